@@ -1,12 +1,15 @@
 #!/usr/bin/env python
-import requests.exceptions
 
-from libarubacentral import ArubaCentralConfig, ArubaCentralAuth
+from libarubacentral import ArubaCentralConfig, open_profiles
+from libarubacentral_aggregate import ClientAggregator
+from libarubacentral_daemon import query_daemon
+from libarubacentral_metrics import client_putvals, scheduler_putvals, session_stats_putvals, write_lines
+from libarubacentral_scheduler import Scheduler
+from libarubacentral_state import StateStore
+from itertools import islice
 import os
-import time
 import argparse
 import logging
-import datetime
 
 
 tool_description = "This tool is used by collectd to get client count statistics per VC from Aruba Central"
@@ -14,18 +17,35 @@ parser = argparse.ArgumentParser(description=tool_description, add_help=True)
 parser.add_argument("-g", "--group", help ="get clients from this group")
 parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
 parser.add_argument("-D", "--DEBUG", help ="turn on debug mode", action="store_true")
-parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use.")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use. Several profiles can"
+                                            " be polled at once, comma separated, or 'all' for every profile; their"
+                                            " values are then prefixed with the profile name")
 parser.add_argument("-i", "--interval", type=float, help="The interval at which to repeat the statistic (in seconds)")
+parser.add_argument("--socket", help="Read the counts from a running arubacentral_daemon.py on this unix socket"
+                                     " instead of calling the API")
+parser.add_argument("-s", "--stream", help="decode client pages as they are received, one page at a time, to keep"
+                                           " memory use flat (slower than the default parallel page fetch)",
+                    action="store_true")
+parser.add_argument("--state", help="keep the clients of the last poll in this file, so the joined/left/roamed counts"
+                                    " carry over a restart (with several profiles, one file per profile:"
+                                    " <state>.<profile>)")
+parser.add_argument("--stats", help="Also report the API calls of each interval per endpoint (calls, retries,"
+                                    " errors, bytes, cache hits, latency and JSON parse time), and the polls"
+                                    " started late, skipped or overrunning the interval", action="store_true")
+parser.add_argument("--deadline", type=float,
+                    help="Give each poll this many seconds and publish partial counts, marked with their coverage, when"
+                         " not every page came back in time (default: 90%% of the interval, 0 to always wait; not with"
+                         " --stream)")
+parser.add_argument("--page-timeout", type=float, default=90,
+                    help="The most seconds to wait for one page of clients (default: 90)")
+parser.add_argument("--once", help="Poll once and exit, instead of polling every interval", action="store_true")
 args = parser.parse_args()
 
 if args.configpath:
     config_path = args.configpath
 else:
     config_path = './config'
-if args.profile:
-    profile = args.profile
-else:
-    profile = 'Default'
+profiles = ArubaCentralConfig.resolve_profiles(config_path, args.profile)
 
 logging.basicConfig(filename=config_path + "/arubacentral_client.log",
                     filemode='a',
@@ -38,9 +58,6 @@ log = logging.getLogger("arubacentral_client")
 
 group = None
 DEBUG = None
-max_results = 1000  # << hard-coded because this is an Aruba limit
-networks = list()
-swarms = list()
 
 if args.group:
     group = args.group
@@ -50,20 +67,27 @@ if args.DEBUG:
 if DEBUG:
     log.setLevel(logging.DEBUG)
 log.debug("starting arubacentral client counter")
-session = ArubaCentralAuth(ArubaCentralConfig(profile, config_path, DEBUG).read_config())
-log.debug(f"got Session token")
-try:
-    networks = session.get_networks(group=group)
-    log.debug(f"got {len(networks)} networks")
-    swarms = session.get_swarms(group=group)
-    log.debug(f"got {len(swarms)} swarms")
-except RuntimeError as e:
-    print("Request failed: " + str(e))
-    exit(1)
-swarm_id_lookup = {}
-for n in swarms:
-    swarm_id_lookup[n['swarm_id']] = n['name']
-log.debug('finished building swarm lookup')
+# Per profile: its session, swarm lookups, and the clients of its last poll (so each poll only recounts
+# the clients that changed).
+pollers = dict()
+if not args.socket:
+    for profile, session in open_profiles(profiles, config_path, DEBUG).items():
+        log.debug(f"got Session token for {profile}")
+        try:
+            networks = session.get_networks(group=group)
+            log.debug(f"got {len(networks)} networks")
+            swarms = session.get_swarms(group=group)
+            log.debug(f"got {len(swarms)} swarms")
+        except RuntimeError as e:
+            print("Request failed: " + str(e))
+            exit(1)
+        state = StateStore(None if not args.state else args.state if len(profiles) == 1 else f"{args.state}.{profile}")
+        if args.state:
+            state.load()
+        pollers[profile] = {'session': session, 'state': state,
+                            'swarm_id_lookup': {n['swarm_id']: n['name'] for n in swarms},
+                            'swarm_group_lookup': {n['swarm_id']: n.get('group_name') for n in swarms}}
+    log.debug('finished building swarm lookup')
 HOSTNAME = os.environ.get("COLLECTD_HOSTNAME")
 INTERVAL = os.environ.get("COLLECTD_INTERVAL")
 if args.interval:
@@ -76,92 +100,82 @@ if not INTERVAL:
 
 if DEBUG:
     INTERVAL = 5
+DEADLINE = 0.9 * float(INTERVAL) if args.deadline is None else args.deadline
 log.debug(f"running every {INTERVAL} seconds, to host {HOSTNAME}")
-while True:
-    try:
-        start = datetime.datetime.now()
-        page = 1
-        clients = session.get_wifi_clients(group=group, timeout=90)
-        log.debug(f'fetched page {page} of {len(clients)} clients')
-        all_clients = clients
-        while len(clients) == max_results:
-            clients = session.get_wifi_clients(group=group, offset=(page * 1000), timeout=90)
-            all_clients = all_clients + clients
-            log.debug(f'fetched page {page} of {len(clients)} clients, total so far {len(all_clients)}'
-                      f' (offset: {page*1000})')
-            page += 1
-
-        count24 = 0
-        count5 = 0
-        count6 = 0
-        count_os = dict()
-        count_conn = dict()
-        count_sick = 0
-        count_ssid = dict()
-        count_vc = dict()
-        log.debug(f"beginning counts for {len(all_clients)}")
-        client_index = 0
-        for i in all_clients:
-            if 'band' in i and i['band'] == 5:
-                count5 += 1
-            elif 'band' in i and i['band'] == 6:
-                count6 += 1
-            else:
-                count24 += 1
-            if 'os_type' in i and i['os_type'] not in count_os:
-                count_os[i['os_type']] = 0
-            if i['os_type'] == '--':
-                if not 'Unclassified Device' in count_os:
-                    count_os['Unclassified Device'] = 0
-                count_os['Unclassified Device'] += 1
+
+
+def poll(session):
+    poller = pollers[session.profile]
+    if args.stream:
+        stream = session.stream_wifi_clients(group=group, timeout=args.page_timeout, records=True)
+        pages = iter(lambda: list(islice(stream, 1000)), [])
+    elif DEADLINE:
+        sweep = session.sweep_wifi_clients(DEADLINE, group=group, page_budget=args.page_timeout)
+        if not sweep.complete:
+            # Count what came back, but leave the state alone: the clients of the missing pages didn't leave.
+            log.warning(f"{session.profile}: {len(sweep.errors)} pages of clients missing at the deadline, "
+                        f"reporting partial counts")
+            aggregator = ClientAggregator(poller['swarm_id_lookup'], poller['swarm_group_lookup'])
+            for page in sweep.pages:
+                aggregator.add(page)
+            counts = aggregator.result()
+            counts['coverage'] = sweep.coverage
+            return counts
+        pages = sweep.pages
+    else:
+        pages = session.iter_all_wifi_clients(group=group, timeout=args.page_timeout)
+
+    log.debug(f"beginning counts for {session.profile}")
+    state = poller['state']
+    first_poll = state.updated['clients'] is None
+    changes = state.update_clients(pages, poller['swarm_id_lookup'], poller['swarm_group_lookup'])
+    counts = state.client_counts()
+    if args.state:
+        state.save()
+    if not first_poll:
+        counts['changes'] = {key: len(changes[key]) for key in ('joined', 'left', 'roamed')}
+    if DEADLINE and not args.stream:
+        counts['coverage'] = 1.0
+    return counts
+
+
+# The API stats at the last report, per profile (--stats)
+previous_stats = dict()
+scheduler = Scheduler()
+
+
+def report(profile):
+    # The polling job of a profile
+    tag = f"{profile}_" if len(profiles) > 1 else ""
+
+    def job():
+        try:
+            if args.socket:
+                counts = query_daemon(args.socket, 'clients', max_age=3 * float(INTERVAL),
+                                      profile=profile if len(profiles) > 1 else None)['data']
+                # The daemon's changes are between its own polls, not ours.
+                counts.pop('changes', None)
             else:
-                count_os[i['os_type']] += 1
-            if 'connection' in i:
-                for c in i['connection'].split(', '):
-                    if c not in count_conn:
-                        count_conn[c] = 0
-                    count_conn[c] += 1
-            if 'health' in i and i['health'] < 75:
-                count_sick += 1
-            if 'network' in i and i['network']:
-                if i['network'] not in count_ssid:
-                    count_ssid[i['network']] = 0
-                count_ssid[i['network']] += 1
-            if 'swarm_id' in i and i['swarm_id'] and swarm_id_lookup.get(i['swarm_id']):
-                vc = swarm_id_lookup[i['swarm_id']]
-                if vc not in count_vc:
-                    count_vc[vc] = 0
-                count_vc[vc] += 1
-            elif 'group' in i and i['group']:
-                group_name = i['group']
-                if group_name not in count_vc:
-                    count_vc[group_name] = 0
-                count_vc[group_name] += 1
-            elif 'group_name' in i and i['group_name']:
-                group_name = i['group_name']
-                if group_name not in count_vc:
-                    count_vc[group_name] = 0
-                count_vc[group_name] += 1
-            client_index += 1
-            if client_index > 0 and client_index % 1000 == 0:
-                log.debug(f"counted {client_index} clients so far...")
-        print(f'PUTVAL "{HOSTNAME}/exec-aruba_all_clients/gauge-arubatotal" interval={INTERVAL} N:{len(all_clients)}')
-        print(f'PUTVAL "{HOSTNAME}/exec-aruba_sick_clients/gauge-arubasick" interval={INTERVAL} N:{count_sick}')
-        for key, value in count_os.items():
-            print(f'PUTVAL "{HOSTNAME}/exec-os_aruba_{key.replace("/","").replace(" ", "")}_clients/gauge-arubaos" interval={INTERVAL} N:{value}')
-        for key, value in count_ssid.items():
-            print(f'PUTVAL "{HOSTNAME}/exec-ssid_aruba_{key}_clients/gauge-arubassid" interval={INTERVAL} N:{value}')
-        for key, value in count_vc.items():
-            print(f'PUTVAL "{HOSTNAME}/exec-vc_aruba_{key}_clients/gauge-arubavc" interval={INTERVAL} N:{value}')
-        for key, value in count_conn.items():
-            print(f'PUTVAL "{HOSTNAME}/exec-connection_aruba_{key}_clients/gauge-arubaconn" interval={INTERVAL} N:{value}')
-        print(f'PUTVAL "{HOSTNAME}/exec-aruba_5g_clients/gauge-arubaband" interval={INTERVAL} N:{count5}')
-        print(f'PUTVAL "{HOSTNAME}/exec-aruba_6g_clients/gauge-arubaband" interval={INTERVAL} N:{count6}')
-        print(f'PUTVAL "{HOSTNAME}/exec-aruba_24g_clients/gauge-arubaband" interval={INTERVAL} N:{count24}')
-    except RuntimeError as e:
-        print("Request failed: " + str(e))
-    except requests.exceptions.Timeout as f:
-        print("Request failed: " + str(f))
-    elapsed = datetime.datetime.now() - start
-    if elapsed.seconds < INTERVAL:
-        time.sleep(float(INTERVAL-elapsed.seconds))
+                counts = poll(pollers[profile]['session'])
+        except Exception as e:
+            log.error(f"poll of {profile} failed: {str(e)}")
+            print(f"Request failed for {profile}: " + str(e))
+            return
+        lines = client_putvals(counts, HOSTNAME, INTERVAL, tag=tag)
+        if args.stats:
+            if not args.socket:
+                lines += session_stats_putvals(pollers[profile]['session'], previous_stats, HOSTNAME, INTERVAL,
+                                               tag=tag)
+            lines += scheduler_putvals({f"clients_{profile}": scheduler.stats()[f"clients_{profile}"]}, HOSTNAME,
+                                       INTERVAL)
+        write_lines(lines)
+    return job
+
+
+# Every profile on the same interval grid, spread over the interval, and never two polls of a profile at once
+for profile in profiles:
+    scheduler.add(f"clients_{profile}", float(INTERVAL), report(profile))
+if args.once:
+    scheduler.run_once()
+else:
+    scheduler.run(first_now=True)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+from libarubacentral import ArubaCentralConfig, open_profiles
+from libarubacentral_daemon import Collector, CollectorServer
+from libarubacentral_scheduler import Scheduler
+from libarubacentral_state import StateStore
+import argparse
+import logging
+import os
+import threading
+
+tool_description = "This tool polls Aruba Central once per interval for every metric family and serves the results" \
+                   " to the nagios and collectd scripts (--socket) over a unix socket"
+parser = argparse.ArgumentParser(description=tool_description, add_help=True)
+parser.add_argument("-g", "--group", help ="only poll this group")
+parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
+parser.add_argument("-D", "--DEBUG", help ="turn on debug mode", action="store_true")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use. Several profiles can"
+                                            " be polled at once, comma separated, or 'all' for every profile")
+parser.add_argument("-i", "--interval", type=float, help="The interval at which to poll (in seconds, default: 60)")
+parser.add_argument("-s", "--socket", help="The unix socket to serve results on"
+                                           " (default: <configpath>/arubacentral.sock)")
+parser.add_argument("-f", "--families", help="Comma separated metric families to poll"
+                                             f" (default: {','.join(Collector.FAMILIES)})")
+parser.add_argument("-S", "--state", help="Keep the APs and clients of the last poll in this file, so the changes"
+                                          " reported after a restart are relative to the last poll before it"
+                                          " (with several profiles, one file per profile: <state>.<profile>)")
+parser.add_argument("--deadline", type=float,
+                    help="Give each poll this many seconds and publish partial counts, marked with their coverage, when"
+                         " not every page came back in time (default: 90%% of the interval, 0 to always wait)")
+args = parser.parse_args()
+
+if args.configpath:
+    config_path = args.configpath
+else:
+    config_path = './config'
+profiles = ArubaCentralConfig.resolve_profiles(config_path, args.profile)
+if args.socket:
+    socket_path = args.socket
+else:
+    socket_path = config_path + "/arubacentral.sock"
+
+INTERVAL = args.interval or os.environ.get("COLLECTD_INTERVAL") or 60
+DEADLINE = 0.9 * float(INTERVAL) if args.deadline is None else args.deadline
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+                    level=logging.DEBUG if args.DEBUG else logging.INFO)
+log = logging.getLogger("arubacentral_daemon")
+
+collectors = dict()
+for profile, session in open_profiles(profiles, config_path, args.DEBUG).items():
+    state = None
+    if args.state:
+        state = StateStore(args.state if len(profiles) == 1 else f"{args.state}.{profile}")
+        state.load()
+    collectors[profile] = Collector(session, group=args.group,
+                                    families=args.families.split(',') if args.families else None, state=state,
+                                    deadline=DEADLINE)
+# Every profile polls on the same interval grid, spread over the interval, each poll in its own thread with
+# its own token, rate limiter and connections, and never two polls of a profile at once.
+scheduler = Scheduler()
+for profile, collector in collectors.items():
+    scheduler.add(f"poll_{profile}", float(INTERVAL), collector.poll)
+server = CollectorServer(socket_path, collectors, scheduler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+log.info(f"serving {', '.join(Collector.FAMILIES if not args.families else args.families.split(','))} of"
+         f" {', '.join(profiles)} on {socket_path}, polling every {INTERVAL} seconds")
+try:
+    scheduler.run(first_now=True)
+finally:
+    server.server_close()
+    os.unlink(socket_path)
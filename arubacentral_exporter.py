@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+from libarubacentral import ArubaCentralConfig, open_profiles, poll_profiles
+from libarubacentral_daemon import Collector, query_daemon
+from libarubacentral_metrics import MetricsServer, render_api_stats, render_prometheus, render_scheduler_stats
+from libarubacentral_scheduler import Scheduler
+from libarubacentral_state import StateStore
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+tool_description = "This tool serves the Aruba Central client and AP statistics to Prometheus: it polls once per" \
+                   " interval and answers every scrape from the metrics of the last poll"
+parser = argparse.ArgumentParser(description=tool_description, add_help=True)
+parser.add_argument("-g", "--group", help ="only poll this group")
+parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
+parser.add_argument("-D", "--DEBUG", help ="turn on debug mode", action="store_true")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use. Several profiles can"
+                                            " be polled at once, comma separated, or 'all' for every profile")
+parser.add_argument("-i", "--interval", type=float, help="The interval at which to poll (in seconds, default: 60)")
+parser.add_argument("-l", "--listen", default="0.0.0.0:9811",
+                    help="The address and port to serve /metrics on (default: 0.0.0.0:9811)")
+parser.add_argument("-S", "--state", help="Keep the APs and clients of the last poll in this file, so the changes"
+                                          " reported after a restart are relative to the last poll before it"
+                                          " (with several profiles, one file per profile: <state>.<profile>)")
+parser.add_argument("--socket", help="Read the counts from a running arubacentral_daemon.py on this unix socket"
+                                     " instead of calling the API")
+parser.add_argument("--deadline", type=float,
+                    help="Give each poll this many seconds and publish partial counts, marked with their coverage, when"
+                         " not every page came back in time (default: 90%% of the interval, 0 to always wait)")
+parser.add_argument("--once", help="Poll once, print the metrics to stdout and exit (e.g. for the node exporter's"
+                                   " textfile collector)", action="store_true")
+args = parser.parse_args()
+
+if args.configpath:
+    config_path = args.configpath
+else:
+    config_path = './config'
+profiles = ArubaCentralConfig.resolve_profiles(config_path, args.profile)
+
+INTERVAL = args.interval or os.environ.get("COLLECTD_INTERVAL") or 60
+DEADLINE = 0.9 * float(INTERVAL) if args.deadline is None else args.deadline
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+                    level=logging.DEBUG if args.DEBUG else logging.INFO)
+log = logging.getLogger("arubacentral_exporter")
+
+collectors = dict()
+if not args.socket:
+    for profile, session in open_profiles(profiles, config_path, args.DEBUG).items():
+        state = None
+        if args.state:
+            state = StateStore(args.state if len(profiles) == 1 else f"{args.state}.{profile}")
+            state.load()
+        collectors[profile] = Collector(session, group=args.group, families=('aps', 'clients'), state=state,
+                                       deadline=DEADLINE)
+
+server = None
+if not args.once:
+    host, port = args.listen.rsplit(':', 1)
+    server = MetricsServer((host, int(port)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"serving the metrics of {', '.join(profiles)} on http://{args.listen}/metrics, polling every"
+             f" {INTERVAL} seconds")
+
+
+def collect(collector):
+    collector.poll()
+    results = {family: (collector.get(family) or dict()).get('data') for family in ('aps', 'clients')}
+    results['api_stats'] = collector.session.api_stats()
+    return results
+
+
+def query(profile):
+    results = dict()
+    for family in ('aps', 'clients', 'api_stats'):
+        try:
+            results[family] = query_daemon(args.socket, family, max_age=3 * float(INTERVAL),
+                                           profile=profile if len(profiles) > 1 else None)['data']
+        except RuntimeError as e:
+            log.error(f"{family} of {profile}: {str(e)}")
+    return results
+
+
+def export():
+    start = time.time()
+    if args.socket:
+        results = {profile: query(profile) for profile in profiles}
+    else:
+        results, errors = poll_profiles(collectors, collect)
+        for profile, error in errors.items():
+            log.error(f"poll of {profile} failed: {str(error)}")
+    # Rendered once here, and served as these bytes to every scrape until the next poll
+    body = render_prometheus(results) + render_api_stats({profile: data['api_stats']
+                                                          for profile, data in results.items()
+                                                          if data.get('api_stats')})
+    if server:
+        server.update(body + render_scheduler_stats(scheduler.stats()), poll_seconds=time.time() - start)
+    else:
+        sys.stdout.buffer.write(body)
+        sys.stdout.flush()
+
+
+scheduler = Scheduler()
+scheduler.add('exporter', float(INTERVAL), export)
+if args.once:
+    scheduler.run_once()
+else:
+    try:
+        scheduler.run(first_now=True)
+    finally:
+        server.server_close()
@@ -1,10 +1,11 @@
 #!/usr/bin/env python
 
-from libarubacentral import ArubaCentralConfig, ArubaCentralAuth
+from libarubacentral import ArubaCentralConfig, open_profiles
+from libarubacentral_daemon import query_daemon
+from libarubacentral_metrics import coverage_putval, putval, scheduler_putvals, session_stats_putvals, write_lines
+from libarubacentral_scheduler import Scheduler
 import os
-import time
 import argparse
-import threading
 
 tool_description = "This tool is used by collectd to get client count statistics per network from Aruba Central"
 parser = argparse.ArgumentParser(description=tool_description, add_help=True)
@@ -12,17 +13,25 @@ parser.add_argument("-g", "--group", help ="get networks from this group")
 parser.add_argument("-n", "--network", help ="get client count for a single network")
 parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
 parser.add_argument("-D", "--DEBUG", help ="turn on debug mode", action="store_true")
-parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use.")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use. Several profiles can"
+                                            " be polled at once, comma separated, or 'all' for every profile; their"
+                                            " values are then prefixed with the profile name")
+parser.add_argument("--socket", help="Read the counts from a running arubacentral_daemon.py on this unix socket"
+                                     " instead of calling the API")
+parser.add_argument("--stats", help="Also report the API calls of each interval per endpoint (calls, retries,"
+                                    " errors, bytes, cache hits, latency and JSON parse time), and the polls"
+                                    " started late, skipped or overrunning the interval", action="store_true")
+parser.add_argument("--deadline", type=float,
+                    help="Give each poll this many seconds and publish partial counts, marked with their coverage, when"
+                         " not every count came back in time (default: 90%% of the interval, 0 to always wait)")
+parser.add_argument("--once", help="Poll once and exit, instead of polling every interval", action="store_true")
 args = parser.parse_args()
 
 if args.configpath:
     config_path = args.configpath
 else:
     config_path = './config'
-if args.profile:
-    profile = args.profile
-else:
-    profile = 'Default'
+profiles = ArubaCentralConfig.resolve_profiles(config_path, args.profile)
 
 group = None
 network = None
@@ -35,12 +44,8 @@ if args.network:
 if args.DEBUG:
     DEBUG = True
 
-session = ArubaCentralAuth(ArubaCentralConfig(profile, config_path).read_config())
-
-if network:
-    networks = {'essid': network}
-else:
-    networks = session.get_networks(group=group)
+if not args.socket:
+    sessions = open_profiles(profiles, config_path)
 
 HOSTNAME = os.environ.get("COLLECTD_HOSTNAME")
 INTERVAL = os.environ.get("COLLECTD_INTERVAL")
@@ -52,13 +57,56 @@ if not INTERVAL:
 
 if DEBUG:
     INTERVAL = 5
+DEADLINE = 0.9 * float(INTERVAL) if args.deadline is None else args.deadline
+
+def get_ssid_counts(session):
+    # ({SSID: clients}, coverage of the counts or None)
+    if network:
+        return {network: session.get_client_count(network=network, group=group)}, None
+    counts = session.get_client_counts(group=group, deadline=DEADLINE or None, kinds=('network',))
+    return counts['network'], counts['coverage'] if DEADLINE else None
+
 
-def print_interval():
-    threading.Timer(INTERVAL, print_interval).start()
-    for ssid in networks:
-        name = ssid['essid']
-        count = session.get_wifi_clients(network=name, count_only=True)
-        print(f'PUTVAL "{HOSTNAME}/exec-ssid_aruba_{name}_clients/gauge-arubassid" interval={INTERVAL} N:{count}')
-    time.sleep(int(float(INTERVAL)))
+# The API stats at the last report, per profile (--stats)
+previous_stats = dict()
+scheduler = Scheduler()
 
-print_interval()
\ No newline at end of file
+
+def report(profile):
+    # The polling job of a profile
+    tag = f"{profile}_" if len(profiles) > 1 else ""
+
+    def job():
+        coverage = None
+        try:
+            if args.socket:
+                ssid_counts = query_daemon(args.socket, 'ssid_counts', max_age=3 * float(INTERVAL),
+                                           profile=profile if len(profiles) > 1 else None)['data']
+                if network:
+                    ssid_counts = {network: ssid_counts.get(network, 0)}
+            else:
+                ssid_counts, coverage = get_ssid_counts(sessions[profile])
+        except Exception as e:
+            print(f"Request failed for {profile}: " + str(e))
+            return
+        lines = list()
+        for name, count in ssid_counts.items():
+            lines.append(putval(HOSTNAME, f"{tag}ssid_aruba_{name}_clients", "arubassid", INTERVAL, count))
+        if coverage is not None:
+            lines.append(coverage_putval(HOSTNAME, f"{tag}ssid_aruba", INTERVAL, coverage))
+        if args.stats:
+            if not args.socket:
+                lines += session_stats_putvals(sessions[profile], previous_stats, HOSTNAME, INTERVAL, tag=tag)
+            lines += scheduler_putvals({f"ssid_{profile}": scheduler.stats()[f"ssid_{profile}"]}, HOSTNAME,
+                                       INTERVAL)
+        write_lines(lines)
+    return job
+
+
+# Every profile on the same interval grid, spread over the interval, and never two polls of a profile at once
+for profile in profiles:
+    scheduler.add(f"ssid_{profile}", float(INTERVAL), report(profile))
+if args.once:
+    scheduler.run_once()
+else:
+    scheduler.run(first_now=True)
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
-from libarubacentral import ArubaCentralConfig, ArubaCentralAuth
+from libarubacentral import ArubaCentralConfig, open_profiles
+from libarubacentral_daemon import query_daemon
+from libarubacentral_metrics import coverage_putval, putval, scheduler_putvals, session_stats_putvals, write_lines
+from libarubacentral_scheduler import Scheduler
 import os
-import time
 import argparse
 
 tool_description = "This tool is used by collectd to get client count statistics per VC from Aruba Central"
@@ -10,17 +12,25 @@ parser = argparse.ArgumentParser(description=tool_description, add_help=True)
 parser.add_argument("-g", "--group", help ="get clients from this group")
 parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
 parser.add_argument("-D", "--DEBUG", help ="turn on debug mode", action="store_true")
-parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use.")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use. Several profiles can"
+                                            " be polled at once, comma separated, or 'all' for every profile; their"
+                                            " values are then prefixed with the profile name")
+parser.add_argument("--socket", help="Read the counts from a running arubacentral_daemon.py on this unix socket"
+                                     " instead of calling the API")
+parser.add_argument("--stats", help="Also report the API calls of each interval per endpoint (calls, retries,"
+                                    " errors, bytes, cache hits, latency and JSON parse time), and the polls"
+                                    " started late, skipped or overrunning the interval", action="store_true")
+parser.add_argument("--deadline", type=float,
+                    help="Give each poll this many seconds and publish partial counts, marked with their coverage, when"
+                         " not every count came back in time (default: 90%% of the interval, 0 to always wait)")
+parser.add_argument("--once", help="Poll once and exit, instead of polling every interval", action="store_true")
 args = parser.parse_args()
 
 if args.configpath:
     config_path = args.configpath
 else:
     config_path = './config'
-if args.profile:
-    profile = args.profile
-else:
-    profile = 'Default'
+profiles = ArubaCentralConfig.resolve_profiles(config_path, args.profile)
 
 group = None
 DEBUG = None
@@ -30,9 +40,8 @@ if args.group:
 if args.DEBUG:
     DEBUG = True
 
-session = ArubaCentralAuth(ArubaCentralConfig(profile, config_path).read_config())
-
-vcs = session.get_vcs(group=group)
+if not args.socket:
+    sessions = open_profiles(profiles, config_path)
 HOSTNAME = os.environ.get("COLLECTD_HOSTNAME")
 INTERVAL = os.environ.get("COLLECTD_INTERVAL")
 
@@ -43,10 +52,47 @@ if not INTERVAL:
 
 if DEBUG:
     INTERVAL = 5
+DEADLINE = 0.9 * float(INTERVAL) if args.deadline is None else args.deadline
+
+# The API stats at the last report, per profile (--stats)
+previous_stats = dict()
+scheduler = Scheduler()
+
 
-while True:
-    for vc in vcs:
-        name = vc['name']
-        count = session.get_wifi_clients(vc=name, count_only=True)
-        print(f'PUTVAL "{HOSTNAME}/exec-vc_aruba_{name}_clients/gauge-arubavc" interval={INTERVAL} N:{count}')
-    time.sleep(int(float(INTERVAL)))
+def report(profile):
+    # The polling job of a profile
+    tag = f"{profile}_" if len(profiles) > 1 else ""
+
+    def job():
+        counts = dict()
+        try:
+            if args.socket:
+                vc_counts = query_daemon(args.socket, 'vc_counts', max_age=3 * float(INTERVAL),
+                                         profile=profile if len(profiles) > 1 else None)['data']
+            else:
+                counts = sessions[profile].get_client_counts(group=group, deadline=DEADLINE or None,
+                                                             kinds=('vc',))
+                vc_counts = counts['vc']
+        except Exception as e:
+            print(f"Request failed for {profile}: " + str(e))
+            return
+        lines = list()
+        for name, count in vc_counts.items():
+            lines.append(putval(HOSTNAME, f"{tag}vc_aruba_{name}_clients", "arubavc", INTERVAL, count))
+        if DEADLINE and 'coverage' in counts:
+            lines.append(coverage_putval(HOSTNAME, f"{tag}vc_aruba", INTERVAL, counts['coverage']))
+        if args.stats:
+            if not args.socket:
+                lines += session_stats_putvals(sessions[profile], previous_stats, HOSTNAME, INTERVAL, tag=tag)
+            lines += scheduler_putvals({f"vc_{profile}": scheduler.stats()[f"vc_{profile}"]}, HOSTNAME, INTERVAL)
+        write_lines(lines)
+    return job
+
+
+# Every profile on the same interval grid, spread over the interval, and never two polls of a profile at once
+for profile in profiles:
+    scheduler.add(f"vc_{profile}", float(INTERVAL), report(profile))
+if args.once:
+    scheduler.run_once()
+else:
+    scheduler.run(first_now=True)
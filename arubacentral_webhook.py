@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+from libarubacentral import ArubaCentralAuth, ArubaCentralConfig, find_swarm
+from libarubacentral_nagios import evaluate_checks, write_command_file, write_spool_dir
+from libarubacentral_scheduler import Scheduler
+from libarubacentral_webhook import ApStatusMap, WebhookServer, ap_event
+import argparse
+import logging
+import threading
+import time
+
+tool_description = "This tool receives Aruba Central's AP up/down webhooks and submits the batch checks of the" \
+                   " affected VCs and groups to nagios as passive checks as soon as an AP goes down or comes back," \
+                   " with a full AP sync every so often to catch missed alerts"
+parser = argparse.ArgumentParser(description=tool_description, add_help=True)
+parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use.")
+parser.add_argument("-D", "--DEBUG", help ="turn on debug mode", action="store_true")
+parser.add_argument("-l", "--listen", default="0.0.0.0:9812",
+                    help="The address and port to receive the webhooks on (default: 0.0.0.0:9812)")
+parser.add_argument("-B", "--batch", default="checks.yml",
+                    help="The checks file with the VCs and groups to submit results for (default: checks.yml)")
+parser.add_argument("--command-file", help="Write results to this nagios external command file")
+parser.add_argument("--spool-dir", help="Write results to this nagios check result directory")
+parser.add_argument("-W", "--warn", type=int, default=1,
+                    help="Warning Threshold for number of APs down, for checks without their own (default: 1)")
+parser.add_argument("-C", "--crit", type=int, default=5,
+                    help="Critical Threshold for number of APs down, for checks without their own (default: 5)")
+parser.add_argument("--sync-interval", type=float, default=3600,
+                    help="Seconds between full AP syncs, which correct any missed alerts (default: 3600)")
+args = parser.parse_args()
+
+if args.configpath:
+    config_path = args.configpath
+else:
+    config_path = './config'
+if args.profile:
+    profile = args.profile
+else:
+    profile = 'Default'
+if not args.command_file and not args.spool_dir:
+    print("Please give --command-file or --spool-dir to submit the results to")
+    exit(1)
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+                    level=logging.DEBUG if args.DEBUG else logging.INFO)
+log = logging.getLogger("arubacentral_webhook")
+
+config = ArubaCentralConfig(profile, config_path)
+cfgdata = config.read_config()
+if not cfgdata.get('webhook_token'):
+    print(f"Please set webhook_token in profile {profile} of config.yml to the token of the Central webhook")
+    exit(1)
+session = ArubaCentralAuth(cfgdata)
+checks = [check for check in config.read_checks(args.batch) if (check.get('profile') or profile) == profile]
+status_map = ApStatusMap()
+# The swarms of the last sync by lowercase name, to resolve the vc of the checks without an API call
+swarm_index = dict()
+submit_lock = threading.Lock()
+
+
+def get_swarm_id(swarm_name):
+    return find_swarm(swarm_index, swarm_name)['swarm_id']
+
+
+def affects(check, swarm_id, group) -> bool:
+    try:
+        check_swarm_id = check.get('swarm_id') or (get_swarm_id(check['vc']) if check.get('vc') else None)
+    except RuntimeError:
+        return False
+    if not check_swarm_id and not check.get('group'):
+        return False
+    return (not check_swarm_id or check_swarm_id == swarm_id) and (not check.get('group') or check['group'] == group)
+
+
+def submit(submitted_checks):
+    if not submitted_checks:
+        return
+    results = evaluate_checks(submitted_checks, status_map.counts(), get_swarm_id, warn=args.warn, crit=args.crit)
+    with submit_lock:
+        if args.command_file:
+            write_command_file(args.command_file, results)
+        if args.spool_dir:
+            write_spool_dir(args.spool_dir, results)
+    log.info(f"submitted {len(results)} check results, {len([r for r in results if r['retcode'] != 0])} not OK")
+
+
+def sync():
+    # A full AP sweep: submit the checks of every location whose counts changed (all of them the first time)
+    global swarm_index
+    first_sync = status_map.synced is None
+    started = time.time()
+    # Swapped in whole: alerts handled meanwhile look VCs up in the old index or the new one, never a half one
+    swarm_index = {swarm['name'].lower(): swarm for swarm in session.get_swarms()}
+    changed = status_map.sync((ap for page in session.iter_all_aps() for ap in page), started=started)
+    if first_sync:
+        submit(checks)
+    else:
+        submit([check for check in checks if any(affects(check, swarm_id, group) for swarm_id, group in changed)])
+    log.info(f"synced, {len(changed)} locations changed since the last sync")
+
+
+def on_alert(alert):
+    event = ap_event(alert)
+    if event is None:
+        log.debug(f"ignoring {alert.get('alert_type')} alert")
+        return
+    serial, down = event
+    location = status_map.set_down(serial, down)
+    if location is None:
+        log.debug(f"AP {serial} {'down' if down else 'up'}: unknown or unchanged, left for the next sync")
+        return
+    log.info(f"AP {serial} {'went down' if down else 'came back'}")
+    submit([check for check in checks if affects(check, *location)])
+
+
+host, port = args.listen.rsplit(':', 1)
+server = WebhookServer((host, int(port)), cfgdata['webhook_token'], status_map, on_alert)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+log.info(f"receiving webhooks for {len(checks)} checks of {profile} on http://{args.listen}/, syncing every"
+         f" {args.sync_interval} seconds")
+scheduler = Scheduler()
+scheduler.add('sync', args.sync_interval, sync)
+try:
+    scheduler.run(first_now=True)
+finally:
+    server.server_close()
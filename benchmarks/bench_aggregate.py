@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Compare the per-client counting loop arubacentral_client.py used to run with ClientAggregator, on
+# synthetic campus data.
+#
+#   python benchmarks/bench_aggregate.py -n 50000
+#
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libarubacentral_aggregate import aggregate_clients
+from synthetic import make_swarms, make_aps, make_clients
+
+
+def loop_counts(all_clients, swarm_id_lookup):
+    # The original counting loop from arubacentral_client.py
+    count24 = 0
+    count5 = 0
+    count6 = 0
+    count_os = dict()
+    count_conn = dict()
+    count_sick = 0
+    count_ssid = dict()
+    count_vc = dict()
+    for i in all_clients:
+        if 'band' in i and i['band'] == 5:
+            count5 += 1
+        elif 'band' in i and i['band'] == 6:
+            count6 += 1
+        else:
+            count24 += 1
+        if 'os_type' in i and i['os_type'] not in count_os:
+            count_os[i['os_type']] = 0
+        if i['os_type'] == '--':
+            if not 'Unclassified Device' in count_os:
+                count_os['Unclassified Device'] = 0
+            count_os['Unclassified Device'] += 1
+        else:
+            count_os[i['os_type']] += 1
+        if 'connection' in i:
+            for c in i['connection'].split(', '):
+                if c not in count_conn:
+                    count_conn[c] = 0
+                count_conn[c] += 1
+        if 'health' in i and i['health'] < 75:
+            count_sick += 1
+        if 'network' in i and i['network']:
+            if i['network'] not in count_ssid:
+                count_ssid[i['network']] = 0
+            count_ssid[i['network']] += 1
+        if 'swarm_id' in i and i['swarm_id'] and swarm_id_lookup.get(i['swarm_id']):
+            vc = swarm_id_lookup[i['swarm_id']]
+            if vc not in count_vc:
+                count_vc[vc] = 0
+            count_vc[vc] += 1
+        elif 'group' in i and i['group']:
+            group_name = i['group']
+            if group_name not in count_vc:
+                count_vc[group_name] = 0
+            count_vc[group_name] += 1
+        elif 'group_name' in i and i['group_name']:
+            group_name = i['group_name']
+            if group_name not in count_vc:
+                count_vc[group_name] = 0
+            count_vc[group_name] += 1
+    count_os.pop('--', None)
+    return {'total': len(all_clients), 'sick': count_sick, 'band': {'2.4': count24, '5': count5, '6': count6},
+            'os': count_os, 'connection': count_conn, 'ssid': count_ssid, 'vc': count_vc}
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark client statistics aggregation")
+    parser.add_argument("-n", "--clients", type=int, default=50000, help="number of synthetic clients")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs per implementation, best is reported")
+    args = parser.parse_args()
+
+    swarms = make_swarms()
+    clients = make_clients(make_aps(swarms), count=args.clients)
+    swarm_names = {swarm['swarm_id']: swarm['name'] for swarm in swarms}
+
+    loop_time, expected = best_of(args.repeat, loop_counts, clients, swarm_names)
+    aggregator_time, result = best_of(args.repeat, aggregate_clients, clients, swarm_names)
+    for key, value in expected.items():
+        if result[key] != value:
+            print(f"MISMATCH in {key}: {result[key]} != {value}")
+            exit(1)
+    print(f"{args.clients} clients, best of {args.repeat}")
+    print(f"  per-client loop:  {loop_time * 1000:8.1f} ms")
+    print(f"  ClientAggregator: {aggregator_time * 1000:8.1f} ms  ({loop_time / aggregator_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
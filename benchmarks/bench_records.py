@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Memory held by a decoded client sweep as JSON dicts, and as the slotted records of
+# libarubacentral_records.py, on synthetic campus data. Both are decoded from the same JSON text, the way
+# the API returns it, so neither shares strings with the generator.
+#
+#   python benchmarks/bench_records.py -n 30000
+#
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libarubacentral import iter_json_array
+from libarubacentral_records import AP, WirelessClient
+from synthetic import make_swarms, make_aps, make_clients
+
+
+def measure(func, *args):
+    # Memory still held by the result of func, and the peak while building it, in bytes
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def as_dicts(text, key):
+    return json.loads(text)[key]
+
+
+def as_records(body, key, record_type):
+    # Decoded 64 KiB at a time, as _stream_pages does, so no page of dicts is ever held at once
+    chunks = (body[offset:offset + 65536] for offset in range(0, len(body), 65536))
+    return [record_type.from_json(item) for item in iter_json_array(chunks, key)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory use of JSON dicts and slotted records")
+    parser.add_argument("-n", "--clients", type=int, default=30000, help="number of synthetic clients")
+    args = parser.parse_args()
+
+    swarms = make_swarms()
+    aps = make_aps(swarms)
+    samples = (('APs', 'aps', AP, json.dumps({'aps': aps})),
+               ('clients', 'clients', WirelessClient,
+                json.dumps({'clients': make_clients(aps, count=args.clients)})))
+    for label, key, record_type, text in samples:
+        dicts, dict_size, dict_peak = measure(as_dicts, text, key)
+        del dicts
+        records, record_size, record_peak = measure(as_records, text.encode(), key, record_type)
+        print(f"{len(records)} {label}, {len(text) / 2 ** 20:.1f} MiB of JSON")
+        print(f"  dicts:    {dict_size / 2 ** 20:8.1f} MiB held, {dict_peak / 2 ** 20:8.1f} MiB peak")
+        print(f"  records:  {record_size / 2 ** 20:8.1f} MiB held, {record_peak / 2 ** 20:8.1f} MiB peak"
+              f"  ({dict_size / record_size:.1f}x smaller)")
+        del records
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# End to end run of every entry script against mock_central.py, for synthetic campuses of the given sizes:
+# wall time (best and mean of the runs), API calls per run (counted by the mock) and the peak RSS of the
+# script's process. Every call goes to the mock (no response cache in the config), so these are the numbers
+# of a cold poll; the first case logs in with the OAuth flow on every run, the others reuse its token.
+#
+#   python benchmarks/bench_scripts.py --clients 10000 50000 200000 -r 3 --latency 0.05
+#
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+
+from mock_central import MockCentral
+
+CONFIG = """Default:
+  region: Bench
+  customer_id: 1
+  client_id: bench
+  client_secret: bench
+  user_account: bench
+"""
+
+
+def make_config(path, url, central, checks=200):
+    os.makedirs(path + "/tokens")
+    os.makedirs(path + "/spool")
+    with open(path + "/config.yml", 'w') as file:
+        file.write(CONFIG)
+    with open(path + "/accounts.yml", 'w') as file:
+        file.write("bench:\n  username: bench\n  password: bench\n")
+    with open(path + "/regions.yml", 'w') as file:
+        file.write(f"Bench:\n  url: {url}\n")
+    with open(path + "/checks.yml", 'w') as file:
+        file.write("checks:\n")
+        for swarm in central.swarms[:checks]:
+            file.write(f"  - {{host: {swarm['name']}, service: APs, vc: {swarm['name']}}}\n")
+
+
+def run(command, central):
+    # (seconds, API calls, peak RSS in bytes, exit code, last line of output) of one run of command
+    calls = central.total_calls
+    with tempfile.TemporaryFile() as output:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT, cwd=REPO)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        output.seek(0)
+        lines = output.read().decode(errors='replace').strip().splitlines()
+    # ru_maxrss is in KiB on Linux
+    return seconds, central.total_calls - calls, usage.ru_maxrss * 1024, process.returncode, \
+        lines[-1] if lines else ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the entry scripts against a local mock of Aruba Central")
+    parser.add_argument("--clients", type=int, nargs='+', default=[10000, 50000],
+                        help="campus sizes, in wireless clients (default: 10000 50000)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per case")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock adds to every response")
+    parser.add_argument("--rate-limit", type=float, help="calls per second the mock allows before answering 429")
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        central = MockCentral(clients=clients, latency=args.latency, rate_limit=args.rate_limit)
+        url = central.start()
+        path = tempfile.mkdtemp()
+        try:
+            make_config(path, url, central)
+            vc = central.swarms[0]['name']
+            token = path + "/tokens/Default.token.json"
+
+            def logout():
+                if os.path.exists(token):
+                    os.unlink(token)
+
+            def empty_spool():
+                for name in os.listdir(path + "/spool"):
+                    os.unlink(path + "/spool/" + name)
+
+            python = sys.executable
+            cases = (
+                ("check -V, OAuth login", [python, "check_aruba_vc_aps.py", "-c", path, "-V", vc], logout),
+                ("check -V", [python, "check_aruba_vc_aps.py", "-c", path, "-V", vc], None),
+                ("check -V -T", [python, "check_aruba_vc_aps.py", "-c", path, "-V", vc, "-T", "10"], None),
+                ("check --batch", [python, "check_aruba_vc_aps.py", "-c", path, "--batch", "checks.yml",
+                                   "--spool-dir", path + "/spool"], empty_spool),
+                ("arubacentral_vc --once", [python, "arubacentral_vc.py", "-c", path, "--once"], None),
+                ("arubacentral_ssid --once", [python, "arubacentral_ssid.py", "-c", path, "--once"], None),
+                ("arubacentral_client --once", [python, "arubacentral_client.py", "-c", path, "--once"], None),
+                ("arubacentral_client --once -s", [python, "arubacentral_client.py", "-c", path, "--once", "-s"],
+                 None),
+                ("arubacentral_exporter --once", [python, "arubacentral_exporter.py", "-c", path, "--once"], None),
+            )
+            print(f"{clients} clients, {len(central.aps)} APs, {len(central.swarms)} swarms"
+                  f" (best / mean of {args.repeat} runs)")
+            print(f"  {'':32} {'best s':>8} {'mean s':>8} {'calls':>7} {'peak MiB':>9}")
+            for label, command, before in cases:
+                runs = list()
+                for _ in range(args.repeat):
+                    if before:
+                        before()
+                    runs.append(run(command, central))
+                times = [seconds for seconds, _, _, _, _ in runs]
+                calls = sum(run_calls for _, run_calls, _, _, _ in runs) / len(runs)
+                rss = max(peak for _, _, peak, _, _ in runs)
+                failed = [(code, line) for _, _, _, code, line in runs if code not in (0, 1, 2)]
+                print(f"  {label:32} {min(times):8.2f} {sum(times) / len(times):8.2f} {calls:7.0f}"
+                      f" {rss / 1048576:9.1f}" + (f"   exit {failed[0][0]}: {failed[0][1][:60]}" if failed else ""))
+        finally:
+            central.stop()
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
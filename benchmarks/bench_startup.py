@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Wall time of one check_aruba_vc_aps.py run, answered entirely from the response cache, with the parsed
+# config cache cold (removed before every run) and warm, next to the bare interpreter start. The API URL
+# points at a closed port, so any request that misses the cache shows up as a failed check.
+#
+#   python benchmarks/bench_startup.py -r 20
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+
+from libarubacentral import ArubaCentralAuth
+from libarubacentral_cache import ResponseCache
+from synthetic import make_swarms, make_aps
+
+CONFIG = """Default:
+  region: Bench
+  customer_id: 1
+  client_id: bench
+  client_secret: bench
+  user_account: bench
+  response_cache:
+    ttl:
+      /monitoring/v1/swarms: 86400
+      /monitoring/v1/aps: 86400
+"""
+LOADED = "import runpy, sys\n" \
+         "sys.argv = sys.argv[1:]\n" \
+         "try:\n" \
+         "    runpy.run_path(sys.argv[0], run_name='__main__')\n" \
+         "except SystemExit:\n" \
+         "    pass\n" \
+         "print(' '.join(module for module in ('yaml', 'requests', 'sqlite3') if module in sys.modules))\n"
+
+
+def make_config(path):
+    os.makedirs(path + "/tokens")
+    with open(path + "/config.yml", 'w') as file:
+        file.write(CONFIG)
+    with open(path + "/accounts.yml", 'w') as file:
+        file.write("bench:\n  username: bench\n  password: bench\n")
+    with open(path + "/regions.yml", 'w') as file:
+        file.write("Bench:\n  url: http://127.0.0.1:9\n")
+    with open(path + "/tokens/Default.token.json", 'w') as file:
+        json.dump({'access_token': 'bench', 'refresh_token': 'bench', 'expires_at': time.time() + 86400}, file)
+    swarms = make_swarms()
+    down_aps = [ap for ap in make_aps(swarms[:1], down_ratio=0.3) if ap['status'] == 'Down']
+    cache = ResponseCache(path + "/cache/responses.sqlite")
+    cache.put("Default" + ArubaCentralAuth._swarms_url(limit=1000), json.dumps({'swarms': swarms}))
+    cache.put("Default" + ArubaCentralAuth._aps_url(limit=1000, status='Down', swarm_id=swarms[0]['swarm_id']),
+              json.dumps({'aps': down_aps, 'count': len(down_aps)}))
+    return swarms[0]['name']
+
+
+def run(command, repeat, before=None):
+    times = list()
+    output = None
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, cwd=REPO).stdout.strip()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times), output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nagios plugin startup")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="runs per case")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        vc = make_config(path)
+        check = [sys.executable, "check_aruba_vc_aps.py", "-c", path, "-V", vc]
+        config_cache = path + "/cache/Default.config.json"
+
+        def drop_config_cache():
+            if os.path.exists(config_cache):
+                os.unlink(config_cache)
+
+        cases = (("python -c pass", [sys.executable, "-c", "pass"], None),
+                 ("check, config cache cold", check, drop_config_cache),
+                 ("check, config cache warm", check, None))
+        print(f"best / mean of {args.repeat} runs")
+        for label, command, before in cases:
+            best, mean, output = run(command, args.repeat, before)
+            print(f"  {label:26} {best * 1000:7.1f} / {mean * 1000:7.1f} ms   {output[:60]}")
+        loaded = subprocess.run([sys.executable, "-c", LOADED] + check[1:], capture_output=True, text=True,
+                                cwd=REPO).stdout.strip().splitlines()[-1]
+        print(f"  modules imported by a warm run: {loaded or 'none of yaml, requests, sqlite3'}")
+
+
+if __name__ == '__main__':
+    main()
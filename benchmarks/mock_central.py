@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# A local stand-in for Aruba Central, so the library and the scripts can be run and measured without a live
+# tenant: the OAuth login, authorization code and token (and refresh) calls, and the monitoring and
+# configuration endpoints the scripts use, over a synthetic campus (see synthetic.py).
+#
+#   python benchmarks/mock_central.py --clients 50000 --latency 0.08 --rate-limit 7 --port 8088
+#
+# then point a region at it in regions.yml (url: http://127.0.0.1:8088). Any username, password, client ID
+# and secret are accepted. Pagination follows the API: limit (at most 1000) and offset, with a total for
+# the client list when calculate_total=true. --rate-limit answers calls above that rate with 429s and a
+# Retry-After, like Central, and --fail-ratio answers that share of the calls with a 503.
+#
+import argparse
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libarubacentral_stats import endpoint_template
+from synthetic import NETWORKS, make_aps, make_clients, make_swarms
+
+MAX_LIMIT = 1000
+
+
+class MockCentral:
+    def __init__(self, clients=10000, latency=0.0, latency_per_item=0.0, rate_limit=None, daily_limit=None,
+                 fail_ratio=0.0, clients_per_swarm=250, aps_per_swarm=10, seed=1):
+        self.swarms = make_swarms(max(clients // clients_per_swarm, 1))
+        self.aps = make_aps(self.swarms, per_swarm=aps_per_swarm, seed=seed)
+        self.clients = make_clients(self.aps, count=clients, seed=seed + 1)
+        self.networks = [{'essid': network, 'type': 'Employee', 'security': 'wpa2-enterprise'}
+                         for network in NETWORKS]
+        self.ap_settings = dict()
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.rate_limit = rate_limit
+        self.daily_limit = daily_limit
+        self.fail_ratio = fail_ratio
+        self.calls = Counter()
+        # The most API calls served at the same time, to tell parallel page fetches from sequential ones
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self.tokens = set()
+        self._random = random.Random(seed)
+        self._selections = dict()
+        self._bucket = float(rate_limit or 0)
+        self._bucket_time = time.monotonic()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+    def start(self, host='127.0.0.1', port=0) -> str:
+        self._server = _Server((host, port), _Handler)
+        self._server.central = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def admit(self, method, path):
+        #
+        # (status, headers) for a call before it is served: the rate limits and the injected failures. A status
+        # of None drops the connection without an answer.
+        #
+        with self._lock:
+            self.calls[f"{method} {endpoint_template(path)}"] += 1
+            used = sum(self.calls.values())
+            headers = dict()
+            if self.daily_limit:
+                headers['X-RateLimit-Limit-day'] = str(self.daily_limit)
+                headers['X-RateLimit-Remaining-day'] = str(max(self.daily_limit - used, 0))
+                if used > self.daily_limit:
+                    return 429, headers
+            if self.rate_limit:
+                now = time.monotonic()
+                self._bucket = min(float(self.rate_limit), self._bucket + (now - self._bucket_time) * self.rate_limit)
+                self._bucket_time = now
+                if self._bucket < 1:
+                    headers['X-RateLimit-Remaining-second'] = '0'
+                    headers['Retry-After'] = '1'
+                    return 429, headers
+                self._bucket -= 1
+                headers['X-RateLimit-Remaining-second'] = str(int(self._bucket))
+            if self.fail_ratio and self._random.random() < self.fail_ratio:
+                return 503, headers
+        return 200, headers
+
+    def select(self, kind, filters: tuple) -> list:
+        # The APs, swarms or clients matching the filters, remembered so paging through them stays cheap
+        with self._lock:
+            if (kind, filters) in self._selections:
+                return self._selections[(kind, filters)]
+        items = {'aps': self.aps, 'swarms': self.swarms, 'clients': self.clients}[kind]
+        for field, value in filters:
+            if field == 'band':
+                items = [item for item in items if str(item.get('band')) == value]
+            else:
+                items = [item for item in items if str(item.get(field)) == value]
+        with self._lock:
+            self._selections[(kind, filters)] = items
+        return items
+
+
+# query parameter -> record field, per list endpoint
+FILTERS = {
+    'aps': {'status': 'status', 'swarm_id': 'swarm_id', 'group': 'group_name', 'macaddr': 'macaddr'},
+    'swarms': {'group': 'group_name'},
+    'clients': {'swarm_id': 'swarm_id', 'group': 'group_name', 'network': 'network', 'band': 'band'},
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up on a slow response (timeouts, deadlines) are expected here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _reply(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        central = self.server.central
+        url = urlsplit(self.path)
+        path = url.path
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status, headers = central.admit(method, path)
+        if status is None:
+            # Dropped without an answer, like a connection reset by a proxy
+            self.close_connection = True
+            return
+        if status != 200:
+            return self._reply(status, {'error': 'Too Many Requests' if status == 429 else 'Service Unavailable'},
+                               headers)
+        if path.startswith('/oauth2/'):
+            return self._oauth(path, query, headers)
+        if self.headers.get('Authorization', '')[len('Bearer '):] not in central.tokens:
+            return self._reply(401, {'error': 'invalid_token'}, headers)
+        try:
+            data, items = self._api(method, path, query, body)
+        except LookupError as e:
+            return self._reply(404, {'error': str(e)}, headers)
+        except ValueError as e:
+            return self._reply(400, {'error': str(e)}, headers)
+        with central._lock:
+            central._in_flight += 1
+            central.max_in_flight = max(central.max_in_flight, central._in_flight)
+        try:
+            time.sleep(central.latency + central.latency_per_item * items)
+        finally:
+            with central._lock:
+                central._in_flight -= 1
+        self._reply(200, data, headers)
+
+    def _oauth(self, path, query, headers):
+        central = self.server.central
+        if path == '/oauth2/authorize/central/api/login':
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Set-Cookie', f"csrftoken={secrets.token_hex(8)}; Path=/")
+            self.send_header('Set-Cookie', f"session={secrets.token_hex(8)}; Path=/")
+            self.end_headers()
+            self.wfile.write(b'{}')
+            return
+        if path == '/oauth2/authorize/central/api':
+            return self._reply(200, {'auth_code': secrets.token_hex(8)}, headers)
+        if path == '/oauth2/token':
+            token = secrets.token_hex(16)
+            with central._lock:
+                central.tokens.add(token)
+            return self._reply(200, {'access_token': token, 'refresh_token': secrets.token_hex(16),
+                                     'token_type': 'bearer', 'expires_in': 7200}, headers)
+        return self._reply(404, {'error': f"unknown path {path}"}, headers)
+
+    def _api(self, method, path, query, body):
+        # (response, number of items) for a monitoring or configuration call
+        central = self.server.central
+        parts = path.strip('/').split('/')
+        if path.startswith('/configuration/v2/ap_settings/'):
+            serial = parts[-1]
+            if method == 'POST':
+                central.ap_settings[serial] = json.loads(body or b'{}')
+                return {}, 1
+            ap = next((ap for ap in central.aps if ap['serial'] == serial), None)
+            if ap is None:
+                raise LookupError(f"AP {serial} not found")
+            return central.ap_settings.get(serial) or {'hostname': ap['name'], 'ip_address': '0.0.0.0'}, 1
+        if path == '/monitoring/v1/aps':
+            return self._page('aps', query)
+        if path == '/monitoring/v1/swarms':
+            return self._page('swarms', query)
+        if path == '/monitoring/v1/clients/wireless':
+            return self._page('clients', query)
+        if path == '/monitoring/v1/clients/count':
+            return {'count': len(self._select('clients', query))}, 1
+        if path == '/monitoring/v2/networks':
+            counts = Counter(client['network'] for client in self._select('clients', query))
+            networks = [dict(network, client_count=counts.get(network['essid'], 0)) for network in central.networks]
+            return {'networks': networks, 'count': len(networks)}, len(networks)
+        for prefix, items, key in (('/monitoring/v1/aps/', central.aps, 'serial'),
+                                   ('/monitoring/v1/swarms/', central.swarms, 'swarm_id'),
+                                   ('/monitoring/v1/clients/wireless/', central.clients, 'macaddr'),
+                                   ('/monitoring/v2/networks/', central.networks, 'essid')):
+            if path.startswith(prefix):
+                item = next((item for item in items if item[key] == parts[-1]), None)
+                if item is None:
+                    raise LookupError(f"{parts[-1]} not found")
+                return item, 1
+        raise LookupError(f"unknown path {path}")
+
+    def _select(self, kind, query) -> list:
+        filters = tuple(sorted((field, query[parameter]) for parameter, field in FILTERS[kind].items()
+                               if parameter in query))
+        return self.server.central.select(kind, filters)
+
+    def _page(self, kind, query):
+        limit = int(query.get('limit', 100))
+        if limit > MAX_LIMIT:
+            raise ValueError(f"limit must be at most {MAX_LIMIT}")
+        offset = int(query.get('offset', 0))
+        items = self._select(kind, query)
+        page = items[offset:offset + limit]
+        data = {kind: page, 'count': len(page)}
+        if query.get('calculate_total') == 'true':
+            data['total'] = len(items)
+        return data, len(page)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A local stand-in for the Aruba Central API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--clients", type=int, default=10000, help="Wireless clients on the campus (default: 10000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API response")
+    parser.add_argument("--latency-per-item", type=float, default=0.0,
+                        help="Seconds added per item in a response (pages of 1000 take longer)")
+    parser.add_argument("--rate-limit", type=float, help="Calls per second before answering with 429")
+    parser.add_argument("--daily-limit", type=int, help="Calls in total before answering with 429")
+    parser.add_argument("--fail-ratio", type=float, default=0.0, help="Share of the calls answered with a 503")
+    args = parser.parse_args()
+    central = MockCentral(clients=args.clients, latency=args.latency, latency_per_item=args.latency_per_item,
+                          rate_limit=args.rate_limit, daily_limit=args.daily_limit, fail_ratio=args.fail_ratio)
+    url = central.start(args.host, args.port)
+    print(f"{len(central.swarms)} swarms, {len(central.aps)} APs, {len(central.clients)} clients on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(", ".join(f"{count} {endpoint}" for endpoint, count in central.calls.most_common()))
+        central.stop()
+
+
+if __name__ == '__main__':
+    main()
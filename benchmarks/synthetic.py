@@ -0,0 +1,56 @@
+import random
+
+#
+# Synthetic Aruba Central campus data for the benchmarks: APs in swarms and groups, and wireless clients
+# shaped like the /monitoring/v1/clients/wireless records the scripts read.
+#
+OS_TYPES = ['iOS', 'Android', 'Windows 10', 'Mac OS', 'Chrome OS', 'Linux', '--', 'PlayStation', 'Roku']
+NETWORKS = ['campus', 'campus-guest', 'campus-iot', 'campus-reserved', 'eduroam']
+CONNECTIONS = ['802.11ax', '802.11ac', '802.11n', '802.11ax, 802.11ac', '802.11ac, 802.11n']
+GROUPS = ['Main Campus', 'Residence Halls', 'Athletics', 'Remote Sites']
+
+
+def make_swarms(count=200):
+    return [{'swarm_id': f'{i:032x}', 'name': f'VC-{i:03d}', 'group_name': GROUPS[i % len(GROUPS)],
+             'status': 'Up', 'ip_address': f'10.{i // 250}.{i % 250}.1'}
+            for i in range(count)]
+
+
+def make_aps(swarms, per_swarm=15, down_ratio=0.02, seed=1):
+    rnd = random.Random(seed)
+    aps = list()
+    for swarm in swarms:
+        for i in range(per_swarm):
+            n = len(aps)
+            aps.append({'serial': f'CNK{n:07d}', 'macaddr': f'20:4c:03:{n >> 16 & 255:02x}:{n >> 8 & 255:02x}:{n & 255:02x}',
+                        'name': f"{swarm['name']}-AP{i:02d}", 'swarm_id': swarm['swarm_id'],
+                        'swarm_name': swarm['name'], 'group_name': swarm['group_name'],
+                        'status': 'Down' if rnd.random() < down_ratio else 'Up', 'model': '515',
+                        'firmware_version': '8.10.0.6', 'ip_address': f'10.100.{n // 250}.{n % 250}',
+                        'labels': [], 'site': swarm['group_name'], 'client_count': rnd.randint(0, 40)})
+    return aps
+
+
+def make_clients(aps, count=50000, seed=2):
+    rnd = random.Random(seed)
+    clients = list()
+    for n in range(count):
+        ap = rnd.choice(aps)
+        client = {'macaddr': f'{n >> 24 & 255:02x}:{n >> 16 & 255:02x}:{n >> 8 & 255:02x}:{n & 255:02x}:aa:bb',
+                  'name': f'client-{n}', 'ip_address': f'172.{16 + n // 65536}.{n >> 8 & 255}.{n & 255}',
+                  'username': f'user{n % 20000}', 'associated_device': ap['serial'],
+                  'associated_device_name': ap['name'], 'associated_device_mac': ap['macaddr'],
+                  'band': rnd.choice([2.4, 5, 5, 5, 6]), 'channel': str(rnd.choice([1, 6, 11, 36, 149])),
+                  'os_type': rnd.choice(OS_TYPES), 'network': rnd.choice(NETWORKS),
+                  'connection': rnd.choice(CONNECTIONS), 'health': rnd.randint(40, 100),
+                  'signal_db': -rnd.randint(40, 85), 'snr': rnd.randint(10, 50), 'speed': rnd.choice([144, 866, 1201]),
+                  'swarm_id': ap['swarm_id'], 'group_name': ap['group_name'], 'group_id': GROUPS.index(ap['group_name']),
+                  'vlan': 100, 'manufacturer': 'Apple, Inc.', 'radio_mac': ap['macaddr'], 'site': ap['site'],
+                  'labels': [], 'last_connection_time': 1700000000000 + n, 'client_type': 'WIRELESS',
+                  'authentication_type': 'WPA2-Enterprise', 'encryption_method': 'WPA2', 'phy_type': 'AC',
+                  'user_role': 'authenticated', 'usage': rnd.randint(0, 10 ** 9), 'maxspeed': 1201,
+                  'failure_stage': '', 'failure_reason': ''}
+        if rnd.random() < 0.01:
+            client['swarm_id'] = None
+        clients.append(client)
+    return clients
@@ -1,8 +1,20 @@
 #!/usr/bin/env python
 
-from libarubacentral import ArubaCentralAuth, ArubaCentralConfig
+from libarubacentral import ArubaCentralAuth, ArubaCentralConfig, find_swarm, poll_profiles
+from libarubacentral_daemon import query_daemon
+from libarubacentral_nagios import evaluate_aps, evaluate_checks, with_age, with_coverage, write_command_file, \
+    write_spool_dir, UNKNOWN
+from libarubacentral_aggregate import aggregate_aps, ap_counts
+from libarubacentral_deadline import Deadline
+from libarubacentral_results import CheckResultStore
+from libarubacentral_state import StateStore
+import atexit
+import json
 import logging
 import argparse
+import os
+import subprocess
+import sys
 
 tool_description = "This tool is used for checking the status of a Virtual Controller Cluster in Aruba Central"
 parser = argparse.ArgumentParser(description=tool_description, add_help=True)
@@ -12,9 +24,35 @@ parser.add_argument("-N", "--name", help = "the Name that corresponds to argumen
 parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
 parser.add_argument("-W", "--warn", type=int, help = "Warning Threshold for number of APs down (default: 1)", default=1)
 parser.add_argument("-C", "--crit", type=int, help = "Critical Threshold for number of APs down (default: 5)", default=5)
-parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use.")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use. Batch mode also takes"
+                                            " several profiles, comma separated, or 'all'; checks without a profile"
+                                            " use the first")
 parser.add_argument("-G", "--group", help="The name of the config group to check.")
 parser.add_argument("-T", "--total", type=int, help="total number of expected APs in this location")
+parser.add_argument("-B", "--batch", help="Check every VC/group listed in this checks file (e.g. checks.yml) with one"
+                                          " AP sweep and submit the results as passive checks")
+parser.add_argument("--command-file", help="Batch mode: write results to this nagios external command file")
+parser.add_argument("--spool-dir", help="Batch mode: write results to this nagios check result directory")
+parser.add_argument("--state", help="Batch mode: keep the APs of the last run in this file and report the APs that"
+                                    " went down or came back since then")
+parser.add_argument("--socket", help="Read the AP counts from a running arubacentral_daemon.py on this unix socket"
+                                     " instead of calling the API")
+parser.add_argument("--max-age", type=int, default=300,
+                    help="With --socket, the oldest daemon data to accept, in seconds (default: 300)")
+parser.add_argument("--max-result-age", type=int,
+                    help="Answer from the last good result of this check while it is at most this many seconds old,"
+                         " and fetch new counts in the background, so the check never waits on the API (default:"
+                         " always wait for the API)")
+parser.add_argument("--refresh-after", type=int, default=60,
+                    help="With --max-result-age, fetch new counts once the last result is this many seconds old"
+                         " (default: 60)")
+parser.add_argument("--refresh", help=argparse.SUPPRESS, action="store_true")
+parser.add_argument("--deadline", type=float,
+                    help="Give the AP sweep this many seconds in all (e.g. a little under the nagios plugin timeout),"
+                         " and check the APs fetched by then: problems among them are reported, an OK becomes"
+                         " UNKNOWN (default: wait for every page)")
+parser.add_argument("--stats", help="Write the API calls of this run per endpoint (calls, retries, status codes,"
+                                    " bytes, cache hits, latency and JSON parse time) to this file as JSON")
 parser.add_argument("-v", "--verbose", help="Turn on error logging", action="store_true")
 parser.add_argument("-vv", "--moreverbose", help="Turn on info logging", action="store_true")
 parser.add_argument("-vvv", "--extraverbose", help="Turn on debug logging", action="store_true")
@@ -32,67 +70,234 @@ if args.configpath:
 else:
     config_path = './config'
 
-if args.profile:
-    profile = args.profile
-else:
-    profile = 'Default'
+profiles = ArubaCentralConfig.resolve_profiles(config_path, args.profile)
+if len(profiles) > 1 and not args.batch:
+    print("UNKNOWN - several profiles can only be checked in batch mode (--batch)")
+    exit(3)
+profile = profiles[0]
+# One time budget for everything this run sends (--deadline)
+deadline = Deadline(args.deadline) if args.deadline else None
+# Every ArubaCentralAuth of this run, for --stats
+sessions = dict()
+
+
+def write_stats():
+    with open(args.stats, 'w') as file:
+        json.dump({opened: session.api_stats() for opened, session in sessions.items()}, file, indent=2)
+
+
+if args.stats and not args.refresh:
+    atexit.register(write_stats)
+
+
+def open_source(profile, daemon_profile=None):
+    #
+    # Where the AP counts of a profile come from: (counts from the daemon or None, get_swarm_id, session or
+    # None). daemon_profile is the profile to ask the daemon for, None for the daemon's first profile.
+    #
+    if args.socket:
+        daemon_counts = query_daemon(args.socket, 'aps', max_age=args.max_age, profile=daemon_profile)['data']
+        swarm_index = {swarm['name'].lower(): swarm for swarm in daemon_counts['swarm_list']}
+
+        def get_swarm_id(swarm_name):
+            return find_swarm(swarm_index, swarm_name)['swarm_id']
+        return daemon_counts, get_swarm_id, None
+    session = ArubaCentralAuth(ArubaCentralConfig(profile, config_path).read_config())
+    sessions[profile] = session
+    return None, session.get_swarm_id, session
+
+
+def sweep_profile(profile):
+    #
+    # One paginated sweep of every AP of a profile (or the daemon's counts), counted per swarm and per group:
+    # (counts, changes, get_swarm_id, coverage). A sweep cut short by --deadline is counted as is, without
+    # changes and without touching --state.
+    #
+    daemon_counts, get_swarm_id, session = open_source(profile, daemon_profile=profile if named_profiles else None)
+    changes = None
+    if daemon_counts:
+        return daemon_counts, None, get_swarm_id, daemon_counts.get('coverage', 1.0)
+    if deadline:
+        sweep = session.sweep_aps(deadline)
+        if not sweep.complete:
+            return aggregate_aps(sweep.items()), None, get_swarm_id, sweep.coverage
+        pages = sweep.pages
+    else:
+        pages = session.iter_all_aps()
+    if args.state:
+        state = StateStore(args.state if len(batch_profiles) == 1 else f"{args.state}.{profile}")
+        first_run = not state.load()
+        changes = state.update_aps(pages)
+        state.save()
+        counts = state.ap_aggregate()
+        if first_run:
+            changes = None
+    else:
+        counts = aggregate_aps(ap for page in pages for ap in page)
+    return counts, changes, get_swarm_id, 1.0
+
+
+if args.batch:
+    if not args.command_file and not args.spool_dir:
+        print("UNKNOWN - batch mode needs --command-file or --spool-dir")
+        exit(3)
+    checks = ArubaCentralConfig(profile, config_path).read_checks(args.batch)
+    batch_profiles = list(dict.fromkeys([check.get('profile') or profile for check in checks] or [profile]))
+    named_profiles = bool(args.profile) or any(check.get('profile') for check in checks)
+    # Every profile is swept at the same time, each with its own token, rate limiter and connections.
+    sweeps, errors = poll_profiles({batch_profile: batch_profile for batch_profile in batch_profiles}, sweep_profile)
+    if not sweeps:
+        print("UNKNOWN - AP sweep failed: " + "; ".join(f"{failed}: {str(e)}" for failed, e in errors.items())
+              .replace('\n', ''))
+        exit(3)
+    results = list()
+    changes = {'down': 0, 'up': 0}
+    # Profiles whose sweep was cut short by --deadline
+    partial = 0
+    for batch_profile in batch_profiles:
+        profile_checks = [check for check in checks if (check.get('profile') or profile) == batch_profile]
+        if batch_profile in errors:
+            results += [{'host': check['host'], 'service': check['service'], 'retcode': UNKNOWN,
+                         'output': f"UNKNOWN - AP sweep of profile {batch_profile} failed: "
+                                   + str(errors[batch_profile]).replace('\n', '')} for check in profile_checks]
+            continue
+        counts, profile_changes, get_swarm_id, coverage = sweeps[batch_profile]
+        profile_results = evaluate_checks(profile_checks, counts, get_swarm_id, warn=args.warn, crit=args.crit,
+                                          tag=f"[{batch_profile}] " if len(batch_profiles) > 1 else "")
+        if coverage != 1.0:
+            partial += 1
+            for result in profile_results:
+                result['retcode'], result['output'] = with_coverage(result['retcode'], result['output'], coverage)
+        results += profile_results
+        if profile_changes is None:
+            changes = None
+        elif changes is not None:
+            changes['down'] += len(profile_changes['down'])
+            changes['up'] += len(profile_changes['up'])
+    if args.command_file:
+        write_command_file(args.command_file, results)
+    if args.spool_dir:
+        write_spool_dir(args.spool_dir, results)
+    problems = len([r for r in results if r['retcode'] != 0])
+    if partial:
+        print(f"WARNING - submitted {len(results)} check results, {problems} not OK, from partial AP sweeps of"
+              f" {partial} of {len(batch_profiles)} profiles | 'checks'={len(results)} 'problems'={problems}"
+              f" 'partial'={partial}")
+        exit(1)
+    if changes and args.state:
+        print(f"OK - submitted {len(results)} check results, {problems} not OK, {changes['down']} APs went down"
+              f" and {changes['up']} came back since the last run | 'checks'={len(results)} "
+              f"'problems'={problems} 'went_down'={changes['down']} 'came_back'={changes['up']}")
+    else:
+        print(f"OK - submitted {len(results)} check results, {problems} not OK | 'checks'={len(results)} "
+              f"'problems'={problems}")
+    exit(0)
+
+name = None
+if args.vc and not args.swarmid:
+    name = "VC " + (args.name or args.vc)
+if args.swarmid:
+    if args.name:
+        name = "VC " + args.name
+    else:
+        name = "Swarm with ID: " + args.swarmid
+if args.group:
+    name = args.group
+
+
+def start_refresh():
+    # Fetch new counts for this check in a detached copy of it, unless one is already fetching them
+    lock = results.try_lock(result_key)
+    if lock is None:
+        return
+    lock.close()
+    subprocess.Popen([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--refresh"],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+results = None
+if args.max_result_age and not args.socket and (args.vc or args.swarmid or args.group):
+    # Stale-while-revalidate: a recent enough stored result is the answer, and is refreshed in the background
+    results = CheckResultStore(config_path + "/cache/checks")
+    result_key = CheckResultStore.key(profile, vc=args.vc, swarm_id=args.swarmid, group=args.group,
+                                      total=args.total)
+    if args.refresh:
+        refresh_lock = results.try_lock(result_key)
+        if refresh_lock is None:
+            exit(0)
+    else:
+        stored = results.get(result_key)
+        if stored and results.age(stored) <= args.max_result_age:
+            age = results.age(stored)
+            if age >= args.refresh_after:
+                start_refresh()
+            retcode, retmsg = evaluate_aps(name, stored['down'], warn=args.warn, crit=args.crit,
+                                           total_count=stored['total'], expected_total=args.total)
+            print(with_age(retmsg, age))
+            exit(retcode)
+
+try:
+    daemon_counts, get_swarm_id, session = open_source(profile, daemon_profile=args.profile)
+except RuntimeError as e:
+    print("UNKNOWN - " + str(e).replace('\n', ''))
+    exit(3)
+
 sid = None
 group = None
-session = ArubaCentralAuth(ArubaCentralConfig(profile, config_path).read_config())
 down_count = 0
 if args.vc and not args.swarmid:
     try:
-        sid = session.get_swarm_id(args.vc)
+        sid = get_swarm_id(args.vc)
     except RuntimeError as e:
         retcode = 3
         retmsg = f"VC {args.vc} not found: "
         print(retmsg + str(e))
         exit(retcode)
-    if args.name:
-        name = "VC " + args.name
-    else:
-        name = "VC " + args.vc
 if args.swarmid:
     sid = args.swarmid
-    if args.name:
-        name = "VC " + args.name
-    else:
-        name = "Swarm with ID: " + args.sid
 if args.group:
     group = args.group
-    name = args.group
+total_count = None
+coverage = 1.0
+if daemon_counts and (sid or group):
+    location = ap_counts(daemon_counts, swarm_id=sid, group=group)
+    down_count = location['down']
+    total_count = location['total']
+    coverage = daemon_counts.get('coverage', 1.0)
+elif sid or group:
     try:
-        down_aps = session.get_down_aps(swarm_id=sid, group=group)
-        down_count = len(down_aps)
+        if deadline:
+            sweep = session.sweep_aps(deadline, status=None if args.total else 'Down', swarm_id=sid, group=group)
+            aps = list(sweep.items())
+            coverage = sweep.coverage
+        elif args.total:
+            # One sweep of the location gives both counts
+            aps = session.get_aps(swarm_id=sid, group=group)
+        else:
+            aps = session.get_down_aps(swarm_id=sid, group=group)
+        down_count = len([ap for ap in aps if ap.get('status') == 'Down'])
+        if args.total:
+            total_count = len(aps)
     except RuntimeError as e:
         retcode = 3
-        retmsg = f"Group {args.vc} not found: "
+        retmsg = f"Could not get the APs of {name}: "
         print(retmsg + str(e))
         exit(retcode)
 
-if down_count >= args.crit:
-    retcode = 2
-    if down_count == 100:
-        dc_string = "100+"
-    else:
-        dc_string = str(down_count)
-    retmsg = f"CRITICAL - {dc_string} APs are down in {name} | 'down_aps'={down_count}"
-elif down_count >= args.warn:
-    retcode = 1
-    retmsg = f"WARNING - {down_count} APs are down in {name} | 'down_aps'={down_count}"
-else:
-    if args.total:
-        total_aps = session.get_aps(swarm_id=sid, group=group, limit=args.total)
-        total_count = len(total_aps)
-        if total_count < args.total:
-            retcode = 3
-            retmsg = f"UNKNOWN - Not enough APs in {name}. Expected {args.total}, got {total_count} | 'aps'={total_count}"
-        else:
-            retcode = 0
-            retmsg = f"OK - {total_count} APs are up in {name} | 'aps'={total_count}"
-    else:
-        retcode = 0
-        retmsg = f"OK - {down_count} APs are down in {name} | 'down_aps'={down_count}"
-
+if results and coverage == 1.0:
+    try:
+        results.put(result_key, {'down': down_count, 'total': total_count})
+    except OSError as e:
+        # The counts are still good for this check, the next one fetches its own
+        logging.error(f"could not store the check result in {results.directory}: {str(e)}")
+if args.refresh:
+    exit(0)
+retcode, retmsg = evaluate_aps(name, down_count, warn=args.warn, crit=args.crit, total_count=total_count,
+                               expected_total=args.total)
+if results:
+    retmsg = with_age(retmsg, 0)
+if coverage != 1.0:
+    retcode, retmsg = with_coverage(retcode, retmsg, coverage)
 print(retmsg)
-exit(retcode)
\ No newline at end of file
+exit(retcode)
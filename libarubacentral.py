@@ -1,49 +1,316 @@
-import requests
+import codecs
+import fcntl
 import json
-import yaml
 import os
 import logging
-from datetime import datetime, timedelta
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from libarubacentral_aggregate import ClientAggregator
+from libarubacentral_deadline import Deadline, DeadlineExceeded, Sweep
+from libarubacentral_files import write_json
+from libarubacentral_inventory import ApInventory
+from libarubacentral_records import AP, Swarm, Network, WirelessClient
+from libarubacentral_stats import ApiStats
+#
+# requests, yaml, sqlite3, concurrent.futures and email.utils are imported where they are used: a nagios check
+# answered from the config and response caches never needs them, and importing them costs more than the check.
+#
 
 log = logging.getLogger('libarubacentral')
 
 
+class RateLimitError(RuntimeError):
+    pass
+
+
+def iter_json_array(chunks, key):
+    #
+    # Incrementally decode the items of the top level "key": [...] array of a JSON object, as the chunks
+    # (bytes) arrive. Only one item and the current chunk are held in memory at a time.
+    #
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    state = {'buf': '', 'pos': 0, 'done': False}
+
+    def more():
+        if state['done']:
+            raise ValueError(f"Unexpected end of JSON document while looking for {key}")
+        chunk = next(chunks, None)
+        if chunk is None:
+            state['done'] = True
+            state['buf'] += text_decoder.decode(b'', final=True)
+        else:
+            state['buf'] += text_decoder.decode(chunk)
+        # Drop what has been consumed so the buffer doesn't grow with the document.
+        if state['pos'] > 65536:
+            state['buf'] = state['buf'][state['pos']:]
+            state['pos'] = 0
+
+    def next_char():
+        while True:
+            buf, pos = state['buf'], state['pos']
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buf):
+                return buf[pos]
+            more()
+
+    def decode_value():
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['buf'], state['pos'])
+                # A number at the very end of the buffer may continue in the next chunk.
+                if end < len(state['buf']) or state['done']:
+                    state['pos'] = end
+                    return value
+            except json.JSONDecodeError:
+                if state['done']:
+                    raise
+            more()
+
+    if next_char() != '{':
+        raise ValueError("Expected a JSON object")
+    state['pos'] += 1
+    while True:
+        char = next_char()
+        if char == '}':
+            return
+        if char == ',':
+            state['pos'] += 1
+            continue
+        name = decode_value()
+        if not isinstance(name, str) or next_char() != ':':
+            raise ValueError(f"Expected ':' after {name}")
+        state['pos'] += 1
+        if next_char() == '[' and name == key:
+            state['pos'] += 1
+            while True:
+                char = next_char()
+                if char == ']':
+                    state['pos'] += 1
+                    break
+                if char == ',':
+                    state['pos'] += 1
+                    continue
+                yield decode_value()
+        else:
+            decode_value()
+
+
+def find_swarm(swarms_by_name: dict, name: str) -> dict:
+    #
+    # Look a swarm up by name in a {lower case name: swarm} index
+    #
+    swarm = swarms_by_name.get(name.lower())
+    if swarm:
+        return swarm
+    # No exact match, fall back to a substring match as long as it is not ambiguous.
+    matches = [swarm for key, swarm in swarms_by_name.items() if name.lower() in key]
+    if len(matches) == 1:
+        return matches[0]
+    elif len(matches) > 1:
+        raise RuntimeError(f"Swarm name {name} is ambiguous, it matches: "
+                           f"{', '.join(sorted(swarm['name'] for swarm in matches))}")
+    raise RuntimeError(f"No swarm found with name {name}")
+
+
+class RateLimiter:
+    #
+    # Token bucket for the Aruba Central API rate limits. There is one limiter per profile, shared by every
+    # ArubaCentralAuth (and thread) using that profile. The X-RateLimit-* response headers keep it in step
+    # with what Central reports, and a 429 makes every caller wait out the backoff, not just the one that got it.
+    #
+    _limiters = dict()
+    _limiters_lock = threading.Lock()
+
+    def __init__(self, per_second=7, per_day=5000):
+        self.per_second = float(per_second)
+        self.per_day = per_day
+        self.daily_remaining = None
+        self.exhausted_until = 0
+        self._tokens = self.per_second
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_profile(cls, profile, per_second=7, per_day=5000):
+        with cls._limiters_lock:
+            if profile not in cls._limiters:
+                cls._limiters[profile] = cls(per_second=per_second, per_day=per_day)
+            return cls._limiters[profile]
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if time.time() < self.exhausted_until:
+                    raise RateLimitError(f"Daily API quota of {self.per_day} calls used up, "
+                                         f"resets at {datetime.fromtimestamp(self.exhausted_until)}")
+                now = time.monotonic()
+                self._tokens = min(self.per_second, self._tokens + (now - self._updated) * self.per_second)
+                self._updated = now
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    if self.daily_remaining:
+                        self.daily_remaining -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.per_second
+            time.sleep(wait)
+
+    def backoff(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        with self._lock:
+            if headers.get('X-RateLimit-Limit-day'):
+                self.per_day = int(headers['X-RateLimit-Limit-day'])
+            if headers.get('X-RateLimit-Remaining-day'):
+                self.daily_remaining = int(headers['X-RateLimit-Remaining-day'])
+                if self.daily_remaining <= 0:
+                    # The daily quota resets at midnight UTC.
+                    tomorrow = datetime.now(timezone.utc).date() + timedelta(days=1)
+                    self.exhausted_until = datetime(tomorrow.year, tomorrow.month, tomorrow.day,
+                                                    tzinfo=timezone.utc).timestamp()
+            if headers.get('X-RateLimit-Remaining-second') == '0':
+                self._tokens = 0
+                self._updated = time.monotonic()
+
+    def status(self) -> dict:
+        return {
+            'per_second': self.per_second,
+            'per_day': self.per_day,
+            'daily_remaining': self.daily_remaining,
+            'exhausted_until': self.exhausted_until or None
+        }
+
+
+def _load_yaml(filename):
+    import yaml
+    # libyaml's loader, when PyYAML was built with it, parses several times faster than the pure Python one.
+    with open(filename, 'r') as ymlfile:
+        return yaml.load(ymlfile, Loader=getattr(yaml, 'CFullLoader', yaml.FullLoader))
+
+
+def __getattr__(name):
+    # CountingHTTPAdapter moved to libarubacentral_http, which imports requests
+    if name == 'CountingHTTPAdapter':
+        from libarubacentral_http import CountingHTTPAdapter
+        return CountingHTTPAdapter
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 class ArubaCentralConfig:
+    CONFIG_FILES = ("config.yml", "accounts.yml", "regions.yml")
+
     def __init__(self, profile, configpath, debug=False):
         self.profile = profile
         self.configpath = configpath
         log.setLevel(logging.DEBUG if debug else logging.INFO)
 
+    @staticmethod
+    def list_profiles(configpath) -> list:
+        # The names of the profiles in <configpath>/config.yml, in file order
+        if not os.path.isfile(configpath + "/config.yml"):
+            return list()
+        return list(_load_yaml(configpath + "/config.yml") or dict())
+
+    @classmethod
+    def resolve_profiles(cls, configpath, profiles: str = None) -> list:
+        #
+        # The profiles named by a -P argument: one profile, a comma separated list, or 'all' for every
+        # profile in config.yml. Defaults to the Default profile.
+        #
+        if not profiles:
+            return ['Default']
+        if profiles == 'all':
+            return cls.list_profiles(configpath)
+        return [profile.strip() for profile in profiles.split(',') if profile.strip()]
+
     def read_accounts(self, account):
         data = dict()
         if os.path.isfile(self.configpath + "/accounts.yml"):
-            with open("/accounts.yml", 'r') as ymlfile:
-                data = yaml.load(ymlfile, Loader=yaml.FullLoader)
+            data = _load_yaml(self.configpath + "/accounts.yml")
         else:
             print(
                 "Please read the README file and create the accounts.yml file using the sample.accounts.yml as a guide")
         return data
 
+    def read_checks(self, filename="checks.yml") -> list:
+        #
+        # Batch check definitions for check_aruba_vc_aps.py --batch, see config/checks.yml.orig
+        #
+        checks = list()
+        if not os.path.isabs(filename):
+            filename = self.configpath + "/" + filename
+        if os.path.isfile(filename):
+            data = _load_yaml(filename)
+            if data and 'checks' in data and data['checks']:
+                checks = data['checks']
+        else:
+            print(f"Please create the batch check file {filename} using the checks.yml.orig as a guide")
+        return checks
+
     def read_config(self) -> dict:
+        #
+        # The merged profile config is cached in <configpath>/cache/<profile>.config.json, and reused for as
+        # long as config.yml, accounts.yml and regions.yml keep the modification times and sizes it was
+        # parsed from.
+        #
+        signature = self._config_signature()
+        cache_file = self.configpath + "/cache/" + self.profile + ".config.json"
+        try:
+            with open(cache_file, 'r') as cachefile:
+                cached = json.load(cachefile)
+            if cached['signature'] == signature:
+                return cached['config']
+        except (OSError, ValueError, KeyError):
+            pass
+        data = self._parse_config()
+        if data:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                # It holds the account password and client secret, so only we can read it.
+                write_json(cache_file, {'signature': signature, 'config': data}, mode=0o600)
+            except OSError as e:
+                log.debug(f"can't cache config in {cache_file}: {str(e)}")
+        return data
+
+    def _config_signature(self) -> list:
+        signature = list()
+        for filename in self.CONFIG_FILES:
+            try:
+                stat = os.stat(self.configpath + "/" + filename)
+                signature.append([filename, stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                signature.append([filename, None, None])
+        return signature
+
+    def _parse_config(self) -> dict:
         data = dict()
         if os.path.isfile(self.configpath + "/config.yml"):
             accounts = dict()
             regions = dict()
-            with open(self.configpath + "/config.yml", 'r') as ymlfile:
-                cfgdata = yaml.load(ymlfile, Loader=yaml.FullLoader)
+            cfgdata = _load_yaml(self.configpath + "/config.yml")
 
             # Get list of Central accounts
             if os.path.isfile(self.configpath + "/accounts.yml"):
-                with open(self.configpath + "/accounts.yml", 'r') as ymlfile:
-                    accounts = yaml.load(ymlfile, Loader=yaml.FullLoader)
+                accounts = _load_yaml(self.configpath + "/accounts.yml")
             else:
                 print(
                     "Please read the README file and create the accounts.yml file using the sample.accounts.yml as a guide")
 
             # Get Central regions
             if os.path.isfile(self.configpath + "/regions.yml"):
-                with open(self.configpath + "/regions.yml", 'r') as ymlfile:
-                    regions = yaml.load(ymlfile, Loader=yaml.FullLoader)
+                regions = _load_yaml(self.configpath + "/regions.yml")
             else:
                 print(
                     "Please read the README file and create the regions.yml file using the sample.regions.yml as a guide")
@@ -64,14 +331,167 @@ class ArubaCentralConfig:
 
 
 class ArubaCentralAuth:
+    # One lock per token file, shared by every ArubaCentralAuth in this process (see _token_lock)
+    _token_locks = dict()
+    _token_locks_guard = threading.Lock()
+
     def __init__(self, cfgdata):
         self.cfgdata = cfgdata
         self.profile = cfgdata['profile']
         self.access_token = None
+        self.token_path = cfgdata['configpath'] + "/tokens/" + self.profile + ".token.json"
+        if 'token_refresh_ahead' in cfgdata.keys() and cfgdata['token_refresh_ahead'] is not None:
+            self.token_refresh_ahead = float(cfgdata['token_refresh_ahead'])
+        else:
+            self.token_refresh_ahead = 300
+        self._refresh_thread = None
+        self._refresh_thread_guard = threading.Lock()
+        self._refresh_failed_at = 0
         if 'http_timeout' in cfgdata.keys() and cfgdata['http_timeout']:
             self.http_timeout = cfgdata['http_timeout']
         else:
             self.http_timeout = 10
+        if 'http_pool_size' in cfgdata.keys() and cfgdata['http_pool_size']:
+            self.http_pool_size = int(cfgdata['http_pool_size'])
+        else:
+            self.http_pool_size = 10
+        if 'max_workers' in cfgdata.keys() and cfgdata['max_workers']:
+            self.max_workers = int(cfgdata['max_workers'])
+        else:
+            self.max_workers = 4
+        if 'swarm_cache_ttl' in cfgdata.keys() and cfgdata['swarm_cache_ttl'] is not None:
+            self.swarm_cache_ttl = float(cfgdata['swarm_cache_ttl'])
+        else:
+            self.swarm_cache_ttl = 300
+        self._swarm_cache = dict()
+        self._swarm_cache_time = None
+        # The names missing from the swarm cache that it was already fetched again for
+        self._swarm_cache_refetched = set()
+        if 'inventory_ttl' in cfgdata.keys() and cfgdata['inventory_ttl'] is not None:
+            self.inventory_ttl = float(cfgdata['inventory_ttl'])
+        else:
+            self.inventory_ttl = 3600
+        self.inventory_path = cfgdata['configpath'] + "/cache/" + self.profile + ".inventory.json"
+        self._inventory = None
+        self.response_cache = None
+        if cfgdata.get('response_cache'):
+            from libarubacentral_cache import ResponseCache
+            self.response_cache = ResponseCache.from_config(cfgdata)
+        if 'http_retries' in cfgdata.keys() and cfgdata['http_retries'] is not None:
+            self.http_retries = int(cfgdata['http_retries'])
+        else:
+            self.http_retries = 3
+        self.rate_limiter = RateLimiter.for_profile(self.profile,
+                                                    per_second=cfgdata.get('rate_limit_per_second') or 7,
+                                                    per_day=cfgdata.get('rate_limit_per_day') or 5000)
+        self.stats = ApiStats()
+        self.adapter = None
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # The requests.Session is only created (and requests imported) for the first request that needs it.
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    from libarubacentral_http import new_session
+                    self._session, self.adapter = new_session(self.http_pool_size)
+        return self._session
+
+    def connection_stats(self) -> dict:
+        if self.adapter is None:
+            return {'requests': 0, 'new_connections': 0, 'reused_connections': 0}
+        return self.adapter.connection_stats()
+
+    def rate_limit_status(self) -> dict:
+        return self.rate_limiter.status()
+
+    def api_stats(self) -> dict:
+        # Calls, latency, bytes, retries, status codes, cache hits and JSON parse time per endpoint
+        # (see libarubacentral_stats.py)
+        return self.stats.stats()
+
+    def _send(self, method, url, deadline: Deadline = None, **kwargs):
+        #
+        # Every HTTP request goes through here: wait for the rate limiter, then retry connection errors,
+        # 429s and 502/503/504s with jittered exponential backoff, honoring Retry-After. With a deadline, each
+        # attempt's timeout is cut to the time left, and a retry that would start after it is not made.
+        #
+        # Only GETs are safe to repeat. A POST (the token refresh, AP settings) may have been applied when
+        # the connection dropped or a gateway answered 502/503/504, so it is only retried on a 429 or when
+        # the connection failed before anything was sent.
+        #
+        session = self.session
+        import requests
+        attempt = 0
+        timeout = kwargs.get('timeout')
+        retry_statuses = (429, 502, 503, 504) if method.upper() == 'GET' else (429,)
+        while True:
+            self.rate_limiter.acquire()
+            if deadline:
+                kwargs['timeout'] = deadline.timeout(timeout)
+            start = time.perf_counter()
+            try:
+                r = session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self.stats.record_request(url, 'error', time.perf_counter() - start, retry=attempt > 0)
+                if attempt >= self.http_retries:
+                    raise
+                if method.upper() != 'GET' and not self._not_sent(e):
+                    raise
+                delay = self._backoff_delay(attempt)
+                if deadline and delay >= deadline.remaining():
+                    raise
+                log.debug(f"connection error on {url}, retrying in {delay:.1f} seconds")
+            else:
+                # A streamed body is counted as it is read (see _iter_api)
+                self.stats.record_request(url, r.status_code, time.perf_counter() - start,
+                                          0 if kwargs.get('stream') else len(r.content), retry=attempt > 0)
+                self.rate_limiter.update_from_headers(r.headers)
+                if r.status_code not in retry_statuses or attempt >= self.http_retries:
+                    return r
+                if self.rate_limiter.daily_remaining is not None and self.rate_limiter.daily_remaining <= 0:
+                    return r
+                delay = self._retry_after(r)
+                if delay is None:
+                    delay = self._backoff_delay(attempt)
+                if r.status_code == 429:
+                    self.rate_limiter.backoff(delay)
+                if deadline and delay >= deadline.remaining():
+                    return r
+                log.debug(f"STATUS CODE {r.status_code} on {url}, retrying in {delay:.1f} seconds")
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _not_sent(e) -> bool:
+        # Whether a connection error happened before the request went out (no connection could be made)
+        from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+        import requests
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(e.args[0], 'reason', None) if e.args else None
+        return isinstance(reason, (ConnectTimeoutError, NewConnectionError))
+
+    @staticmethod
+    def _backoff_delay(attempt: int) -> float:
+        return min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _retry_after(r):
+        value = r.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        from email.utils import parsedate_to_datetime
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
 
     def get_login(self) -> dict:
         csrftoken = 'uninitialized'
@@ -80,14 +500,16 @@ class ArubaCentralAuth:
         params = {"client_id": self.cfgdata['client_id']}
         headers = {"Content-Type": "application/json"}
         data = {"username": self.cfgdata['username'], "password": self.cfgdata['password']}
-        s = requests.Session()
-        r = s.post(auth_url, headers=headers, params=params, data=json.dumps(data), verify=True, timeout=10)
+        r = self._send('POST', auth_url, headers=headers, params=params, data=json.dumps(data), verify=True,
+                       timeout=10)
         if r.status_code == 200:
             for i in r.cookies:
                 if i.name == "csrftoken":
                     csrftoken = i.value
                 if i.name == "session":
                     csession = i.value
+            # The login cookies are passed explicitly to get_authcode, don't send them with every API call.
+            self.session.cookies.clear()
         else:
             print("ERROR CODE: " + str(r.status_code))
             print("ERORR Detail: " + str(r.text))
@@ -112,9 +534,8 @@ class ArubaCentralAuth:
                    "Cookie": "session=" + csession}
         params = {"client_id": self.cfgdata['client_id'], "response_type": "code", "scope": "all"}
         data = {"customer_id": str(self.cfgdata['customer_id'])}
-        s = requests.Session()
-        result = s.post(auth_url, headers=headers, params=params,
-                        data=json.dumps(data), verify=True, timeout=10)
+        result = self._send('POST', auth_url, headers=headers, params=params,
+                            data=json.dumps(data), verify=True, timeout=10)
         if result.status_code == 200:
             tmp = json.loads(result.text)
             authcode = tmp['auth_code']
@@ -133,8 +554,8 @@ class ArubaCentralAuth:
         tokens = dict()
         params = {"client_id": self.cfgdata['client_id'], "client_secret": self.cfgdata['client_secret'],
                   "grant_type": "authorization_code", "code": authcode}
-        r = requests.post(token_url, headers=headers, params=params,
-                          data=json.dumps(data), verify=True, timeout=10)
+        r = self._send('POST', token_url, headers=headers, params=params,
+                       data=json.dumps(data), verify=True, timeout=10)
         if r.status_code == 200:
             tokens = json.loads(r.text)
             #
@@ -144,21 +565,39 @@ class ArubaCentralAuth:
             expires_at_epoc = expires_at_dt.timestamp()
             tokens.update({'expires_at': expires_at_epoc})
             self.access_token = tokens
-            with open(self.cfgdata['configpath'] + "/tokens/" + self.profile + ".token.json", 'w') as newtokenfile:
-                newtokenfile.write(json.dumps(tokens))
+            self._write_token(tokens)
         else:
             raise RuntimeError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
         return tokens
 
     def retrieve_stored_token(self):
         data = dict()
-        if os.path.exists(self.cfgdata['configpath'] + "/tokens/" + self.profile + ".token.json"):
-            with open(self.cfgdata['configpath'] + "/tokens/" + self.profile + ".token.json", 'r') as existingtokenfile:
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'r') as existingtokenfile:
                 data = json.loads(existingtokenfile.read())
         else:
             log.debug(f"No stored token for profile {self.profile}")
         return data
 
+    def _write_token(self, tokens: dict):
+        write_json(self.token_path, tokens, mode=0o600)
+
+    @contextmanager
+    def _token_lock(self):
+        #
+        # Only one thread of one process refreshes the token of a profile at a time: threads of this process
+        # wait on a lock, other processes on an flock of tokens/<profile>.token.json.lock.
+        #
+        with self._token_locks_guard:
+            thread_lock = self._token_locks.setdefault(self.token_path, threading.Lock())
+        with thread_lock:
+            with open(self.token_path + '.lock', 'a') as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
     def refresh_access_token(self, access_token: dict=None) -> dict:
         if not access_token:
             access_token = self.access_token
@@ -168,8 +607,8 @@ class ArubaCentralAuth:
         headers = {}
         params = {"client_id": self.cfgdata['client_id'], "client_secret": self.cfgdata['client_secret'],
                   "grant_type": "refresh_token", "refresh_token": access_token['refresh_token']}
-        r = requests.post(token_url, headers=headers, params=params,
-                          data=json.dumps(data), verify=True, timeout=10)
+        r = self._send('POST', token_url, headers=headers, params=params,
+                       data=json.dumps(data), verify=True, timeout=10)
         if r.status_code == 200:
             new_token = json.loads(r.text)
             #
@@ -179,8 +618,7 @@ class ArubaCentralAuth:
             expires_at_epoc = expires_at_dt.timestamp()
             new_token.update({'expires_at': expires_at_epoc})
             self.access_token = new_token
-            with open(self.cfgdata['configpath'] + "/tokens/" + self.profile + ".token.json", 'w') as newtokenfile:
-                newtokenfile.write(json.dumps(new_token))
+            self._write_token(new_token)
         else:
             raise RuntimeError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
 
@@ -204,72 +642,278 @@ class ArubaCentralAuth:
 
     def authenticate(self):
         if not self.access_token:
-            log.debug(f"Access token not cached. retrieving from {self.cfgdata['configpath']+'tokens/' + self.profile + '.token.json'}")
+            log.debug(f"Access token not cached. retrieving from {self.token_path}")
             self.access_token = self.retrieve_stored_token()
-        if not self.access_token:
-            log.debug(f"Access token not stored. Generating a new token.")
-            self.get_new_token()
-        if self.token_expired():
-            try:
-                log.debug(f"Token Expired. Renewing with stored refresh token.")
-                self.refresh_access_token()
-            except RuntimeError:
-                log.debug(f"Can't refresh expired token. Getting a new token")
+        if self.access_token and not self.token_expired():
+            if time.time() > self.access_token['expires_at'] - self.token_refresh_ahead:
+                self._refresh_in_background()
+            return
+        with self._token_lock():
+            # Another thread or process may have renewed the token while we waited for the lock, and if it
+            # refreshed it, only the stored refresh token is still good.
+            stored_token = self.retrieve_stored_token()
+            if stored_token:
+                self.access_token = stored_token
+            if not self.access_token:
+                log.debug(f"Access token not stored. Generating a new token.")
                 self.get_new_token()
+            if self.token_expired():
+                try:
+                    log.debug(f"Token Expired. Renewing with stored refresh token.")
+                    self.refresh_access_token()
+                except RuntimeError:
+                    log.debug(f"Can't refresh expired token. Getting a new token")
+                    self.get_new_token()
         if not self.access_token:
             raise RuntimeError('Token problem. No token stored, or token still expired after refresh.')
 
+    def _refresh_in_background(self):
+        #
+        # The token expires within token_refresh_ahead seconds: refresh it in a thread while callers keep using
+        # the current one. The thread is not a daemon thread, so a plugin that exits meanwhile still waits for
+        # the new token to be stored, instead of leaving a used up refresh token in the token file.
+        #
+        with self._refresh_thread_guard:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            if time.monotonic() - self._refresh_failed_at < 30:
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh_early, name=f"token-refresh-{self.profile}")
+            self._refresh_thread.start()
+
+    def _refresh_early(self):
+        try:
+            with self._token_lock():
+                stored_token = self.retrieve_stored_token()
+                if stored_token and time.time() < stored_token['expires_at'] - self.token_refresh_ahead:
+                    log.debug("Token already refreshed by another process")
+                    self.access_token = stored_token
+                    return
+                log.debug(f"Token expires within {self.token_refresh_ahead} seconds, refreshing it")
+                self.refresh_access_token(stored_token or self.access_token)
+        except (RuntimeError, OSError) as e:  # requests exceptions are OSErrors
+            self._refresh_failed_at = time.monotonic()
+            log.error(f"Early token refresh failed, retrying in 30 seconds: {str(e)}")
+
 
     def get_user_account_list(self, access_token: dict = None):
-        return self._get_api("/platform/rbac/v1/users", access_token)
+        return self._get_api("/platform/rbac/v1/users", access_token=access_token)
 
-    def get_aps(self, access_token: dict = None, limit: int = 100, status: str = None, vc: str = None,
+    def get_aps(self, access_token: dict = None, limit: int = None, status: str = None, vc: str = None,
                 group: str = None, client_count: bool = None, label: str = None, swarm_id=None, mac_address=None,
-                timeout=None):
+                timeout=None, records=False):
+        #
+        # Every AP matching the filters, 1000 per page (fetched in parallel when the API reports a total), or
+        # the first limit APs.
+        #
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        if not swarm_id and vc:
+            swarm_id = self.get_swarm_id(vc, access_token=access_token)
+        page_size = min(limit, 1000) if limit else 1000
+        # Without a limit the API's total lets the pages after the first be fetched in parallel; with one,
+        # only the pages needed are fetched, one after the other
+        url = self._aps_url(limit=page_size, status=status, group=group, client_count=client_count, label=label,
+                            swarm_id=swarm_id, mac_address=mac_address, calculate_total=not limit)
+        log.debug(f"getting aps: {url}")
+        aps = list()
+        pages = self._iter_pages(url, 'aps', page_size, access_token=access_token, timeout=timeout)
+        for page in pages:
+            aps += page
+            if limit and len(aps) >= limit:
+                pages.close()
+                del aps[limit:]
+                break
+        return self._records(AP, aps) if records else aps
+
+    def iter_all_aps(self, access_token: dict = None, status: str = None, vc: str = None, group: str = None,
+                     client_count: bool = None, label: str = None, swarm_id=None, timeout=None, max_workers=None,
+                     records=False):
+        #
+        # Yields every page of APs (1000 per page), in offset order.
+        #
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        if not swarm_id and vc:
+            swarm_id = self.get_swarm_id(vc, access_token=access_token)
+        url = self._aps_url(limit=1000, status=status, group=group, client_count=client_count, label=label,
+                            swarm_id=swarm_id)
+        pages = self._iter_pages(url, 'aps', 1000, access_token=access_token, timeout=timeout,
+                                 max_workers=max_workers)
+        return (self._records(AP, page) for page in pages) if records else pages
+
+    def stream_aps(self, access_token: dict = None, status: str = None, vc: str = None, group: str = None,
+                   client_count: bool = None, label: str = None, swarm_id=None, timeout=None, records=False):
+        #
+        # Yields every AP, decoding each page as it is received.
+        #
+        if not swarm_id and vc:
+            swarm_id = self.get_swarm_id(vc, access_token=access_token)
+        url = self._aps_url(limit=1000, status=status, group=group, client_count=client_count, label=label,
+                            swarm_id=swarm_id)
+        aps = self._stream_pages(url, 'aps', 1000, timeout=timeout, access_token=access_token)
+        return self._stream_records(AP, aps) if records else aps
+
+    def sweep_aps(self, deadline, status: str = None, group: str = None, swarm_id=None, page_budget=None,
+                  access_token: dict = None, max_workers=None) -> Sweep:
+        #
+        # Every AP matching the filters that can be fetched before the deadline (a Deadline, or seconds from
+        # now), as a Sweep with the pages that finished and their coverage, instead of an error when a page
+        # times out.
+        #
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        url = self._aps_url(limit=1000, status=status, group=group, swarm_id=swarm_id)
+        return self._sweep_pages(url, 'aps', 1000, Deadline.of(deadline, page_budget), access_token=access_token,
+                                 max_workers=max_workers)
+
+    @classmethod
+    def _aps_url(cls, limit: int = None, status: str = None, group: str = None, client_count: bool = None,
+                 label: str = None, swarm_id=None, mac_address=None, calculate_total=True) -> str:
         url = "/monitoring/v1/aps"
         if limit:
-            url = self._add_arg(url, f"limit={str(limit)}")
+            url = cls._add_arg(url, f"limit={str(limit)}")
         if status:
-            url = self._add_arg(url, f"status={status}")
+            url = cls._add_arg(url, f"status={status}")
         if swarm_id:
-            url = self._add_arg(url, f"swarm_id={swarm_id}")
-        elif vc:
-            url = self._add_arg(url, f"swarm_id={self.get_swarm_id(vc, access_token=access_token)}")
+            url = cls._add_arg(url, f"swarm_id={swarm_id}")
         if group:
-            url = self._add_arg(url, f"group={group}")
+            url = cls._add_arg(url, f"group={group}")
         if client_count:
-            url = self._add_arg(url, f"calculate_client_count=true")
+            url = cls._add_arg(url, f"calculate_client_count=true")
         if label:
-            url = self._add_arg(url, f"label={label}")
+            url = cls._add_arg(url, f"label={label}")
         if mac_address:
-            url = self._add_arg(url, f"macaddr={mac_address}")
-        log.debug(f"getting aps: {url}")
-        return self._get_api(url, timeout=timeout, access_token=access_token)['aps']
+            url = cls._add_arg(url, f"macaddr={mac_address}")
+        if calculate_total:
+            url = cls._add_arg(url, 'calculate_total=true')
+        return url
 
     def get_swarm_id(self, name: str, access_token: dict=None) -> str:
-        data = self._get_api('/monitoring/v1/swarms', access_token)
-        for swarm in data['swarms']:
-            if name.lower() in swarm['name'].lower():
-                return swarm['swarm_id']
-        raise RuntimeError(f"No swarm found with name {name}")
+        return self.get_swarm(name, access_token=access_token)['swarm_id']
+
+    def get_swarm(self, name: str, access_token: dict = None) -> dict:
+        if not self._swarm_cache_fresh():
+            self.get_swarms(access_token=access_token)
+        elif self._swarm_cache_miss(name):
+            # Maybe a VC added since the cache was filled: fetch the swarms again, once per name until it expires
+            self.get_swarms(access_token=access_token)
+            self._swarm_cache_refetched.add(name.lower())
+        return self._find_swarm(name)
+
+    def get_swarms(self, access_token:dict=None, group=None, records=False) -> list:
+        # Every swarm, 1000 per page
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        swarms = list()
+        for page in self._iter_pages(self._swarms_url(group=group, limit=1000), 'swarms', 1000,
+                                     access_token=access_token):
+            swarms += page
+        if not group:
+            self._update_swarm_cache(swarms)
+        return self._records(Swarm, swarms) if records else swarms
+
+    def _swarm_cache_miss(self, name: str) -> bool:
+        return name.lower() not in self._swarm_cache and name.lower() not in self._swarm_cache_refetched
+
+    def _swarm_cache_fresh(self) -> bool:
+        if self._swarm_cache_time is None:
+            return False
+        return time.monotonic() - self._swarm_cache_time < self.swarm_cache_ttl
+
+    def _update_swarm_cache(self, swarms: list):
+        #
+        # Keep only what the vc= lookups need: name, swarm ID and group, indexed by lower case name.
+        #
+        cache = dict()
+        for swarm in swarms:
+            cache[swarm['name'].lower()] = {'name': swarm['name'],
+                                            'swarm_id': swarm['swarm_id'],
+                                            'group_name': swarm.get('group_name')}
+        self._swarm_cache = cache
+        self._swarm_cache_time = time.monotonic()
+        self._swarm_cache_refetched = set()
+        log.debug(f"cached {len(cache)} swarms for {self.swarm_cache_ttl} seconds")
 
-    def get_swarms(self, access_token:dict=None, group=None) -> list:
+    def _find_swarm(self, name: str) -> dict:
+        return find_swarm(self._swarm_cache, name)
+
+    @classmethod
+    def _swarms_url(cls, group=None, limit=None) -> str:
         url = '/monitoring/v1/swarms'
+        if limit:
+            url = cls._add_arg(url, f"limit={str(limit)}")
         if group:
-            url = self._add_arg(url, f"group={group}")
-        return self._get_api(url, access_token)['swarms']
+            url = cls._add_arg(url, f"group={group}")
+        url = cls._add_arg(url, 'calculate_total=true')
+        return url
+
+    def get_ap(self, serial, access_token: dict = None, max_age=None):
+        #
+        # The full details of an AP. With max_age, the fields of the AP inventory are good enough, so an
+        # inventory no older than max_age seconds answers without an API call.
+        #
+        if max_age is not None:
+            ap = self.get_inventory(max_age=max_age, access_token=access_token).find(serial=serial)
+            if ap:
+                return ap.as_dict()
+        data = self._get_api(f'/monitoring/v1/aps/{serial}', access_token=access_token)
+        return data
+
+    def get_inventory(self, max_age=None, refresh=False, access_token: dict = None) -> ApInventory:
+        #
+        # The AP inventory snapshot (see libarubacentral_inventory.py) of this profile: the one in memory or
+        # in <configpath>/cache if it is no older than max_age (default: inventory_ttl), otherwise a new one
+        # from a paginated sweep of every AP, which is saved for the other processes of the profile.
+        #
+        if max_age is None:
+            max_age = self.inventory_ttl
+        if not refresh:
+            if self._inventory and self._inventory.age() <= max_age:
+                return self._inventory
+            inventory = ApInventory.load(self.inventory_path, loader=self._raw_loaders[AP])
+            if inventory and inventory.age() <= max_age:
+                self._inventory = inventory
+                return inventory
+        inventory = ApInventory.from_pages(self.iter_all_aps(access_token=access_token, records=True))
+        log.debug(f"AP inventory: {len(inventory.aps)} APs")
+        try:
+            inventory.save(self.inventory_path)
+        except OSError as e:
+            log.error(f"could not save the AP inventory to {self.inventory_path}: {str(e)}")
+        self._inventory = inventory
+        return inventory
 
-    def get_ap(self, serial, access_token: dict = None):
-        data = self._get_api(f'/monitoring/v1/aps/{serial}', access_token)
+    def _get_api(self, url, timeout=None, access_token: dict=None, deadline: Deadline = None) -> dict:
+        text = None
+        if self.response_cache:
+            ttl = self.response_cache.ttl_for(url)
+            if ttl > 0:
+                fetched = list()
+
+                def fetch():
+                    fetched.append(url)
+                    return self._get_api_text(url, timeout, access_token, deadline)
+                text = self.response_cache.fetch(self.profile + url, ttl, fetch)
+                if not fetched:
+                    self.stats.record_cache_hit(url)
+        if text is None:
+            text = self._get_api_text(url, timeout, access_token, deadline)
+        start = time.perf_counter()
+        data = json.loads(text)
+        self.stats.record_parse(url, time.perf_counter() - start)
         return data
 
-    def _get_api(self, url, timeout=None, access_token: dict=None) -> dict:
+    def _get_api_text(self, url, timeout=None, access_token: dict=None, deadline: Deadline = None) -> str:
         if not timeout and self.http_timeout:
             timeout = self.http_timeout
         if not access_token:
             self.authenticate()
             access_token = self.access_token
-        api_data = dict()
         this_access_token = access_token['access_token']
         token_url = self.cfgdata['url'] + url
         headers = {
@@ -278,12 +922,59 @@ class ArubaCentralAuth:
             'Authorization': 'Bearer ' + this_access_token
         }
         data = {}
-        r = requests.get(token_url, headers=headers, data=json.dumps(data), verify=True, timeout=timeout)
+        r = self._send('GET', token_url, headers=headers, data=json.dumps(data), verify=True, timeout=timeout,
+                       deadline=deadline)
         if r.status_code == 200:
-            api_data = json.loads(r.text)
+            return r.text
+        elif r.status_code == 429:
+            raise RateLimitError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
         else:
             raise RuntimeError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
-        return api_data
+
+    def _iter_api(self, url, key, timeout=None, access_token: dict = None):
+        #
+        # Like _get_api, but yields the items of the response's "key" array as they are read from the
+        # connection instead of loading the whole body. The response cache is not used here.
+        #
+        if not timeout and self.http_timeout:
+            timeout = self.http_timeout
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': 'Bearer ' + access_token['access_token']
+        }
+        r = self._send('GET', self.cfgdata['url'] + url, headers=headers, data=json.dumps({}), verify=True,
+                       timeout=timeout, stream=True)
+        with r:
+            if r.status_code == 429:
+                raise RateLimitError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
+            elif r.status_code != 200:
+                raise RuntimeError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
+            yield from iter_json_array(self._count_bytes(url, r.iter_content(chunk_size=65536)), key)
+
+    def _count_bytes(self, url, chunks):
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.stats.record_bytes(url, size)
+
+    def _stream_pages(self, url, key, page_size, timeout=None, access_token: dict = None):
+        offset = 0
+        while True:
+            count = 0
+            page_url = self._add_arg(url, f"offset={offset}") if offset else url
+            for item in self._iter_api(page_url, key, timeout=timeout, access_token=access_token):
+                count += 1
+                yield item
+            if count < page_size:
+                return
+            offset += count
 
     def _post_api(self, url, data: dict, access_token: dict = None, timeout=None) -> dict:
         if not timeout:
@@ -299,9 +990,11 @@ class ArubaCentralAuth:
             'Content-Type': 'application/json',
             'Authorization': 'Bearer ' + this_access_token
         }
-        r = requests.post(request_url, headers=headers, data=json.dumps(data), verify=True, timeout=timeout)
+        r = self._send('POST', request_url, headers=headers, data=json.dumps(data), verify=True, timeout=timeout)
         if r.status_code == 200:
             api_data = json.loads(r.text)
+        elif r.status_code == 429:
+            raise RateLimitError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
         else:
             raise RuntimeError(f"STATUS CODE: {str(r.status_code)} \nDetail: {str(r.text)}")
         return api_data
@@ -320,69 +1013,351 @@ class ArubaCentralAuth:
         return down_list
 
     def get_client_count(self, vc = None, group=None, network=None, label=None, access_token=None, swarm_id=None,
-                         timeout=None):
+                         timeout=None, deadline: Deadline = None):
+        if not swarm_id and vc:
+            swarm_id = self.get_swarm_id(vc, access_token=access_token)
+        url = self._client_count_url(group=group, network=network, label=label, swarm_id=swarm_id)
+        return self._get_api(url, access_token=access_token, timeout=timeout, deadline=deadline)['count']
+
+    def get_client_counts(self, group=None, labels: list = None, access_token=None, timeout=None,
+                          method: str = None, deadline=None, kinds=('vc', 'network', 'group')) -> dict:
+        #
+        # Client counts per VC, SSID (network), group and label, with as few API calls as we can manage.
+        # Either one paginated /clients/wireless sweep counted locally ('sweep'), or one /clients/count
+        # call per VC, SSID and group ('count'), whichever needs fewer calls. Labels are not part of the
+        # client records, so they are always counted with /clients/count. kinds are the counts wanted of
+        # 'vc', 'network' and 'group': the others are left empty and cost no calls (the swarms are only
+        # fetched for VC counts, and for group counts without a group).
+        #
+        # With a deadline (a Deadline, or seconds from now), the counts are of whatever finished in time:
+        # 'coverage' is the share of the clients swept, or of the counts answered (VCs, SSIDs, groups and
+        # labels not answered are left out), below 1.0 for partial counts.
+        #
+        deadline = Deadline.of(deadline)
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        api_calls = 0
+        coverage = 1.0
+        swarms = list()
+        networks = list()
+        groups = list()
+        if 'vc' in kinds or ('group' in kinds and not group):
+            swarms = self.get_swarms(access_token=access_token, group=group)
+            api_calls += 1
+        if 'network' in kinds:
+            networks = self.get_networks(access_token=access_token, group=group, timeout=timeout)
+            api_calls += 1
+        if 'group' in kinds:
+            if group:
+                groups = [group]
+            else:
+                groups = sorted({swarm['group_name'] for swarm in swarms if swarm.get('group_name')})
+        vc_swarms = swarms if 'vc' in kinds else list()
+        if not method:
+            total = self.get_client_count(group=group, access_token=access_token, timeout=timeout)
+            api_calls += 1
+            sweep_calls = max(1, -(-total // 1000))
+            count_calls = len(vc_swarms) + len(networks) + len(groups)
+            method = 'sweep' if sweep_calls <= count_calls else 'count'
+            log.debug(f"{total} clients: {sweep_calls} calls to sweep, {count_calls} calls to count, using {method}")
+
+        vc_counts = {swarm['name']: 0 for swarm in vc_swarms}
+        network_counts = {network['essid']: 0 for network in networks}
+        group_counts = {group_name: 0 for group_name in groups}
+        if method == 'sweep':
+            aggregator = ClientAggregator({swarm['swarm_id']: swarm['name'] for swarm in swarms},
+                                          {swarm['swarm_id']: swarm.get('group_name') for swarm in swarms})
+            if deadline:
+                sweep = self.sweep_wifi_clients(deadline, group=group, access_token=access_token)
+                pages = sweep.pages
+                coverage = sweep.coverage
+            else:
+                pages = self.iter_all_wifi_clients(group=group, access_token=access_token, timeout=timeout)
+            for page in pages:
+                aggregator.add(page)
+                api_calls += 1
+            counts = aggregator.result()
+            for swarm in vc_swarms:
+                vc_counts[swarm['name']] = counts['swarm'].get(swarm['swarm_id'], 0)
+            if 'network' in kinds:
+                network_counts.update(counts['ssid'])
+            for group_name in groups:
+                group_counts[group_name] = counts['group'].get(group_name, 0)
+        else:
+            queries = [('vc', swarm['name'], {'swarm_id': swarm['swarm_id']}) for swarm in vc_swarms]
+            queries += [('network', network['essid'], {'network': network['essid'], 'group': group})
+                        for network in networks]
+            queries += [('group', group_name, {'group': group_name}) for group_name in groups]
+            results = self._count_clients(queries, access_token, timeout, deadline)
+            if queries and all(count is None for count in results):
+                raise RuntimeError("no client counts answered before the deadline")
+            api_calls += len(queries)
+            for (kind, name, _), count in zip(queries, results):
+                kind_counts = {'vc': vc_counts, 'network': network_counts, 'group': group_counts}[kind]
+                if count is None:
+                    del kind_counts[name]
+                else:
+                    kind_counts[name] = count
+            if deadline and queries:
+                coverage = len([count for count in results if count is not None]) / len(queries)
+
+        label_counts = dict()
+        if labels:
+            queries = [('label', label, {'label': label, 'group': group}) for label in labels]
+            label_counts = {label: count for label, count in
+                            zip(labels, self._count_clients(queries, access_token, timeout, deadline))
+                            if count is not None}
+            api_calls += len(queries)
+        return {'vc': vc_counts, 'network': network_counts, 'group': group_counts, 'label': label_counts,
+                'method': method, 'api_calls': api_calls, 'coverage': coverage}
+
+    def _count_clients(self, queries, access_token, timeout, deadline: Deadline = None) -> list:
+        # The /clients/count of each query; with a deadline, None for the queries not answered in time
+        from concurrent.futures import ThreadPoolExecutor
+
+        def count(query):
+            if not deadline:
+                return self.get_client_count(access_token=access_token, timeout=timeout, **query[2])
+            if not deadline.can_finish():
+                return None
+            start = time.monotonic()
+            try:
+                result = self.get_client_count(access_token=access_token, timeout=deadline.page_budget or timeout,
+                                               deadline=deadline, **query[2])
+            except Exception as e:
+                log.debug(f"client count of {query[0]} {query[1]} failed: {str(e)}")
+                return None
+            deadline.record_page(time.monotonic() - start)
+            return result
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(count, queries))
+
+    @classmethod
+    def _client_count_url(cls, group=None, network=None, label=None, swarm_id=None) -> str:
         url = '/monitoring/v1/clients/count'
         if swarm_id:
-            url = self._add_arg(url, f"swarm_id={swarm_id}")
-        elif vc:
-            url = self._add_arg(url, f"swarm_id={self.get_swarm_id(vc, access_token=access_token)}")
+            url = cls._add_arg(url, f"swarm_id={swarm_id}")
         if group:
-            url = self._add_arg(url, f"group={group}")
+            url = cls._add_arg(url, f"group={group}")
         if label:
-            url = self._add_arg(url, f"label={label}")
+            url = cls._add_arg(url, f"label={label}")
         if network:
-            url = self._add_arg(url, f"network={network}")
-        return self._get_api(url, access_token=access_token, timeout=timeout)['count']
+            url = cls._add_arg(url, f"network={network}")
+        return url
 
     def get_wifi_clients(self, vc = None, group=None, network=None, label=None, access_token=None, count_only=False,
-                         limit=1000, band=None, offset=None, timeout=None):
+                         limit=1000, band=None, offset=None, timeout=None, records=False):
+        swarm_id = self.get_swarm_id(vc, access_token=access_token) if vc else None
+        url = self._wifi_clients_url(swarm_id=swarm_id, group=group, network=network, label=label, limit=limit,
+                                     band=band, offset=offset)
+        if count_only:
+            return self._get_api(url, access_token=access_token, timeout=timeout)['count']
+        else:
+            clients = self._get_api(url, access_token=access_token, timeout=timeout)['clients']
+            return self._records(WirelessClient, clients) if records else clients
+
+    def get_wifi_client(self, macaddr, access_token=None, timeout=None) -> dict:
+        return self._get_api(f'/monitoring/v1/clients/wireless/{macaddr}', access_token=access_token,
+                             timeout=timeout)
+
+    def iter_all_wifi_clients(self, vc=None, group=None, network=None, label=None, access_token=None, band=None,
+                              timeout=None, max_workers=None, records=False):
+        #
+        # Yields every page of wireless clients, in offset order. The first page tells us the total,
+        # the remaining pages are fetched in parallel by at most max_workers threads.
+        #
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        swarm_id = self.get_swarm_id(vc, access_token=access_token) if vc else None
+        url = self._wifi_clients_url(swarm_id=swarm_id, group=group, network=network, label=label, limit=1000,
+                                     band=band)
+        pages = self._iter_pages(url, 'clients', 1000, access_token=access_token, timeout=timeout,
+                                 max_workers=max_workers)
+        return (self._records(WirelessClient, page) for page in pages) if records else pages
+
+    def sweep_wifi_clients(self, deadline, group=None, network=None, band=None, page_budget=None,
+                           access_token=None, max_workers=None) -> Sweep:
+        # Every wireless client that can be fetched before the deadline, like sweep_aps
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        url = self._wifi_clients_url(group=group, network=network, limit=1000, band=band)
+        return self._sweep_pages(url, 'clients', 1000, Deadline.of(deadline, page_budget),
+                                 access_token=access_token, max_workers=max_workers)
+
+    def stream_wifi_clients(self, vc=None, group=None, network=None, label=None, access_token=None, band=None,
+                            timeout=None, records=False):
+        #
+        # Yields every wireless client, one page after another, decoding each page as it is received so
+        # memory use stays flat no matter how many clients there are.
+        #
+        swarm_id = self.get_swarm_id(vc, access_token=access_token) if vc else None
+        url = self._wifi_clients_url(swarm_id=swarm_id, group=group, network=network, label=label, limit=1000,
+                                     band=band)
+        clients = self._stream_pages(url, 'clients', 1000, timeout=timeout, access_token=access_token)
+        return self._stream_records(WirelessClient, clients) if records else clients
+
+    @classmethod
+    def _wifi_clients_url(cls, swarm_id=None, group=None, network=None, label=None, limit=1000, band=None,
+                          offset=None) -> str:
         url = '/monitoring/v1/clients/wireless'
         if limit:
-            url = self._add_arg(url, f"limit={str(limit)}")
-        if vc:
-            url = self._add_arg(url, f"swarm_id={self.get_swarm_id(vc, access_token=access_token)}")
+            url = cls._add_arg(url, f"limit={str(limit)}")
+        if swarm_id:
+            url = cls._add_arg(url, f"swarm_id={swarm_id}")
         if group:
-            url = self._add_arg(url, f"group={group}")
+            url = cls._add_arg(url, f"group={group}")
         if label:
-            url = self._add_arg(url, f"label={label}")
+            url = cls._add_arg(url, f"label={label}")
         if network:
-            url = self._add_arg(url, f"network={network}")
+            url = cls._add_arg(url, f"network={network}")
         if band:
-            url = self._add_arg(url, f"band={band}")
+            url = cls._add_arg(url, f"band={band}")
         if offset:
-            url = self._add_arg(url, f"offset={str(offset)}")
-        url = self._add_arg(url, 'calculate_total=true')
-        if count_only:
-            return self._get_api(url, access_token=access_token, timeout=timeout)['count']
-        else:
-            return self._get_api(url, access_token=access_token, timeout=timeout)['clients']
+            url = cls._add_arg(url, f"offset={str(offset)}")
+        url = cls._add_arg(url, 'calculate_total=true')
+        return url
+
+    def _iter_pages(self, url, key, page_size, access_token=None, timeout=None, max_workers=None):
+        first_page = self._get_api(url, timeout=timeout, access_token=access_token)
+        items = first_page[key]
+        yield items
+        total = first_page.get('total')
+        if total is None:
+            # No total in the response, so all we can do is walk the pages one at a time.
+            offset = len(items)
+            while len(items) == page_size:
+                items = self._get_api(self._add_arg(url, f"offset={offset}"), timeout=timeout,
+                                      access_token=access_token)[key]
+                offset += len(items)
+                yield items
+            return
+        offsets = range(page_size, int(total), page_size)
+        if not offsets:
+            return
+        log.debug(f"fetching {len(offsets)} more pages of {url} with {max_workers or self.max_workers} workers")
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = [executor.submit(self._get_api, self._add_arg(url, f"offset={offset}"), timeout, access_token)
+                       for offset in offsets]
+            try:
+                for future in futures:
+                    yield future.result()[key]
+            except RateLimitError:
+                log.debug(f"rate limited while fetching {url}, cancelling remaining pages")
+                raise
+            finally:
+                for future in futures:
+                    future.cancel()
 
-    def get_networks(self, access_token: dict = None, group=None, timeout=None):
+    def _sweep_pages(self, url, key, page_size, deadline: Deadline, access_token=None, max_workers=None) -> Sweep:
+        #
+        # _iter_pages against a deadline: the pages that finished in time, in offset order. A page that fails or
+        # times out is left out rather than failing the sweep (except the first), and pages that can't finish
+        # before the deadline are not requested. Requests still running at the deadline are abandoned to their
+        # timeout.
+        #
+        errors = list()
+
+        def fetch(offset):
+            if not deadline.can_finish():
+                raise DeadlineExceeded(f"no time left for offset {offset}")
+            start = time.monotonic()
+            # The page budget replaces http_timeout here, so a sweep can wait longer than that for a page
+            data = self._get_api(self._add_arg(url, f"offset={offset}") if offset else url,
+                                 timeout=deadline.page_budget or deadline.remaining(), access_token=access_token,
+                                 deadline=deadline)
+            deadline.record_page(time.monotonic() - start)
+            return data
+
+        try:
+            first_page = fetch(0)
+        except RuntimeError:
+            raise
+        except Exception as e:
+            # Without the first page there is nothing to count: that is an error like any other, and requests'
+            # Timeout is raised as one.
+            raise RuntimeError(f"first page of {url} failed: {str(e)}") from e
+        pages = [first_page[key]]
+        total = first_page.get('total')
+        if total is None:
+            # No total, so the pages are fetched one at a time until one is short or time runs out.
+            offset = len(pages[0])
+            while len(pages[-1]) == page_size:
+                try:
+                    pages.append(fetch(offset)[key])
+                except Exception as e:
+                    errors.append(str(e))
+                    return Sweep(pages, complete=False, errors=errors)
+                offset += len(pages[-1])
+            return Sweep(pages, total=offset, errors=errors)
+        offsets = range(page_size, int(total), page_size)
+        from concurrent.futures import ThreadPoolExecutor, TimeoutError
+        executor = ThreadPoolExecutor(max_workers=max_workers or self.max_workers)
+        futures = [executor.submit(fetch, offset) for offset in offsets]
+        try:
+            for future in futures:
+                try:
+                    pages.append(future.result(timeout=max(deadline.remaining(), 0))[key])
+                except TimeoutError:
+                    errors.append("deadline passed")
+                except Exception as e:
+                    errors.append(str(e))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if errors:
+            log.debug(f"{url}: {len(errors)} of {len(offsets) + 1} pages missing at the deadline")
+        return Sweep(pages, total=int(total), complete=not errors, errors=errors)
+
+    def get_networks(self, access_token: dict = None, group=None, timeout=None, records=False):
+        networks = self._get_api(self._networks_url(group=group), access_token=access_token,
+                                 timeout=timeout)['networks']
+        return self._records(Network, networks) if records else networks
+
+    def _records(self, record_type, items) -> list:
+        #
+        # Compact records (see libarubacentral_records.py) instead of the JSON dicts. The full payload of a
+        # record is fetched again from the API when its .raw is read.
+        #
+        return record_type.from_list(items, loader=self._raw_loaders[record_type])
+
+    def _stream_records(self, record_type, items):
+        loader = self._raw_loaders[record_type]
+        return (record_type.from_json(item, loader=loader) for item in items)
+
+    @property
+    def _raw_loaders(self) -> dict:
+        return {
+            AP: lambda ap: self.get_ap(ap.serial),
+            Swarm: lambda swarm: self._get_api(f'/monitoring/v1/swarms/{swarm.swarm_id}'),
+            Network: lambda network: self._get_api(f'/monitoring/v2/networks/{network.essid}'),
+            WirelessClient: lambda client: self.get_wifi_client(client.macaddr)
+        }
+
+    @classmethod
+    def _networks_url(cls, group=None) -> str:
         url = '/monitoring/v2/networks'
         if group:
-            url = self._add_arg(url, f"group={group}")
-        return self._get_api(url, access_token=access_token, timeout=timeout)['networks']
+            url = cls._add_arg(url, f"group={group}")
+        return url
 
     def get_vcs(self, access_token: dict = None, group=None):
-        url = '/monitoring/v1/swarms'
-        if group:
-            url = self._add_arg(url, f"group={group}")
-        return self._get_api(url, access_token=access_token)['swarms']
+        return self.get_swarms(access_token=access_token, group=group)
 
     def name_ap(self, name, serial=None, mac=None, access_token=None):
         if not serial:
             if not mac:
                 raise RuntimeError("Need a Serial or Mac Address to rename an AP.")
-            else:
-                aps = self.get_aps(access_token=access_token,mac_address=mac)
-                if len(aps) == 1:
-                    serial = aps[0]['serial']
-                elif len(aps) > 1:
-                    for i in aps:
-                        if mac.lower().replace(' ','').replace('-','').replace(':','') == i['macaddr'].replace(';',''):
-                            serial = i['serial']
-                else:
-                    raise RuntimeError(f"Could not find AP with Mac Address {mac}")
+            # The MAC address is looked up in the AP inventory, and only a MAC it doesn't know (a new AP)
+            # costs a fresh sweep.
+            ap = self.get_inventory(access_token=access_token).find(mac=mac)
+            if not ap and self._inventory.age() > 60:
+                ap = self.get_inventory(refresh=True, access_token=access_token).find(mac=mac)
+            if not ap:
+                raise RuntimeError(f"Could not find AP with Mac Address {mac}")
+            serial = ap.serial
         url = f'/configuration/v2/ap_settings/{serial}'
         ap_settings = self._get_api(url, access_token=access_token)
         if not 'hostname' in ap_settings:
@@ -390,3 +1365,135 @@ class ArubaCentralAuth:
         if ap_settings['hostname'] != name:
             ap_settings.update({'hostname': name})
             return self._post_api(url, data=ap_settings, access_token=access_token)
+
+    def rename_aps(self, renames: list, journal=None, max_workers=None, prefetch=True, access_token=None) -> list:
+        #
+        # Bulk name_ap. renames is a list of {'name': new name, 'serial': serial} or {'name': ..., 'mac': ...}.
+        # A fresh AP inventory resolves every MAC address to a serial and skips the APs that already have
+        # their new name (prefetch=False uses the saved inventory instead, or none if every rename has a serial).
+        # The remaining APs are renamed by max_workers threads, a GET and a POST of the AP settings each, all
+        # under the profile's rate limiter.
+        #
+        # With a journal file every result is appended to it as one line of JSON as soon as it is in, and
+        # renames already done (renamed or unchanged) in an earlier run with the same journal are skipped,
+        # so a failed run continues where it stopped. Returns a result per rename, with a status of renamed,
+        # unchanged, done (in an earlier run), not found or failed (with the error).
+        #
+        if not access_token:
+            self.authenticate()
+            access_token = self.access_token
+        done = self._read_rename_journal(journal) if journal else set()
+        inventory = ApInventory(list())
+        if prefetch:
+            inventory = self.get_inventory(refresh=True, access_token=access_token)
+        elif any(not rename.get('serial') for rename in renames):
+            inventory = self.get_inventory(access_token=access_token)
+
+        results = list()
+        pending = list()
+        for rename in renames:
+            result = {'name': rename['name'], 'serial': rename.get('serial'), 'mac': rename.get('mac'),
+                      'status': None, 'error': None}
+            results.append(result)
+            if not result['serial']:
+                ap = inventory.find(mac=result['mac'])
+                if not ap:
+                    result['status'] = 'not found'
+                    result['error'] = f"Could not find AP with Mac Address {result['mac']}"
+                    continue
+                result['serial'] = ap.serial
+            # Only a fresh inventory has the current names
+            current = inventory.find(serial=result['serial']) if prefetch else None
+            if (result['serial'], result['name']) in done:
+                result['status'] = 'done'
+            elif current and current.name == result['name']:
+                result['status'] = 'unchanged'
+            else:
+                pending.append(result)
+
+        journal_lock = threading.Lock()
+        journal_file = open(journal, 'a') if journal else None
+
+        def record(result):
+            if journal_file and result['status'] != 'done':
+                with journal_lock:
+                    journal_file.write(json.dumps(dict(result, time=time.time())) + '\n')
+                    journal_file.flush()
+
+        def rename_one(result):
+            try:
+                result['status'] = self._rename_ap(result['serial'], result['name'], access_token)
+            except (RuntimeError, OSError) as e:  # requests exceptions are OSErrors
+                result['status'] = 'failed'
+                result['error'] = str(e)
+            record(result)
+
+        from concurrent.futures import ThreadPoolExecutor
+        try:
+            for result in results:
+                if result['status']:
+                    record(result)
+            log.debug(f"renaming {len(pending)} of {len(renames)} APs with {max_workers or self.max_workers} workers")
+            with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+                for _ in executor.map(rename_one, pending):
+                    pass
+        finally:
+            if journal_file:
+                journal_file.close()
+        return results
+
+    def _rename_ap(self, serial, name, access_token=None) -> str:
+        url = f'/configuration/v2/ap_settings/{serial}'
+        ap_settings = self._get_api(url, access_token=access_token)
+        if ap_settings.get('hostname') == name:
+            return 'unchanged'
+        ap_settings.update({'hostname': name})
+        self._post_api(url, data=ap_settings, access_token=access_token)
+        return 'renamed'
+
+    @staticmethod
+    def _read_rename_journal(journal) -> set:
+        # (serial, name) of the renames a journal records as renamed or unchanged
+        done = set()
+        if not os.path.exists(journal):
+            return done
+        with open(journal, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # The last line of a run that was killed mid write
+                    continue
+                if result.get('status') in ('renamed', 'unchanged'):
+                    done.add((result['serial'], result['name']))
+        return done
+
+
+def open_profiles(profiles: list, configpath, debug=False) -> dict:
+    #
+    # An ArubaCentralAuth per profile, {profile: session}. Each has its own token, rate limiter, connection
+    # pool and caches, exactly as if every profile was polled by its own process.
+    #
+    return {profile: ArubaCentralAuth(ArubaCentralConfig(profile, configpath, debug).read_config())
+            for profile in profiles}
+
+
+def poll_profiles(sessions: dict, poll, max_workers=None):
+    #
+    # Call poll(session) for every profile at the same time, one thread per profile (or max_workers).
+    # Returns ({profile: result}, {profile: exception}), so one failing tenant doesn't hide the others.
+    #
+    from concurrent.futures import ThreadPoolExecutor
+    results = dict()
+    errors = dict()
+    if not sessions:
+        return results, errors
+    with ThreadPoolExecutor(max_workers=max_workers or len(sessions)) as executor:
+        futures = {profile: executor.submit(poll, session) for profile, session in sessions.items()}
+        for profile, future in futures.items():
+            try:
+                results[profile] = future.result()
+            except Exception as e:
+                log.error(f"polling profile {profile} failed: {str(e)}")
+                errors[profile] = e
+    return results, errors
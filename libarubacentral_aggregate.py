@@ -0,0 +1,208 @@
+from array import array
+from collections import Counter
+from itertools import compress
+
+#
+# Client statistics for the collectd scripts. Each field a statistic needs is read out of a page of client
+# dicts once, into a list, and the histograms are Counters over those lists. This is no vectorized engine:
+# in pure Python it runs at about the speed of the per-client loop it replaced (benchmarks/bench_aggregate.py).
+# What it adds is one place for the statistics, accumulated over pages (ClientAggregator) and updated per
+# client between polls (ClientAggregator.adjust).
+#
+SICK_HEALTH = 75
+UNCLASSIFIED_OS = 'Unclassified Device'
+
+
+class ClientColumns:
+    # The fields counted per value
+    COUNTED = ('band', 'os_type', 'network', 'swarm_id')
+
+    def __init__(self, clients):
+        if not isinstance(clients, list):
+            clients = list(clients)
+        self.clients = clients
+        self.length = len(clients)
+        self.values = {field: [client.get(field) for client in clients] for field in self.COUNTED}
+        self.health = array('f', [health for health in [client.get('health') for client in clients]
+                                  if health is not None])
+        self.connection = [connection for connection in [client.get('connection') for client in clients]
+                           if connection]
+        self._counts = dict()
+
+    def value_counts(self, field) -> Counter:
+        if field not in self._counts:
+            self._counts[field] = Counter(self.values[field])
+        return self._counts[field]
+
+    def sick_count(self) -> int:
+        return sum(map(float(SICK_HEALTH).__gt__, self.health))
+
+    def connection_counts(self) -> Counter:
+        # A client can list several connection types, split each distinct value once.
+        counts = Counter()
+        for connection, count in Counter(self.connection).items():
+            for part in connection.split(', '):
+                counts[part] += count
+        return counts
+
+    def unmatched(self, field, known) -> list:
+        # The clients whose value in field is not in known (e.g. swarm IDs we have no name for)
+        return list(compress(self.clients, [value not in known for value in self.values[field]]))
+
+
+class ClientAggregator:
+    #
+    # Accumulates the client statistics of arubacentral_client.py over any number of pages:
+    #
+    #   aggregator = ClientAggregator(swarm_names, swarm_groups)
+    #   for page in session.iter_all_wifi_clients():
+    #       aggregator.add(page)
+    #   counts = aggregator.result()
+    #
+    def __init__(self, swarm_names: dict = None, swarm_groups: dict = None):
+        self.swarm_names = swarm_names or dict()
+        self.swarm_groups = swarm_groups or dict()
+        self.total = 0
+        self.sick = 0
+        self.band = Counter()
+        self.os = Counter()
+        self.network = Counter()
+        self.swarm = Counter()
+        self.unknown_swarm = Counter()
+        self.connection = Counter()
+
+    def add(self, clients):
+        columns = ClientColumns(clients)
+        self.total += columns.length
+        self.sick += columns.sick_count()
+        self.band.update(columns.value_counts('band'))
+        self.os.update(columns.value_counts('os_type'))
+        self.network.update(columns.value_counts('network'))
+        self.swarm.update(columns.value_counts('swarm_id'))
+        self.connection.update(columns.connection_counts())
+        # Only the few clients without a known swarm need their group looked at.
+        for client in columns.unmatched('swarm_id', self.swarm_names):
+            self.unknown_swarm[(client.get('swarm_id'), client.get('group'), client.get('group_name'))] += 1
+        return columns
+
+    @staticmethod
+    def record(client) -> tuple:
+        # The fields of a client the statistics depend on, as a hashable tuple (see adjust)
+        health = client.get('health')
+        return (client.get('band'), client.get('os_type'), client.get('network'), client.get('swarm_id'),
+                client.get('group'), client.get('group_name'), health is not None and health < SICK_HEALTH,
+                client.get('connection'))
+
+    def adjust(self, record: tuple, delta=1):
+        #
+        # Count (delta=1) or uncount (delta=-1) a single client record, so the statistics can follow the
+        # clients that changed between two polls instead of being rebuilt. Counts that drop to zero are
+        # removed, so the result is the same as counting the current clients from scratch.
+        #
+        band, os_type, network, swarm_id, group, group_name, sick, connection = record
+        self.total += delta
+        if sick:
+            self.sick += delta
+        _bump(self.band, band, delta)
+        _bump(self.os, os_type, delta)
+        _bump(self.network, network, delta)
+        _bump(self.swarm, swarm_id, delta)
+        if swarm_id not in self.swarm_names:
+            _bump(self.unknown_swarm, (swarm_id, group, group_name), delta)
+        if connection:
+            for part in connection.split(', '):
+                _bump(self.connection, part, delta)
+
+    def result(self) -> dict:
+        band = {'2.4': 0, '5': 0, '6': 0}
+        for value, count in self.band.items():
+            if value == 5:
+                band['5'] += count
+            elif value == 6:
+                band['6'] += count
+            else:
+                band['2.4'] += count
+        os_counts = dict()
+        for value, count in self.os.items():
+            if value is None or value == '--':
+                value = UNCLASSIFIED_OS
+            os_counts[value] = os_counts.get(value, 0) + count
+        vc_counts = dict()
+        swarm_counts = dict()
+        group_counts = dict()
+        for swarm_id, count in self.swarm.items():
+            if swarm_id in self.swarm_names:
+                vc = self.swarm_names[swarm_id]
+                vc_counts[vc] = vc_counts.get(vc, 0) + count
+                if self.swarm_groups.get(swarm_id):
+                    group = self.swarm_groups[swarm_id]
+                    group_counts[group] = group_counts.get(group, 0) + count
+            if swarm_id:
+                swarm_counts[swarm_id] = count
+        for (swarm_id, group, group_name), count in self.unknown_swarm.items():
+            if group_name or group:
+                group_counts[group_name or group] = group_counts.get(group_name or group, 0) + count
+            # Clients of an unknown swarm are counted under their group instead of a VC name.
+            vc = group or group_name
+            if vc:
+                vc_counts[vc] = vc_counts.get(vc, 0) + count
+        return {
+            'total': self.total,
+            'sick': self.sick,
+            'band': band,
+            'os': os_counts,
+            'connection': dict(self.connection),
+            'ssid': {network: count for network, count in self.network.items() if network},
+            'vc': vc_counts,
+            'swarm': swarm_counts,
+            'group': group_counts
+        }
+
+
+def _bump(counter: Counter, key, delta):
+    counter[key] += delta
+    if not counter[key]:
+        del counter[key]
+
+
+def aggregate_clients(clients, swarm_names: dict = None, swarm_groups: dict = None) -> dict:
+    aggregator = ClientAggregator(swarm_names, swarm_groups)
+    aggregator.add(clients)
+    return aggregator.result()
+
+
+def aggregate_aps(aps) -> dict:
+    #
+    # Total and down AP counts per swarm, per group, and per group within a swarm, from any iterable of APs
+    # (or pages of APs from iter_all_aps, flattened).
+    #
+    aggregate = {'swarms': dict(), 'groups': dict(), 'swarm_groups': dict()}
+    for ap in aps:
+        count_ap(aggregate, ap.get('swarm_id'), ap.get('group_name'), ap.get('status') == 'Down')
+    return aggregate
+
+
+def count_ap(aggregate: dict, swarm_id, group_name, down: bool, delta=1):
+    # Count (delta=1) or uncount (delta=-1) one AP in an aggregate_aps result, dropping locations left empty
+    swarm_groups = aggregate['swarm_groups'].setdefault(swarm_id, dict())
+    for location, key in ((aggregate['swarms'], swarm_id), (aggregate['groups'], group_name),
+                          (swarm_groups, group_name)):
+        counts = location.setdefault(key, {'total': 0, 'down': 0})
+        counts['total'] += delta
+        if down:
+            counts['down'] += delta
+        if not counts['total']:
+            del location[key]
+    if not swarm_groups:
+        del aggregate['swarm_groups'][swarm_id]
+
+
+def ap_counts(aggregate: dict, swarm_id=None, group=None) -> dict:
+    # The {'total', 'down'} counts of an aggregate_aps result for a swarm, a group, or a group within a swarm
+    empty = {'total': 0, 'down': 0}
+    if swarm_id and group:
+        return aggregate['swarm_groups'].get(swarm_id, dict()).get(group, empty)
+    elif swarm_id:
+        return aggregate['swarms'].get(swarm_id, empty)
+    else:
+        return aggregate['groups'].get(group, empty)
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+
+import aiohttp
+
+from libarubacentral import ArubaCentralAuth, RateLimitError
+
+log = logging.getLogger('libarubacentral.async')
+
+
+class AsyncArubaCentralAuth:
+    #
+    # asyncio counterpart of ArubaCentralAuth. Token handling (stored token file, refresh, new login) is
+    # delegated to a regular ArubaCentralAuth, so both share the same token for a profile. The monitoring
+    # calls are made with aiohttp, so many of them can be awaited at once from a single event loop:
+    #
+    #   async with AsyncArubaCentralAuth(cfgdata) as session:
+    #       counts = await asyncio.gather(*[session.get_client_count(swarm_id=i) for i in swarm_ids])
+    #
+    def __init__(self, cfgdata, auth: ArubaCentralAuth = None):
+        if not auth:
+            auth = ArubaCentralAuth(cfgdata)
+        self.auth = auth
+        self.cfgdata = auth.cfgdata
+        self.profile = auth.profile
+        self.http_timeout = auth.http_timeout
+        self._session = None
+        self._auth_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if not self._session or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.auth.http_pool_size)
+            self._session = aiohttp.ClientSession(connector=connector, headers={'Accept-Encoding': 'gzip, deflate'})
+        return self._session
+
+    def _token_valid(self) -> bool:
+        access_token = self.auth.access_token
+        return bool(access_token) and datetime.now() < datetime.fromtimestamp(access_token['expires_at'])
+
+    async def authenticate(self):
+        if self._token_valid():
+            return
+        if not self._auth_lock:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            # Another task may have authenticated while we were waiting for the lock.
+            if not self._token_valid():
+                await asyncio.get_running_loop().run_in_executor(None, self.auth.authenticate)
+
+    async def _get_api(self, url, timeout=None, access_token: dict = None) -> dict:
+        if not timeout and self.http_timeout:
+            timeout = self.http_timeout
+        if not access_token:
+            await self.authenticate()
+            access_token = self.auth.access_token
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': 'Bearer ' + access_token['access_token']
+        }
+        log.debug(f"async get: {url}")
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            # Same per-profile rate limiter and retry rules as ArubaCentralAuth._send
+            await loop.run_in_executor(None, self.auth.rate_limiter.acquire)
+            start = time.perf_counter()
+            try:
+                async with self._get_session().get(self.cfgdata['url'] + url, headers=headers,
+                                                   timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                    status = r.status
+                    body = await r.read()
+                    response_headers = r.headers
+                    text = body.decode(r.get_encoding())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.auth.stats.record_request(url, 'error', time.perf_counter() - start, retry=attempt > 0)
+                if attempt >= self.auth.http_retries:
+                    raise
+                delay = ArubaCentralAuth._backoff_delay(attempt)
+                log.debug(f"{type(e).__name__} on {url}, retrying in {delay:.1f} seconds")
+            else:
+                # Same per endpoint counters as the synchronous calls
+                self.auth.stats.record_request(url, status, time.perf_counter() - start, len(body),
+                                               retry=attempt > 0)
+                self.auth.rate_limiter.update_from_headers(response_headers)
+                if status == 200:
+                    start = time.perf_counter()
+                    data = json.loads(text)
+                    self.auth.stats.record_parse(url, time.perf_counter() - start)
+                    return data
+                if status not in (429, 502, 503, 504) or attempt >= self.auth.http_retries:
+                    if status == 429:
+                        raise RateLimitError(f"STATUS CODE: {str(status)} \nDetail: {text}")
+                    raise RuntimeError(f"STATUS CODE: {str(status)} \nDetail: {text}")
+                delay = ArubaCentralAuth._retry_after(r)
+                if delay is None:
+                    delay = ArubaCentralAuth._backoff_delay(attempt)
+                if status == 429:
+                    self.auth.rate_limiter.backoff(delay)
+                log.debug(f"STATUS CODE {status} on {url}, retrying in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get_swarm_id(self, name: str, access_token: dict = None) -> str:
+        # The swarm cache lives in the wrapped ArubaCentralAuth, so it is shared with the synchronous calls.
+        if not self.auth._swarm_cache_fresh():
+            await self.get_swarms(access_token=access_token)
+        elif self.auth._swarm_cache_miss(name):
+            # Maybe a VC added since the cache was filled, like ArubaCentralAuth.get_swarm
+            await self.get_swarms(access_token=access_token)
+            self.auth._swarm_cache_refetched.add(name.lower())
+        return self.auth._find_swarm(name)['swarm_id']
+
+    async def get_aps(self, access_token: dict = None, limit: int = None, status: str = None, vc: str = None,
+                      group: str = None, client_count: bool = None, label: str = None, swarm_id=None,
+                      mac_address=None, timeout=None):
+        # Every AP matching the filters, or the first limit APs, like ArubaCentralAuth.get_aps
+        if not swarm_id and vc:
+            swarm_id = await self.get_swarm_id(vc, access_token=access_token)
+        page_size = min(limit, 1000) if limit else 1000
+        url = ArubaCentralAuth._aps_url(limit=page_size, status=status, group=group, client_count=client_count,
+                                        label=label, swarm_id=swarm_id, mac_address=mac_address)
+        return await self._get_pages(url, 'aps', page_size, limit=limit, timeout=timeout, access_token=access_token)
+
+    async def get_down_aps(self, vc=None, group=None, access_token=None, swarm_id=None):
+        return await self.get_aps(status='Down', vc=vc, group=group, access_token=access_token, swarm_id=swarm_id)
+
+    async def get_swarms(self, access_token: dict = None, group=None) -> list:
+        url = ArubaCentralAuth._swarms_url(group=group, limit=1000)
+        swarms = await self._get_pages(url, 'swarms', 1000, access_token=access_token)
+        if not group:
+            self.auth._update_swarm_cache(swarms)
+        return swarms
+
+    async def _get_pages(self, url, key, page_size, limit=None, timeout=None, access_token: dict = None) -> list:
+        #
+        # Every item of a paginated call (or the first limit items). The pages after the first are awaited
+        # together when the API reports a total, at most max_workers at a time like the threaded page fetch,
+        # one after the other otherwise.
+        #
+        first_page = await self._get_api(url, timeout=timeout, access_token=access_token)
+        items = first_page[key]
+        total = first_page.get('total')
+        if limit:
+            total = min(int(total), limit) if total is not None else None
+        if total is not None:
+            semaphore = asyncio.Semaphore(self.auth.max_workers)
+
+            async def get_page(offset):
+                async with semaphore:
+                    return await self._get_api(ArubaCentralAuth._add_arg(url, f"offset={offset}"), timeout=timeout,
+                                               access_token=access_token)
+            pages = await asyncio.gather(*[get_page(offset) for offset in range(page_size, int(total), page_size)])
+            for page in pages:
+                items += page[key]
+        else:
+            page = items
+            while len(page) == page_size and not (limit and len(items) >= limit):
+                page = (await self._get_api(ArubaCentralAuth._add_arg(url, f"offset={len(items)}"),
+                                            timeout=timeout, access_token=access_token))[key]
+                items += page
+        return items[:limit] if limit else items
+
+    async def get_client_count(self, vc=None, group=None, network=None, label=None, access_token=None,
+                               swarm_id=None, timeout=None):
+        if not swarm_id and vc:
+            swarm_id = await self.get_swarm_id(vc, access_token=access_token)
+        url = ArubaCentralAuth._client_count_url(group=group, network=network, label=label, swarm_id=swarm_id)
+        return (await self._get_api(url, access_token=access_token, timeout=timeout))['count']
+
+    async def get_wifi_clients(self, vc=None, group=None, network=None, label=None, access_token=None,
+                               count_only=False, limit=1000, band=None, offset=None, timeout=None):
+        swarm_id = await self.get_swarm_id(vc, access_token=access_token) if vc else None
+        url = ArubaCentralAuth._wifi_clients_url(swarm_id=swarm_id, group=group, network=network, label=label,
+                                                 limit=limit, band=band, offset=offset)
+        data = await self._get_api(url, access_token=access_token, timeout=timeout)
+        if count_only:
+            return data['count']
+        else:
+            return data['clients']
+
+    async def get_networks(self, access_token: dict = None, group=None, timeout=None):
+        url = ArubaCentralAuth._networks_url(group=group)
+        return (await self._get_api(url, access_token=access_token, timeout=timeout))['networks']
@@ -0,0 +1,115 @@
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+log = logging.getLogger('libarubacentral.cache')
+
+
+class ResponseCache:
+    #
+    # Response cache shared by every process using the same config path. Responses are kept in a SQLite file,
+    # keyed by profile and URL, and are fresh for the TTL configured for the longest matching URL path prefix:
+    #
+    #   response_cache:
+    #     default_ttl: 0
+    #     ttl:
+    #       /monitoring/v1/swarms: 300
+    #       /monitoring/v1/aps: 30
+    #
+    # On a miss only one process (and one thread) fetches a key, the others wait on a lock for that key and
+    # then read the freshly stored response.
+    #
+    LOCK_SLOTS = 65536
+
+    def __init__(self, path, ttl: dict = None, default_ttl=0):
+        self.path = path
+        self.default_ttl = float(default_ttl or 0)
+        self.ttl = sorted(((prefix, float(value)) for prefix, value in (ttl or dict()).items()),
+                          key=lambda item: len(item[0]), reverse=True)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_locks = dict()
+        self._thread_locks_guard = threading.Lock()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS responses "
+                       "(key TEXT PRIMARY KEY, fetched_at REAL NOT NULL, body TEXT NOT NULL)")
+
+    @classmethod
+    def from_config(cls, cfgdata: dict):
+        settings = cfgdata.get('response_cache')
+        if not settings:
+            return None
+        path = settings.get('path') or cfgdata['configpath'] + "/cache/responses.sqlite"
+        return cls(path, ttl=settings.get('ttl'), default_ttl=settings.get('default_ttl', 0))
+
+    def ttl_for(self, url: str) -> float:
+        path = url.split('?', 1)[0]
+        for prefix, ttl in self.ttl:
+            if path.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key: str, ttl: float):
+        with self._connect() as db:
+            row = db.execute("SELECT fetched_at, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row and time.time() - row[0] < ttl:
+            return row[1]
+        return None
+
+    def put(self, key: str, body: str):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO responses (key, fetched_at, body) VALUES (?, ?, ?)",
+                       (key, time.time(), body))
+
+    def fetch(self, key: str, ttl: float, fetcher) -> str:
+        body = self.get(key, ttl)
+        if body is not None:
+            self.hits += 1
+            return body
+        with self._key_lock(key):
+            # Someone else may have fetched it while we were waiting for the lock.
+            body = self.get(key, ttl)
+            if body is not None:
+                self.hits += 1
+                return body
+            self.misses += 1
+            body = fetcher()
+            self.put(key, body)
+        return body
+
+    def purge(self, older_than: float = 86400):
+        with self._connect() as db:
+            db.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - older_than,))
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def _key_lock(self, key: str):
+        #
+        # fcntl record locks only exclude other processes, so threads of this process also take a thread lock
+        # for the same slot.
+        #
+        slot = zlib.crc32(key.encode()) % self.LOCK_SLOTS
+        with self._thread_locks_guard:
+            thread_lock = self._thread_locks.setdefault(slot, threading.Lock())
+        with thread_lock:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, slot)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, slot)
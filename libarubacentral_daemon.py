@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from libarubacentral_aggregate import ClientAggregator, aggregate_aps
+from libarubacentral_deadline import Deadline
+from libarubacentral_state import StateStore
+
+log = logging.getLogger('libarubacentral.daemon')
+
+
+class Collector:
+    #
+    # Polls every metric family for one profile with a single ArubaCentralAuth, so the token, swarm cache and
+    # connection pool stay warm between intervals. Each endpoint is fetched at most once per poll and shared
+    # by every family that needs it:
+    #
+    #   aps          down/total AP counts per swarm and group (one AP sweep)
+    #   clients      the full arubacentral_client.py breakdown (one client sweep)
+    #   vc_counts    clients per VC name, including VCs without clients (same client sweep)
+    #   ssid_counts  clients per SSID, including SSIDs without clients (same client sweep)
+    #
+    # The APs and clients of the last poll are kept in a StateStore, so each poll only recounts what changed,
+    # and the aps and clients data carry the changes since the previous poll.
+    #
+    # With a deadline (seconds per poll), the sweeps return the pages that finished in time. Partial aps and
+    # clients data are counted from those pages alone, without changes and without touching the state (the
+    # missing APs and clients didn't leave), and carry the share fetched as 'coverage' (1.0 when complete).
+    #
+    FAMILIES = ('aps', 'clients', 'vc_counts', 'ssid_counts')
+
+    def __init__(self, session, group=None, families=None, state: StateStore = None, deadline=None):
+        self.session = session
+        self.group = group
+        self.deadline = deadline
+        self.state = state or StateStore()
+        self.families = tuple(families) if families else self.FAMILIES
+        for family in self.families:
+            if family not in self.FAMILIES:
+                raise RuntimeError(f"Unknown metric family {family}")
+        self.results = dict()
+        self._lock = threading.Lock()
+
+    def poll(self):
+        start = time.time()
+        deadline = Deadline(self.deadline) if self.deadline else None
+        swarms = None
+        try:
+            swarms = self.session.get_swarms(group=self.group)
+        except RuntimeError as e:
+            log.error(f"swarm list failed: {str(e)}")
+        if 'aps' in self.families:
+            self._collect('aps', lambda: self._collect_aps(swarms, deadline))
+        client_families = [family for family in ('clients', 'vc_counts', 'ssid_counts') if family in self.families]
+        if client_families:
+            try:
+                counts = self._collect_clients(swarms, deadline)
+                networks = None
+                if 'ssid_counts' in client_families:
+                    networks = self.session.get_networks(group=self.group)
+            except Exception as e:
+                for family in client_families:
+                    self._record_error(family, e)
+            else:
+                self._collect('clients', lambda: counts)
+                if 'vc_counts' in client_families:
+                    self._collect('vc_counts', lambda: self._vc_counts(swarms, counts))
+                if 'ssid_counts' in client_families:
+                    self._collect('ssid_counts', lambda: self._ssid_counts(networks, counts))
+        log.debug(f"poll finished in {time.time() - start:.1f} seconds")
+
+    def get(self, family) -> dict:
+        with self._lock:
+            return self.results.get(family)
+
+    def _collect(self, family, fetch):
+        try:
+            result = {'family': family, 'updated': time.time(), 'data': fetch(), 'error': None}
+        except Exception as e:
+            self._record_error(family, e)
+        else:
+            with self._lock:
+                self.results[family] = result
+
+    def _record_error(self, family, error):
+        log.error(f"{family} failed: {str(error)}")
+        # Keep serving the last good data, marked with the error.
+        with self._lock:
+            result = dict(self.results.get(family) or {'family': family, 'updated': None, 'data': None})
+            result['error'] = str(error)
+            self.results[family] = result
+
+    def _collect_aps(self, swarms, deadline=None):
+        swarm_list = self._swarm_list(swarms)
+        if deadline:
+            sweep = self.session.sweep_aps(deadline, group=self.group)
+            if not sweep.complete:
+                log.warning(f"AP sweep partial at the deadline ({len(sweep.errors)} pages missing)")
+                counts = aggregate_aps(sweep.items())
+                counts['swarm_list'] = swarm_list
+                counts['coverage'] = sweep.coverage
+                return counts
+            pages = sweep.pages
+        else:
+            pages = self.session.iter_all_aps(group=self.group)
+        changes = self.state.update_aps(pages)
+        self._save_state()
+        counts = self.state.ap_aggregate()
+        counts['swarm_list'] = swarm_list
+        counts['changes'] = changes
+        counts['coverage'] = 1.0
+        return counts
+
+    def _collect_clients(self, swarms, deadline=None):
+        swarm_list = self._swarm_list(swarms)
+        swarm_names = {swarm['swarm_id']: swarm['name'] for swarm in swarm_list}
+        swarm_groups = {swarm['swarm_id']: swarm['group_name'] for swarm in swarm_list}
+        if deadline:
+            sweep = self.session.sweep_wifi_clients(deadline, group=self.group)
+            if not sweep.complete:
+                log.warning(f"client sweep partial at the deadline ({len(sweep.errors)} pages missing)")
+                aggregator = ClientAggregator(swarm_names, swarm_groups)
+                for page in sweep.pages:
+                    aggregator.add(page)
+                counts = aggregator.result()
+                counts['coverage'] = sweep.coverage
+                return counts
+            pages = sweep.pages
+        else:
+            pages = self.session.iter_all_wifi_clients(group=self.group)
+        changes = self.state.update_clients(pages, swarm_names, swarm_groups)
+        self._save_state()
+        counts = self.state.client_counts()
+        counts['changes'] = {'joined': len(changes['joined']), 'left': len(changes['left']),
+                             'roamed': len(changes['roamed'])}
+        counts['coverage'] = 1.0
+        return counts
+
+    def _save_state(self):
+        if self.state.path:
+            try:
+                self.state.save()
+            except OSError as e:
+                log.error(f"can't save state to {self.state.path}: {str(e)}")
+
+    @staticmethod
+    def _swarm_list(swarms) -> list:
+        if swarms is None:
+            raise RuntimeError("no swarm list")
+        return [{'name': swarm['name'], 'swarm_id': swarm['swarm_id'], 'group_name': swarm.get('group_name')}
+                for swarm in swarms]
+
+    @staticmethod
+    def _vc_counts(swarms, counts) -> dict:
+        return {swarm['name']: counts['swarm'].get(swarm['swarm_id'], 0) for swarm in swarms or list()}
+
+    @staticmethod
+    def _ssid_counts(networks, counts) -> dict:
+        ssid_counts = {network['essid']: 0 for network in networks or list()}
+        ssid_counts.update(counts['ssid'])
+        return ssid_counts
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        family = self.rfile.readline().decode().strip()
+        profile = None
+        if '/' in family:
+            profile, family = family.split('/', 1)
+        collector = self.server.collectors.get(profile or self.server.default_profile)
+        result = None
+        if collector and family == 'api_stats':
+            result = {'family': family, 'updated': time.time(), 'data': collector.session.api_stats(), 'error': None}
+        elif family == 'scheduler' and self.server.scheduler:
+            result = {'family': family, 'updated': time.time(), 'data': self.server.scheduler.stats(), 'error': None}
+        elif collector:
+            result = collector.get(family)
+        if result is None:
+            result = {'family': family, 'updated': None, 'data': None,
+                      'error': f"No data for {family}" + (f" of profile {profile}" if profile else "")}
+        self.wfile.write(json.dumps(result).encode() + b'\n')
+
+
+class CollectorServer(socketserver.ThreadingUnixStreamServer):
+    #
+    # Serves the latest result of each family over a unix socket: the client sends the family name, or
+    # <profile>/<family> when the daemon polls several profiles, and a newline, and gets one line of JSON
+    # back. A family without a profile is answered from the first profile. The api_stats family is the
+    # profile's ArubaCentralAuth.api_stats(), and the scheduler family the stats of the polling scheduler.
+    #
+    daemon_threads = True
+
+    def __init__(self, socket_path, collectors, scheduler=None):
+        if isinstance(collectors, Collector):
+            collectors = {collectors.session.profile: collectors}
+        self.collectors = collectors
+        self.scheduler = scheduler
+        self.default_profile = next(iter(collectors))
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+
+
+def query_daemon(socket_path, family, max_age=None, timeout=5, profile=None) -> dict:
+    #
+    # Ask a running arubacentral_daemon.py for the latest data of a family (of a profile, or of its first
+    # profile). Raises RuntimeError when the daemon has no data, or only data older than max_age seconds.
+    #
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            raise RuntimeError(f"Can't connect to the collector daemon at {socket_path}: {str(e)}")
+        sock.sendall((f"{profile}/{family}" if profile else family).encode() + b'\n')
+        response = b''
+        while not response.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    result = json.loads(response)
+    if result['data'] is None:
+        raise RuntimeError(result['error'] or f"No data for {family}")
+    if max_age and time.time() - result['updated'] > max_age:
+        raise RuntimeError(f"{family} data is {int(time.time() - result['updated'])} seconds old"
+                           + (f", last error: {result['error']}" if result['error'] else ""))
+    return result
@@ -0,0 +1,87 @@
+import threading
+import time
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class Deadline:
+    #
+    # An overall time budget for a sweep of many pages, with a budget per page:
+    #
+    #   deadline = Deadline(50, page_budget=20)
+    #   sweep = session.sweep_wifi_clients(deadline)
+    #
+    # Every page request of the sweep gets the page budget as its timeout (the time left when there is no
+    # budget), cut to the time left, instead of http_timeout. Retries are not waited for when they would end
+    # after the deadline, and a page is not requested at all when pages have so far taken longer than the time
+    # left (can_finish()). The page time is a moving average of the pages of this sweep.
+    #
+    def __init__(self, seconds, page_budget=None):
+        self.expires = time.monotonic() + float(seconds)
+        self.page_budget = page_budget
+        self._page_seconds = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, deadline, page_budget=None):
+        # A Deadline as is, or a new one of that many seconds
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline, page_budget=page_budget)
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, timeout=None) -> float:
+        # The timeout of the next request: the timeout it was sent with (http_timeout unless the caller gave
+        # one, e.g. the page budget), cut to the page budget and the time left
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline passed")
+        return min(value for value in (timeout, self.page_budget, remaining) if value)
+
+    def can_finish(self) -> bool:
+        with self._lock:
+            page_seconds = self._page_seconds or 0.0
+        return self.remaining() > page_seconds
+
+    def record_page(self, seconds: float):
+        with self._lock:
+            if self._page_seconds is None:
+                self._page_seconds = seconds
+            else:
+                self._page_seconds = 0.7 * self._page_seconds + 0.3 * seconds
+
+
+class Sweep:
+    #
+    # The pages of a sweep that finished before its deadline. coverage is the share of the items that were
+    # fetched (1.0 for a complete sweep), or None when the API gave no total and the sweep did not finish.
+    # errors has why pages are missing: failed requests, and the pages not requested for lack of time.
+    #
+    def __init__(self, pages: list, total=None, complete=True, errors=None):
+        self.pages = pages
+        self.total = total
+        self.complete = complete
+        self.errors = errors or list()
+
+    @property
+    def count(self) -> int:
+        return sum(len(page) for page in self.pages)
+
+    @property
+    def coverage(self):
+        if self.complete:
+            return 1.0
+        if not self.total:
+            return None
+        return min(self.count / self.total, 1.0)
+
+    def items(self):
+        for page in self.pages:
+            yield from page
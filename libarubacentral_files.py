@@ -0,0 +1,24 @@
+import json
+import os
+import tempfile
+
+
+def write_json(path, data, mode=0o644):
+    #
+    # Write data as JSON to a temporary file of its own next to path, then rename it over path: readers never
+    # see half a file, and writers racing for the same path (a check and its background refresh, two processes
+    # renewing a token) each rename a complete file, the last one winning. Raises OSError like open() does.
+    #
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            os.fchmod(file.fileno(), mode)
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,43 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+#
+# The requests side of ArubaCentralAuth. Importing requests takes longer than the rest of a cached plugin run,
+# so libarubacentral only imports this module once the first HTTP request is sent.
+#
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    #
+    # HTTPAdapter that keeps track of how many requests went through the pool, so we can tell
+    # how many of them reused a kept-alive connection instead of opening a new one.
+    #
+    def __init__(self, *args, **kwargs):
+        self.requests_sent = 0
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        self.requests_sent += 1
+        return super().send(request, *args, **kwargs)
+
+    def connection_stats(self) -> dict:
+        new_connections = 0
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+            if pool:
+                new_connections += pool.num_connections
+        return {
+            'requests': self.requests_sent,
+            'new_connections': new_connections,
+            'reused_connections': max(self.requests_sent - new_connections, 0)
+        }
+
+
+def new_session(pool_size: int):
+    # A requests.Session with keep-alive connection pools of pool_size, and the adapter counting its requests
+    adapter = CountingHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session, adapter
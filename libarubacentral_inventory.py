@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import time
+
+from libarubacentral_files import write_json
+from libarubacentral_records import AP
+
+log = logging.getLogger('libarubacentral.inventory')
+
+
+def normalize_mac(mac: str) -> str:
+    return mac.lower().replace(' ', '').replace('-', '').replace(':', '').replace('.', '')
+
+
+class ApInventory:
+    #
+    # A snapshot of every AP of a profile, indexed by serial, MAC address, swarm and group, so lookups that
+    # used to be an API call each (MAC to serial, the APs of a swarm...) are answered locally:
+    #
+    #   inventory = session.get_inventory()
+    #   inventory.find(mac='20:4c:03:00:00:01').serial
+    #   inventory.in_swarm(swarm_id)
+    #
+    # It is kept in <configpath>/cache/<profile>.inventory.json, so every process of a profile can use it
+    # until it is older than inventory_ttl.
+    #
+    def __init__(self, aps, fetched_at=None):
+        self.aps = list(aps)
+        self.fetched_at = fetched_at or time.time()
+        self.by_serial = dict()
+        self.by_mac = dict()
+        self.by_swarm = dict()
+        self.by_group = dict()
+        for ap in self.aps:
+            self.by_serial[ap.serial] = ap
+            if ap.macaddr:
+                self.by_mac[normalize_mac(ap.macaddr)] = ap
+            self.by_swarm.setdefault(ap.swarm_id, list()).append(ap)
+            self.by_group.setdefault(ap.group_name, list()).append(ap)
+
+    @classmethod
+    def from_pages(cls, pages):
+        return cls(ap for page in pages for ap in page)
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def find(self, serial=None, mac=None):
+        # The AP with this serial or MAC address (in any notation), or None
+        if serial:
+            return self.by_serial.get(serial)
+        if mac:
+            return self.by_mac.get(normalize_mac(mac))
+        return None
+
+    def in_swarm(self, swarm_id) -> list:
+        return self.by_swarm.get(swarm_id, list())
+
+    def in_group(self, group) -> list:
+        return self.by_group.get(group, list())
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json(path, {'fetched_at': self.fetched_at, 'aps': [ap.as_dict() for ap in self.aps]})
+
+    @classmethod
+    def load(cls, path, loader=None):
+        try:
+            with open(path, 'r') as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.error(f"ignoring unreadable inventory {path}: {str(e)}")
+            return None
+        return cls(AP.from_list(snapshot['aps'], loader=loader), fetched_at=snapshot['fetched_at'])
@@ -0,0 +1,307 @@
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libarubacentral_aggregate import SICK_HEALTH
+from libarubacentral_stats import LATENCY_BUCKETS
+
+log = logging.getLogger('libarubacentral.metrics')
+
+#
+# Output formats for the collected statistics and the API self-metrics: collectd PUTVAL lines for the exec
+# plugin scripts, and the Prometheus text format for arubacentral_exporter.py.
+#
+
+
+def putval(hostname, instance, value_type, interval, value) -> str:
+    return f'PUTVAL "{hostname}/exec-{instance}/gauge-{value_type}" interval={interval} N:{value}\n'
+
+
+def client_putvals(counts: dict, hostname, interval, tag="") -> list:
+    # The PUTVAL lines of arubacentral_client.py for the counts of ClientAggregator.result()
+    lines = list()
+    for key, value in counts.get('changes', dict()).items():
+        lines.append(putval(hostname, f"{tag}aruba_{key}_clients", "arubachurn", interval, value))
+    lines.append(putval(hostname, f"{tag}aruba_all_clients", "arubatotal", interval, counts['total']))
+    lines.append(putval(hostname, f"{tag}aruba_sick_clients", "arubasick", interval, counts['sick']))
+    for key, value in counts['os'].items():
+        lines.append(putval(hostname, f"{tag}os_aruba_{key.replace('/', '').replace(' ', '')}_clients", "arubaos",
+                            interval, value))
+    for key, value in counts['ssid'].items():
+        lines.append(putval(hostname, f"{tag}ssid_aruba_{key}_clients", "arubassid", interval, value))
+    for key, value in counts['vc'].items():
+        lines.append(putval(hostname, f"{tag}vc_aruba_{key}_clients", "arubavc", interval, value))
+    for key, value in counts['connection'].items():
+        lines.append(putval(hostname, f"{tag}connection_aruba_{key}_clients", "arubaconn", interval, value))
+    for band, instance in (('5', '5g'), ('6', '6g'), ('2.4', '24g')):
+        lines.append(putval(hostname, f"{tag}aruba_{instance}_clients", "arubaband", interval, counts['band'][band]))
+    if 'coverage' in counts:
+        lines.append(coverage_putval(hostname, f"{tag}aruba_clients", interval, counts['coverage']))
+    return lines
+
+
+def coverage_putval(hostname, prefix, interval, coverage) -> str:
+    # The share of the items a poll fetched before its deadline (1 when complete, U when unknown), so partial
+    # counts can be told apart from a real drop
+    return putval(hostname, f"{prefix}_coverage", "arubacoverage", interval, 'U' if coverage is None else coverage)
+
+
+_write_lock = threading.Lock()
+
+
+def write_lines(lines, stream=None):
+    # All the values of an interval in one write, so collectd reads them together and a slow reader
+    # doesn't cost a system call per value. Jobs running in parallel never interleave their lines.
+    stream = stream or sys.stdout
+    with _write_lock:
+        stream.write(''.join(lines))
+        stream.flush()
+
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labels: dict, value) -> str:
+    if labels:
+        label_text = ','.join(f'{key}="{_label_value(label)}"' for key, label in labels.items())
+        return f"{name}{{{label_text}}} {value}\n"
+    return f"{name} {value}\n"
+
+
+CLIENT_METRICS = (
+    # (metric, help, key in ClientAggregator.result(), label)
+    ('aruba_clients_band', "Wireless clients per radio band", 'band', 'band'),
+    ('aruba_clients_os', "Wireless clients per OS type", 'os', 'os'),
+    ('aruba_clients_ssid', "Wireless clients per SSID", 'ssid', 'ssid'),
+    ('aruba_clients_vc', "Wireless clients per virtual controller", 'vc', 'vc'),
+    ('aruba_clients_connection', "Wireless clients per connection type", 'connection', 'connection'),
+)
+
+
+def render_prometheus(results: dict) -> bytes:
+    #
+    # The Prometheus text format of {profile: {'clients': client counts, 'aps': AP counts}}, where the client
+    # counts are a ClientAggregator.result() and the AP counts an aggregate_aps() result with a swarm_list
+    # (both as served by a Collector). Either can be missing.
+    #
+    lines = list()
+
+    def family(name, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}\n# TYPE {name} gauge\n")
+        lines.extend(samples)
+
+    clients = {profile: data['clients'] for profile, data in results.items() if data.get('clients')}
+    aps = {profile: data['aps'] for profile, data in results.items() if data.get('aps')}
+    if clients:
+        family('aruba_clients', "Wireless clients", [_sample('aruba_clients', {'profile': profile}, counts['total'])
+                                                     for profile, counts in clients.items()])
+        family('aruba_clients_sick', f"Wireless clients with a health below {SICK_HEALTH}",
+               [_sample('aruba_clients_sick', {'profile': profile}, counts['sick'])
+                for profile, counts in clients.items()])
+        for name, help_text, key, label in CLIENT_METRICS:
+            family(name, help_text, [_sample(name, {'profile': profile, label: value}, count)
+                                     for profile, counts in clients.items()
+                                     for value, count in counts[key].items()])
+        family('aruba_clients_changes', "Wireless clients that joined, left or roamed since the previous poll",
+               [_sample('aruba_clients_changes', {'profile': profile, 'change': change}, count)
+                for profile, counts in clients.items() for change, count in counts.get('changes', dict()).items()])
+        family('aruba_clients_coverage', "Share of the wireless clients the poll fetched before its deadline"
+                                         " (below 1 for partial counts)",
+               [_sample('aruba_clients_coverage', {'profile': profile}, _coverage(counts))
+                for profile, counts in clients.items() if 'coverage' in counts])
+    if aps:
+        samples = list()
+        for profile, counts in aps.items():
+            names = {swarm['swarm_id']: swarm['name'] for swarm in counts.get('swarm_list', list())}
+            for swarm_id, location in counts['swarms'].items():
+                labels = {'profile': profile, 'vc': names.get(swarm_id, swarm_id)}
+                samples.append(_sample('aruba_aps', dict(labels, status='up'), location['total'] - location['down']))
+                samples.append(_sample('aruba_aps', dict(labels, status='down'), location['down']))
+        family('aruba_aps', "Access points per virtual controller and status", samples)
+        samples = list()
+        for profile, counts in aps.items():
+            for group, location in counts['groups'].items():
+                labels = {'profile': profile, 'group': group}
+                samples.append(_sample('aruba_group_aps', dict(labels, status='up'),
+                                       location['total'] - location['down']))
+                samples.append(_sample('aruba_group_aps', dict(labels, status='down'), location['down']))
+        family('aruba_group_aps', "Access points per group and status", samples)
+        family('aruba_aps_coverage', "Share of the access points the poll fetched before its deadline"
+                                     " (below 1 for partial counts)",
+               [_sample('aruba_aps_coverage', {'profile': profile}, _coverage(counts))
+                for profile, counts in aps.items() if 'coverage' in counts])
+    return ''.join(lines).encode()
+
+
+def _coverage(counts: dict):
+    return 'NaN' if counts['coverage'] is None else counts['coverage']
+
+
+def api_stats_putvals(stats: dict, previous: dict, hostname, interval, tag="") -> list:
+    #
+    # PUTVAL lines for the API calls of one interval, per endpoint: the difference between two
+    # ArubaCentralAuth.api_stats() results (previous may be empty for the first interval).
+    #
+    lines = list()
+    for template, endpoint in stats.items():
+        before = previous.get(template, dict())
+        instance = f"{tag}api_{template.strip('/').replace('/', '_').replace('{', '').replace('}', '')}"
+        calls = endpoint['calls'] - before.get('calls', 0)
+        seconds = endpoint['seconds'] - before.get('seconds', 0.0)
+        for key in ('calls', 'retries', 'bytes', 'cache_hits'):
+            lines.append(putval(hostname, instance, f"arubaapi_{key}", interval,
+                                endpoint[key] - before.get(key, 0)))
+        errors = sum(count for status, count in endpoint['status'].items() if status != 200) \
+            - sum(count for status, count in before.get('status', dict()).items() if status != 200)
+        lines.append(putval(hostname, instance, "arubaapi_errors", interval, errors))
+        lines.append(putval(hostname, instance, "arubaapi_latency_ms", interval,
+                            round(1000 * seconds / calls, 1) if calls else 0))
+        lines.append(putval(hostname, instance, "arubaapi_parse_ms", interval,
+                            round(1000 * (endpoint['parse_seconds'] - before.get('parse_seconds', 0.0)), 1)))
+    return lines
+
+
+def session_stats_putvals(session, previous: dict, hostname, interval, tag="") -> list:
+    # api_stats_putvals for an ArubaCentralAuth since the previous call (previous keeps the stats of each
+    # profile between calls)
+    stats = session.api_stats()
+    lines = api_stats_putvals(stats, previous.get(session.profile, dict()), hostname, interval, tag=tag)
+    previous[session.profile] = stats
+    return lines
+
+
+def scheduler_putvals(stats: dict, hostname, interval) -> list:
+    # PUTVAL lines for Scheduler.stats(): runs, missed starts, overruns and errors so far, and the duration
+    # and lateness of the last run per job
+    lines = list()
+    for name, job in stats.items():
+        for key in ('runs', 'missed', 'overruns', 'errors'):
+            lines.append(putval(hostname, f"scheduler_{name}", f"arubasched_{key}", interval, job[key]))
+        for key in ('last_duration', 'last_lateness'):
+            if job[key] is not None:
+                lines.append(putval(hostname, f"scheduler_{name}", f"arubasched_{key}", interval, round(job[key], 3)))
+    return lines
+
+
+def render_scheduler_stats(stats: dict) -> bytes:
+    # The Prometheus text format of Scheduler.stats()
+    lines = list()
+    for key, metric_type, help_text in (('runs', 'counter', "Finished runs of a polling job"),
+                                        ('missed', 'counter', "Starts skipped because the previous run was still"
+                                                              " going"),
+                                        ('overruns', 'counter', "Runs that took longer than the interval"),
+                                        ('errors', 'counter', "Runs that failed"),
+                                        ('last_duration', 'gauge', "Duration of the last run in seconds"),
+                                        ('last_lateness', 'gauge', "How late the last run started, in seconds")):
+        name = f"aruba_scheduler_{key}" + ('_total' if metric_type == 'counter' else '')
+        lines.append(f"# HELP {name} {help_text}\n# TYPE {name} {metric_type}\n")
+        lines.extend(_sample(name, {'job': job_name}, job[key]) for job_name, job in stats.items()
+                     if job[key] is not None)
+    return ''.join(lines).encode()
+
+
+def render_api_stats(stats_by_profile: dict) -> bytes:
+    # The Prometheus text format of {profile: ArubaCentralAuth.api_stats()}
+    lines = list()
+
+    def family(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}\n# TYPE {name} {metric_type}\n")
+        lines.extend(samples)
+
+    endpoints = [({'profile': profile, 'endpoint': template}, endpoint)
+                 for profile, stats in stats_by_profile.items() for template, endpoint in stats.items()]
+    family('aruba_api_requests_total', 'counter', "API requests sent, retries included",
+           [_sample('aruba_api_requests_total', dict(labels, status=status), count)
+            for labels, endpoint in endpoints for status, count in endpoint['status'].items()])
+    family('aruba_api_retries_total', 'counter', "API requests sent again after a failure",
+           [_sample('aruba_api_retries_total', labels, endpoint['retries']) for labels, endpoint in endpoints])
+    family('aruba_api_response_bytes_total', 'counter', "API response body bytes",
+           [_sample('aruba_api_response_bytes_total', labels, endpoint['bytes']) for labels, endpoint in endpoints])
+    family('aruba_api_cache_hits_total', 'counter', "API calls answered by the response cache",
+           [_sample('aruba_api_cache_hits_total', labels, endpoint['cache_hits']) for labels, endpoint in endpoints])
+    family('aruba_api_parse_seconds_total', 'counter', "Time spent decoding API responses",
+           [_sample('aruba_api_parse_seconds_total', labels, f"{endpoint['parse_seconds']:.6f}")
+            for labels, endpoint in endpoints])
+    samples = list()
+    for labels, endpoint in endpoints:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, endpoint['latency_buckets']):
+            cumulative += count
+            samples.append(_sample('aruba_api_request_duration_seconds_bucket', dict(labels, le=bound), cumulative))
+        samples.append(_sample('aruba_api_request_duration_seconds_bucket', dict(labels, le='+Inf'),
+                               endpoint['calls']))
+        samples.append(_sample('aruba_api_request_duration_seconds_sum', labels, f"{endpoint['seconds']:.6f}"))
+        samples.append(_sample('aruba_api_request_duration_seconds_count', labels, endpoint['calls']))
+    family('aruba_api_request_duration_seconds', 'histogram', "API response time", samples)
+    return ''.join(lines).encode()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        start = time.perf_counter()
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.body() + self.server.self_metrics()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record_scrape(time.perf_counter() - start)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    #
+    # Serves the metrics of the last poll over HTTP (GET /metrics). The poller renders them once per poll
+    # with update(), and every scrape gets the same bytes, so any number of scrapers cost no API calls and
+    # next to no CPU. Each scrape also reports how long the previous scrapes took to serve, and when the
+    # metrics were last updated.
+    #
+    daemon_threads = True
+
+    def __init__(self, address):
+        self._body = b''
+        self._updated = None
+        self._poll_seconds = None
+        self._lock = threading.Lock()
+        self.scrapes = 0
+        self.scrape_seconds = 0.0
+        super().__init__(address, _MetricsHandler)
+
+    def update(self, body: bytes, poll_seconds=None):
+        with self._lock:
+            self._body = body
+            self._updated = time.time()
+            self._poll_seconds = poll_seconds
+
+    def body(self) -> bytes:
+        with self._lock:
+            return self._body
+
+    def record_scrape(self, seconds):
+        with self._lock:
+            self.scrapes += 1
+            self.scrape_seconds += seconds
+
+    def self_metrics(self) -> bytes:
+        with self._lock:
+            lines = ["# HELP aruba_exporter_scrape_duration_seconds Time spent serving scrapes\n",
+                     "# TYPE aruba_exporter_scrape_duration_seconds summary\n",
+                     f"aruba_exporter_scrape_duration_seconds_sum {self.scrape_seconds:.6f}\n",
+                     f"aruba_exporter_scrape_duration_seconds_count {self.scrapes}\n"]
+            if self._updated:
+                lines += ["# HELP aruba_exporter_last_poll_timestamp_seconds When the metrics were last polled\n",
+                          "# TYPE aruba_exporter_last_poll_timestamp_seconds gauge\n",
+                          f"aruba_exporter_last_poll_timestamp_seconds {self._updated:.3f}\n"]
+            if self._poll_seconds is not None:
+                lines += ["# HELP aruba_exporter_poll_duration_seconds How long the last poll took\n",
+                          "# TYPE aruba_exporter_poll_duration_seconds gauge\n",
+                          f"aruba_exporter_poll_duration_seconds {self._poll_seconds:.3f}\n"]
+        return ''.join(lines).encode()
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import time
+
+from libarubacentral_aggregate import ap_counts
+
+OK = 0
+WARNING = 1
+CRITICAL = 2
+UNKNOWN = 3
+
+
+def evaluate_aps(name, down_count, warn=1, crit=5, total_count=None, expected_total=None):
+    #
+    # Turn AP counts into a nagios (return code, output) pair using the warn/crit/total thresholds
+    # of check_aruba_vc_aps.py.
+    #
+    if down_count >= crit:
+        return CRITICAL, f"CRITICAL - {down_count} APs are down in {name} | 'down_aps'={down_count}"
+    elif down_count >= warn:
+        return WARNING, f"WARNING - {down_count} APs are down in {name} | 'down_aps'={down_count}"
+    elif expected_total:
+        if total_count < expected_total:
+            return UNKNOWN, f"UNKNOWN - Not enough APs in {name}. Expected {expected_total}, got {total_count}" \
+                            f" | 'aps'={total_count}"
+        else:
+            return OK, f"OK - {total_count} APs are up in {name} | 'aps'={total_count}"
+    else:
+        return OK, f"OK - {down_count} APs are down in {name} | 'down_aps'={down_count}"
+
+
+def evaluate_checks(checks: list, counts: dict, get_swarm_id, warn=1, crit=5, tag="") -> list:
+    #
+    # The passive check results of batch checks (see config/checks.yml.orig) from an aggregate_aps result:
+    # one {host, service, retcode, output} per check. get_swarm_id resolves the vc of checks without a
+    # swarm_id; warn and crit are the thresholds of checks that don't set their own.
+    #
+    results = list()
+    for check in checks:
+        sid = check.get('swarm_id')
+        check_group = check.get('group')
+        if not sid and not check_group and not check.get('vc'):
+            results.append({'host': check['host'], 'service': check['service'], 'retcode': UNKNOWN,
+                            'output': "UNKNOWN - the check needs a vc, swarm_id or group in the checks file"})
+            continue
+        try:
+            if check.get('vc') and not sid:
+                sid = get_swarm_id(check['vc'])
+        except RuntimeError as e:
+            results.append({'host': check['host'], 'service': check['service'], 'retcode': UNKNOWN,
+                            'output': f"VC {check['vc']} not found: {str(e)}"})
+            continue
+        location = ap_counts(counts, swarm_id=sid, group=check_group)
+        down_count = location['down']
+        total_count = location['total']
+        if check.get('name'):
+            check_name = check['name']
+        elif check.get('vc'):
+            check_name = "VC " + check['vc']
+        elif check_group:
+            check_name = check_group
+        else:
+            check_name = "Swarm with ID: " + sid
+        retcode, output = evaluate_aps(tag + check_name, down_count,
+                                       warn=check.get('warn', warn), crit=check.get('crit', crit),
+                                       total_count=total_count, expected_total=check.get('total'))
+        results.append({'host': check['host'], 'service': check['service'], 'retcode': retcode, 'output': output})
+    return results
+
+
+def with_coverage(retcode, output: str, coverage):
+    #
+    # A check result from AP counts that only cover part of the APs (a sweep cut short by its deadline): the
+    # problems found stand, but an OK can't be trusted, so it becomes UNKNOWN. coverage is the share of the
+    # APs fetched, or None when unknown.
+    #
+    text, _, perfdata = output.partition(' | ')
+    if retcode == OK:
+        retcode = UNKNOWN
+        text = "UNKNOWN - " + text.partition(' - ')[2]
+    share = "some" if coverage is None else f"{coverage:.0%}"
+    perfdata += '' if coverage is None else f" 'coverage'={coverage:.2f}"
+    return retcode, f"{text} (partial: {share} of the APs fetched before the deadline) | {perfdata}"
+
+
+def with_age(output: str, age: float) -> str:
+    # Add how old the counts behind a check result are to its output and perfdata
+    text, _, perfdata = output.partition(' | ')
+    return f"{text} (data {age:.0f}s old) | {perfdata} 'age'={age:.0f}s"
+
+
+def write_command_file(path, results: list):
+    #
+    # Submit passive service check results through the nagios external command file. Each result is a dict
+    # with host, service, retcode and output.
+    #
+    now = int(time.time())
+    lines = list()
+    for result in results:
+        lines.append(f"[{now}] PROCESS_SERVICE_CHECK_RESULT;{result['host']};{result['service']};"
+                     f"{result['retcode']};{_single_line(result['output'])}\n")
+    with open(path, 'a') as command_file:
+        command_file.write(''.join(lines))
+
+
+def write_spool_dir(path, results: list):
+    #
+    # Drop all results into one file in the nagios check result spool directory (check_result_path). The .ok
+    # file tells nagios the result file is complete.
+    #
+    now = time.time()
+    lines = ["### Passive Check Result File ###\n", f"file_time={int(now)}\n", "\n"]
+    for result in results:
+        lines += ["### Nagios Service Check Result ###\n",
+                  f"# Time: {time.ctime(now)}\n",
+                  f"host_name={result['host']}\n",
+                  f"service_description={result['service']}\n",
+                  "check_type=1\n",
+                  "check_options=0\n",
+                  "scheduled_check=0\n",
+                  "reschedule_check=0\n",
+                  "latency=0.0\n",
+                  f"start_time={now:.6f}\n",
+                  f"finish_time={now:.6f}\n",
+                  "early_timeout=0\n",
+                  "exited_ok=1\n",
+                  f"return_code={result['retcode']}\n",
+                  f"output={_single_line(result['output'])}\n",
+                  "\n"]
+    fd, filename = tempfile.mkstemp(prefix='c', dir=path)
+    with os.fdopen(fd, 'w') as result_file:
+        result_file.write(''.join(lines))
+    with open(filename + '.ok', 'w'):
+        pass
+    return filename
+
+
+def _single_line(output: str) -> str:
+    return str(output).replace('\n', '\\n')
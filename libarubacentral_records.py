@@ -0,0 +1,97 @@
+import sys
+
+#
+# Compact records for the monitoring API results. The API returns dozens of fields per AP or client, and the
+# scripts read a handful of them, so a record keeps only those fields in __slots__, with the strings that
+# repeat across thousands of records (group, network, OS type, status...) interned so every record shares one
+# copy. Records answer get(), [] and `in` like the JSON dicts they replace, so they can be handed to the
+# aggregators and the state store as they are.
+#
+# The full JSON payload is dropped, unless keep_raw is set, and fetched again from the API on first access to
+# .raw when the record was made with a loader (ArubaCentralAuth does this for every record it returns).
+#
+
+
+class Record:
+    FIELDS = ()
+    INTERNED = ()
+    __slots__ = ('_raw',)
+
+    def __init__(self, fields: dict, raw=None):
+        for field in self.FIELDS:
+            value = fields.get(field)
+            if field in self.INTERNED and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, field, value)
+        self._raw = raw
+
+    @classmethod
+    def from_json(cls, data: dict, keep_raw=False, loader=None):
+        # loader is called with the record to fetch the full payload when .raw is read
+        return cls(data, raw=data if keep_raw else loader)
+
+    @classmethod
+    def from_list(cls, items, keep_raw=False, loader=None) -> list:
+        return [cls.from_json(item, keep_raw=keep_raw, loader=loader) for item in items]
+
+    @property
+    def raw(self) -> dict:
+        if callable(self._raw):
+            self._raw = self._raw(self)
+        return self._raw
+
+    def get(self, field, default=None):
+        if field in self.FIELDS:
+            value = getattr(self, field)
+            return default if value is None else value
+        if isinstance(self._raw, dict):
+            return self._raw.get(field, default)
+        return default
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field) -> bool:
+        return self.get(field) is not None
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{key}={value!r}' for key, value in self.as_dict().items())})"
+
+
+class AP(Record):
+    FIELDS = ('serial', 'macaddr', 'name', 'status', 'swarm_id', 'group_name', 'ip_address', 'model', 'site',
+              'client_count')
+    INTERNED = frozenset(('status', 'swarm_id', 'group_name', 'model', 'site'))
+    __slots__ = FIELDS
+
+
+class Swarm(Record):
+    FIELDS = ('swarm_id', 'name', 'group_name', 'status', 'ip_address')
+    INTERNED = frozenset(('group_name', 'status'))
+    __slots__ = FIELDS
+
+
+class Network(Record):
+    FIELDS = ('essid', 'type', 'security')
+    INTERNED = frozenset(FIELDS)
+    __slots__ = FIELDS
+
+
+class WirelessClient(Record):
+    FIELDS = ('macaddr', 'name', 'ip_address', 'associated_device', 'band', 'os_type', 'network', 'connection',
+              'health', 'swarm_id', 'group_name')
+    INTERNED = frozenset(('associated_device', 'os_type', 'network', 'connection', 'swarm_id', 'group_name'))
+    __slots__ = FIELDS
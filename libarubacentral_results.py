@@ -0,0 +1,69 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+from libarubacentral_files import write_json
+
+log = logging.getLogger('libarubacentral.results')
+
+
+class CheckResultStore:
+    #
+    # The last good AP counts of each single check of check_aruba_vc_aps.py, one file per check in
+    # <configpath>/cache/checks/<key>.json, so a check can answer from them right away while another process
+    # fetches new counts (stale-while-revalidate):
+    #
+    #   store = CheckResultStore(configpath + "/cache/checks")
+    #   key = store.key(profile, vc='BRO')
+    #   result = store.get(key)         # {'down': 2, 'total': 40, 'fetched_at': ...} or None
+    #   store.put(key, {'down': 2, 'total': 40})
+    #
+    # The counts are stored rather than the plugin output, so changed thresholds apply to stored results too.
+    #
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def key(profile, vc=None, swarm_id=None, group=None, total=False) -> str:
+        # The same check (profile, location and whether it counts every AP) always has the same key
+        identity = json.dumps([profile, vc and vc.lower(), swarm_id, group, bool(total)])
+        return hashlib.sha1(identity.encode()).hexdigest()[:20]
+
+    def _path(self, key) -> str:
+        return f"{self.directory}/{key}.json"
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.error(f"ignoring unreadable check result {self._path(key)}: {str(e)}")
+            return None
+
+    def put(self, key, result: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        write_json(self._path(key), dict(result, fetched_at=time.time()))
+
+    @staticmethod
+    def age(result: dict) -> float:
+        return max(time.time() - result['fetched_at'], 0.0)
+
+    def try_lock(self, key):
+        #
+        # The refresh lock of a check, so only one process fetches its counts at a time: an open file holding
+        # an flock of <key>.lock, or None when another process holds it. The lock is released when the file
+        # is closed (or the process exits).
+        #
+        os.makedirs(self.directory, exist_ok=True)
+        lockfile = open(self._path(key) + '.lock', 'a')
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lockfile.close()
+            return None
+        return lockfile
@@ -0,0 +1,141 @@
+import logging
+import math
+import threading
+import time
+
+log = logging.getLogger('libarubacentral.scheduler')
+
+
+class Job:
+    def __init__(self, name, interval, function, offset=None):
+        self.name = name
+        self.interval = float(interval)
+        self.function = function
+        self.offset = offset
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.missed = 0
+        self.overruns = 0
+        self.errors = 0
+        self.last_duration = None
+        self.last_lateness = None
+
+    def align(self, now: float) -> float:
+        # The first start time after now on this job's grid: offset + a whole number of intervals
+        next_run = self.offset + (math.floor((now - self.offset) / self.interval) + 1) * self.interval
+        if next_run <= now:
+            # now was a hair before a grid point, by floating point rounding
+            next_run += self.interval
+        return next_run
+
+    def stats(self) -> dict:
+        return {'interval': self.interval, 'offset': self.offset, 'runs': self.runs, 'missed': self.missed,
+                'overruns': self.overruns, 'errors': self.errors, 'running': self.running,
+                'last_duration': self.last_duration, 'last_lateness': self.last_lateness}
+
+
+class Scheduler:
+    #
+    # Runs polling jobs on a fixed grid instead of sleeping for an interval after each run, so the runs don't
+    # drift by however long the work took:
+    #
+    #   scheduler = Scheduler()
+    #   scheduler.add('clients_Default', 60, poll_default)
+    #   scheduler.add('clients_Two', 60, poll_two)
+    #   scheduler.run()
+    #
+    # A job starts at offset + n * interval seconds of the wall clock, in its own thread. Jobs added without
+    # an offset are spread evenly over their interval (two 60 second jobs run at :00 and :30), so they don't
+    # all send their requests at the same moment. A job is never started while its previous run is still
+    # going: that start is counted as missed. A run that took longer than the interval is counted as an
+    # overrun. stats() has these counts per job, for the self-metrics of the scripts.
+    #
+    def __init__(self):
+        self.jobs = list()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, name, interval, function, offset=None) -> Job:
+        job = Job(name, interval, function, offset)
+        self.jobs.append(job)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {job.name: job.stats() for job in self.jobs}
+
+    def stop(self):
+        self._stop.set()
+
+    def _spread(self):
+        by_interval = dict()
+        for job in self.jobs:
+            if job.offset is None:
+                by_interval.setdefault(job.interval, list()).append(job)
+        for interval, jobs in by_interval.items():
+            for index, job in enumerate(jobs):
+                job.offset = index * interval / len(jobs)
+
+    def run(self, first_now=False):
+        #
+        # Run the jobs until stop() is called. With first_now, the grid starts now instead of at the epoch,
+        # so the first job runs right away and the others at their offset from now.
+        #
+        self._spread()
+        now = time.time()
+        for job in self.jobs:
+            if first_now:
+                job.next_run = now + job.offset
+                job.offset = job.next_run % job.interval
+            else:
+                job.next_run = job.align(now)
+        while self.jobs and not self._stop.is_set():
+            job = min(self.jobs, key=lambda candidate: candidate.next_run)
+            if self._stop.wait(max(job.next_run - time.time(), 0)):
+                break
+            deadline = job.next_run
+            now = time.time()
+            with self._lock:
+                # Slots that went by entirely (e.g. the machine was suspended) are missed as well.
+                skipped = max(int((now - deadline) // job.interval), 0)
+                job.missed += skipped
+                if job.running:
+                    job.missed += 1
+                    log.warning(f"{job.name}: previous run still going, skipping this one")
+                else:
+                    job.running = True
+                    threading.Thread(target=self._run_job, args=(job, deadline), name=job.name, daemon=True).start()
+            job.next_run = job.align(now)
+
+    def run_once(self):
+        # Every job once, all at the same time, returning when they are all done (the --once of the scripts)
+        now = time.time()
+        threads = list()
+        for job in self.jobs:
+            job.running = True
+            threads.append(threading.Thread(target=self._run_job, args=(job, now), name=job.name))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_job(self, job: Job, deadline: float):
+        start = time.time()
+        try:
+            job.function()
+        except Exception as e:
+            with self._lock:
+                job.errors += 1
+            log.exception(f"{job.name} failed: {str(e)}")
+        finally:
+            duration = time.time() - start
+            with self._lock:
+                job.running = False
+                job.runs += 1
+                job.last_duration = duration
+                job.last_lateness = start - deadline
+                if duration > job.interval:
+                    job.overruns += 1
+            if duration > job.interval:
+                log.warning(f"{job.name} took {duration:.1f} seconds, longer than its {job.interval} second interval")
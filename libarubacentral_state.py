@@ -0,0 +1,158 @@
+import copy
+import json
+import logging
+import time
+
+from libarubacentral_aggregate import ClientAggregator, count_ap
+from libarubacentral_files import write_json
+
+log = logging.getLogger('libarubacentral.state')
+
+
+class StateStore:
+    #
+    # Remembers the APs (by serial) and clients (by MAC address) of the last poll, so the next poll can be
+    # turned into a list of transitions, and the AP and client statistics can be updated for just the APs and
+    # clients that changed instead of being counted again:
+    #
+    #   state = StateStore()
+    #   changes = state.update_aps(session.iter_all_aps())
+    #   changes['down']              serials of the APs that went down since the last poll
+    #   state.ap_aggregate()         the same counts as aggregate_aps() over every AP
+    #
+    #   changes = state.update_clients(session.iter_all_wifi_clients(), swarm_names, swarm_groups)
+    #   changes['roamed']            (mac, old swarm_id, new swarm_id) of the clients that moved to another VC
+    #   state.client_counts()        the same counts as ClientAggregator.result() over every client
+    #
+    # Both update methods take pages (lists) of APs or clients, and only change the state once the last page
+    # is in, so a sweep that fails half way leaves the previous poll in place.
+    #
+    AP_STATUS = 0
+    AP_SWARM_ID = 1
+    AP_GROUP_NAME = 2
+    CLIENT_SWARM_ID = 3
+
+    def __init__(self, path=None):
+        self.path = path
+        self.aps = dict()
+        self.clients = dict()
+        self.updated = {'aps': None, 'clients': None}
+        self._ap_aggregate = {'swarms': dict(), 'groups': dict(), 'swarm_groups': dict()}
+        self._client_aggregator = ClientAggregator()
+
+    @staticmethod
+    def ap_record(ap) -> tuple:
+        return ap.get('status'), ap.get('swarm_id'), ap.get('group_name'), ap.get('name')
+
+    def update_aps(self, pages) -> dict:
+        previous = self.aps
+        current = dict()
+        changed = list()
+        for page in pages:
+            for ap in page:
+                serial = ap.get('serial')
+                if not serial or serial in current:
+                    continue
+                record = self.ap_record(ap)
+                current[serial] = record
+                if previous.get(serial) != record:
+                    changed.append((serial, previous.get(serial), record))
+        removed = [(serial, record, None) for serial, record in previous.items() if serial not in current]
+
+        changes = {'down': list(), 'up': list(), 'added': list(), 'removed': list(), 'moved': list()}
+        for serial, old, new in changed + removed:
+            if old:
+                self._count_ap(old, -1)
+            if new:
+                self._count_ap(new, 1)
+            if old is None:
+                changes['added'].append(serial)
+            elif new is None:
+                changes['removed'].append(serial)
+            else:
+                if old[self.AP_STATUS] != new[self.AP_STATUS]:
+                    changes['down' if new[self.AP_STATUS] == 'Down' else 'up'].append(serial)
+                if old[self.AP_SWARM_ID] != new[self.AP_SWARM_ID] or old[self.AP_GROUP_NAME] != new[self.AP_GROUP_NAME]:
+                    changes['moved'].append(serial)
+        self.aps = current
+        self.updated['aps'] = time.time()
+        log.debug(f"{len(current)} APs, {len(changed) + len(removed)} changed: "
+                  + ", ".join(f"{len(serials)} {kind}" for kind, serials in changes.items()))
+        return changes
+
+    def update_clients(self, pages, swarm_names: dict = None, swarm_groups: dict = None) -> dict:
+        if swarm_names is not None and (swarm_names != self._client_aggregator.swarm_names or
+                                        (swarm_groups or dict()) != self._client_aggregator.swarm_groups):
+            # VC names are resolved when a client is counted, so a new swarm list means counting again.
+            self._client_aggregator = ClientAggregator(swarm_names, swarm_groups)
+            for record in self.clients.values():
+                self._client_aggregator.adjust(record)
+        previous = self.clients
+        current = dict()
+        changed = list()
+        for page in pages:
+            for client in page:
+                mac = client.get('macaddr')
+                if not mac or mac in current:
+                    continue
+                record = ClientAggregator.record(client)
+                current[mac] = record
+                if previous.get(mac) != record:
+                    changed.append((mac, previous.get(mac), record))
+        left = [mac for mac in previous if mac not in current]
+
+        changes = {'joined': list(), 'left': left, 'roamed': list(), 'changed': 0}
+        for mac, old, new in changed:
+            if old is None:
+                changes['joined'].append(mac)
+            else:
+                self._client_aggregator.adjust(old, -1)
+                if old[self.CLIENT_SWARM_ID] != new[self.CLIENT_SWARM_ID]:
+                    changes['roamed'].append((mac, old[self.CLIENT_SWARM_ID], new[self.CLIENT_SWARM_ID]))
+                else:
+                    changes['changed'] += 1
+            self._client_aggregator.adjust(new)
+        for mac in left:
+            self._client_aggregator.adjust(previous[mac], -1)
+        self.clients = current
+        self.updated['clients'] = time.time()
+        log.debug(f"{len(current)} clients: {len(changes['joined'])} joined, {len(left)} left,"
+                  f" {len(changes['roamed'])} roamed, {changes['changed']} changed")
+        return changes
+
+    def ap_aggregate(self) -> dict:
+        return copy.deepcopy(self._ap_aggregate)
+
+    def client_counts(self) -> dict:
+        return self._client_aggregator.result()
+
+    def _count_ap(self, record, delta):
+        count_ap(self._ap_aggregate, record[self.AP_SWARM_ID], record[self.AP_GROUP_NAME],
+                 record[self.AP_STATUS] == 'Down', delta)
+
+    def save(self, path=None):
+        path = path or self.path
+        state = {'updated': self.updated, 'aps': self.aps, 'clients': self.clients}
+        write_json(path, state)
+
+    def load(self, path=None):
+        path = path or self.path
+        try:
+            with open(path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            log.error(f"ignoring unreadable state file {path}: {str(e)}")
+            return False
+        self.updated = state['updated']
+        self.aps = {serial: tuple(record) for serial, record in state['aps'].items()}
+        self.clients = {mac: tuple(record) for mac, record in state['clients'].items()}
+        self._ap_aggregate = {'swarms': dict(), 'groups': dict(), 'swarm_groups': dict()}
+        for record in self.aps.values():
+            self._count_ap(record, 1)
+        self._client_aggregator = ClientAggregator(self._client_aggregator.swarm_names,
+                                                   self._client_aggregator.swarm_groups)
+        for record in self.clients.values():
+            self._client_aggregator.adjust(record)
+        return True
@@ -0,0 +1,93 @@
+import re
+import threading
+from urllib.parse import urlsplit
+
+#
+# Per endpoint instrumentation of the API calls of an ArubaCentralAuth. Every URL is reduced to its endpoint
+# template (no host, no query string, identifiers replaced by their name), so the AP details of 2000 serials
+# are one endpoint, and for each template we count:
+#
+#   calls          HTTP requests sent, retries included (what the rate limit counts)
+#   retries        requests that were sent again after a 429, 50x or connection error
+#   status         {HTTP status code: count}, with 'error' for connection errors
+#   seconds        total time waiting for the responses, and a histogram of it (LATENCY_BUCKETS)
+#   bytes          response body bytes
+#   cache_hits     responses answered by the response cache, without a request
+#   parse_seconds  time spent decoding JSON
+#
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TEMPLATES = (
+    (re.compile(r'^/monitoring/v1/aps/[^/]+'), '/monitoring/v1/aps/{serial}'),
+    (re.compile(r'^/monitoring/v1/swarms/[^/]+'), '/monitoring/v1/swarms/{swarm_id}'),
+    (re.compile(r'^/monitoring/v2/networks/[^/]+'), '/monitoring/v2/networks/{essid}'),
+    (re.compile(r'^/monitoring/v1/clients/wireless/[^/]+'), '/monitoring/v1/clients/wireless/{macaddr}'),
+    (re.compile(r'^/configuration/v2/ap_settings/[^/]+'), '/configuration/v2/ap_settings/{serial}'),
+)
+
+
+def endpoint_template(url: str) -> str:
+    path = urlsplit(url).path or url
+    for pattern, template in TEMPLATES:
+        if pattern.match(path):
+            return template
+    return path
+
+
+class ApiStats:
+    def __init__(self):
+        self._endpoints = dict()
+        self._lock = threading.Lock()
+
+    def _endpoint(self, url) -> dict:
+        # Called with the lock held
+        template = endpoint_template(url)
+        endpoint = self._endpoints.get(template)
+        if endpoint is None:
+            endpoint = {'calls': 0, 'retries': 0, 'status': dict(), 'seconds': 0.0,
+                        'latency_buckets': [0] * len(LATENCY_BUCKETS), 'bytes': 0, 'cache_hits': 0,
+                        'parse_seconds': 0.0}
+            self._endpoints[template] = endpoint
+        return endpoint
+
+    def record_request(self, url, status, seconds: float, size: int = 0, retry=False):
+        with self._lock:
+            endpoint = self._endpoint(url)
+            endpoint['calls'] += 1
+            if retry:
+                endpoint['retries'] += 1
+            endpoint['status'][status] = endpoint['status'].get(status, 0) + 1
+            endpoint['seconds'] += seconds
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    endpoint['latency_buckets'][index] += 1
+                    break
+            endpoint['bytes'] += size
+
+    def record_bytes(self, url, size: int):
+        with self._lock:
+            self._endpoint(url)['bytes'] += size
+
+    def record_cache_hit(self, url):
+        with self._lock:
+            self._endpoint(url)['cache_hits'] += 1
+
+    def record_parse(self, url, seconds: float):
+        with self._lock:
+            self._endpoint(url)['parse_seconds'] += seconds
+
+    def stats(self) -> dict:
+        #
+        # {template: counters} as described above. latency_buckets are not cumulative: latency_buckets[i]
+        # counts the requests slower than LATENCY_BUCKETS[i - 1] and no slower than LATENCY_BUCKETS[i]; the
+        # requests slower than the last bound are calls minus their sum.
+        #
+        with self._lock:
+            return {template: dict(endpoint, status=dict(endpoint['status']),
+                                   latency_buckets=list(endpoint['latency_buckets']))
+                    for template, endpoint in self._endpoints.items()}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = dict()
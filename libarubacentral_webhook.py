@@ -0,0 +1,221 @@
+import base64
+import copy
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libarubacentral_aggregate import count_ap
+
+log = logging.getLogger('libarubacentral.webhook')
+
+#
+# Aruba Central webhooks for AP up/down alerts. Central signs every delivery with the webhook's token: the
+# X-Central-Signature header is the base64 HMAC-SHA256 of the body followed by the X-Central-Service,
+# X-Central-Delivery-ID and X-Central-Delivery-Timestamp headers. An alert is {'alert_type': 'AP disconnected',
+# 'device_id': <serial>, 'state': 'Open' | 'Close', ...}: Open when the AP went down, Close when it came back.
+# X-Central-Delivery-Timestamp is the Unix time of the delivery: one too far from now is refused, so a signed
+# delivery captured on the way can't be replayed later.
+#
+
+SIGNED_HEADERS = ('X-Central-Service', 'X-Central-Delivery-ID', 'X-Central-Delivery-Timestamp')
+AP_DOWN_ALERTS = ('ap disconnected',)
+# Seconds a delivery's timestamp may be away from our clock
+MAX_DELIVERY_SKEW = 300
+
+
+def central_signature(token: str, body: bytes, headers) -> str:
+    message = body + ''.join(headers.get(header) or '' for header in SIGNED_HEADERS).encode()
+    return base64.b64encode(hmac.new(token.encode(), message, hashlib.sha256).digest()).decode()
+
+
+def verify_signature(token: str, body: bytes, headers) -> bool:
+    signature = headers.get('X-Central-Signature')
+    return bool(signature) and hmac.compare_digest(signature, central_signature(token, body, headers))
+
+
+def delivery_fresh(headers, max_skew=MAX_DELIVERY_SKEW) -> bool:
+    try:
+        delivered = float(headers.get('X-Central-Delivery-Timestamp'))
+    except (TypeError, ValueError):
+        return False
+    if delivered > 1e11:
+        # In milliseconds
+        delivered /= 1000
+    return abs(time.time() - delivered) <= max_skew
+
+
+def ap_event(alert: dict):
+    # (serial, down) for an AP up/down alert, None for any other alert
+    if str(alert.get('alert_type', '')).lower() not in AP_DOWN_ALERTS:
+        return None
+    serial = alert.get('device_id') or (alert.get('details') or dict()).get('serial')
+    if not serial:
+        return None
+    return serial, str(alert.get('state', 'Open')).lower() != 'close'
+
+
+class ApStatusMap:
+    #
+    # Which APs are down, per swarm and group, kept up to date by webhook alerts and corrected by full syncs:
+    #
+    #   status = ApStatusMap()
+    #   status.sync(ap for page in session.iter_all_aps() for ap in page)
+    #   status.set_down('CNXXXXXXXX', True)     # -> (swarm_id, group) of the AP, or None if nothing changed
+    #   ap_counts(status.counts(), swarm_id=...)
+    #
+    # Alerts don't say which swarm or group an AP is in, so only APs seen by a sync are tracked; alerts for
+    # other APs are left for the next sync.
+    #
+    def __init__(self):
+        self.aps = dict()
+        self.aggregate = {'swarms': dict(), 'groups': dict(), 'swarm_groups': dict()}
+        self.synced = None
+        # serial -> when an alert last set its status, so a sync doesn't undo alerts newer than its sweep
+        self._alerted = dict()
+        self._lock = threading.Lock()
+
+    def sync(self, aps, started=None) -> set:
+        #
+        # Replace the map with these APs, swept from started (time.time(), default now) on: the (swarm_id,
+        # group) locations whose counts changed. An AP whose status an alert set after started keeps that
+        # status, as the sweep may have read it before the alert.
+        #
+        started = time.time() if started is None else started
+        current = {ap['serial']: (ap.get('swarm_id'), ap.get('group_name'), ap.get('status') == 'Down')
+                   for ap in aps if ap.get('serial')}
+        with self._lock:
+            for serial, alerted in list(self._alerted.items()):
+                if alerted < started:
+                    del self._alerted[serial]
+                elif serial in current and serial in self.aps:
+                    current[serial] = current[serial][:2] + (self.aps[serial][2],)
+            aggregate = {'swarms': dict(), 'groups': dict(), 'swarm_groups': dict()}
+            for swarm_id, group, down in current.values():
+                count_ap(aggregate, swarm_id, group, down)
+            changed = {record[:2] for serial, record in current.items() if self.aps.get(serial) != record}
+            changed |= {record[:2] for serial, record in self.aps.items() if current.get(serial) != record}
+            self.aps = current
+            self.aggregate = aggregate
+            self.synced = time.time()
+        return changed
+
+    def set_down(self, serial, down: bool):
+        with self._lock:
+            record = self.aps.get(serial)
+            if record is None:
+                return None
+            self._alerted[serial] = time.time()
+            if record[2] == down:
+                return None
+            swarm_id, group, _ = record
+            count_ap(self.aggregate, swarm_id, group, record[2], -1)
+            count_ap(self.aggregate, swarm_id, group, down)
+            self.aps[serial] = (swarm_id, group, down)
+            return swarm_id, group
+
+    def counts(self) -> dict:
+        with self._lock:
+            return copy.deepcopy(self.aggregate)
+
+    def down_aps(self) -> dict:
+        with self._lock:
+            swarms = dict()
+            groups = dict()
+            for serial, (swarm_id, group, down) in self.aps.items():
+                if down:
+                    swarms.setdefault(swarm_id, list()).append(serial)
+                    groups.setdefault(group, list()).append(serial)
+            return {'swarms': swarms, 'groups': groups, 'synced': self.synced}
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if not verify_signature(server.token, body, self.headers):
+            server.count('rejected')
+            log.warning(f"rejected a webhook from {self.client_address[0]}: bad signature")
+            return self._reply(401, {'error': 'bad signature'})
+        if not delivery_fresh(self.headers, server.max_skew):
+            server.count('rejected')
+            log.warning(f"rejected a webhook from {self.client_address[0]}: stale or missing timestamp")
+            return self._reply(401, {'error': 'stale delivery'})
+        try:
+            alert = json.loads(body)
+        except ValueError:
+            server.count('rejected')
+            return self._reply(400, {'error': 'not JSON'})
+        delivery = self.headers.get('X-Central-Delivery-ID')
+        if server.seen(delivery):
+            server.count('duplicates')
+            return self._reply(200, {})
+        server.count('alerts')
+        try:
+            server.on_alert(alert)
+        except Exception as e:
+            # Not remembered, so Central's retry of this delivery is applied
+            server.count('errors')
+            log.exception(f"alert {delivery} failed: {str(e)}")
+            return self._reply(500, {'error': str(e)})
+        server.remember(delivery)
+        self._reply(200, {})
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/status':
+            return self._reply(404, {'error': 'not found'})
+        self._reply(200, dict(self.server.status_map.down_aps(), counters=self.server.counters()))
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    #
+    # Receives Central's webhook POSTs: checks the signature and that the delivery is no more than max_skew
+    # seconds old, drops deliveries already applied (Central retries a delivery it didn't get a 200 for), and
+    # hands every alert to on_alert(alert). GET /status has the down APs of status_map and the counts of
+    # alerts, rejected deliveries, duplicates and failed alerts.
+    #
+    daemon_threads = True
+
+    def __init__(self, address, token, status_map: ApStatusMap, on_alert, remember=1000,
+                 max_skew=MAX_DELIVERY_SKEW):
+        self.token = token
+        self.max_skew = max_skew
+        self.status_map = status_map
+        self.on_alert = on_alert
+        self._deliveries = deque(maxlen=remember)
+        self._counters = {'alerts': 0, 'rejected': 0, 'duplicates': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        super().__init__(address, _WebhookHandler)
+
+    def seen(self, delivery) -> bool:
+        with self._lock:
+            return bool(delivery) and delivery in self._deliveries
+
+    def remember(self, delivery):
+        # A delivery that was applied: its retries are duplicates
+        if delivery:
+            with self._lock:
+                self._deliveries.append(delivery)
+
+    def count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def counters(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
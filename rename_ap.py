@@ -1,28 +1,59 @@
 from libarubacentral import ArubaCentralAuth, ArubaCentralConfig
-from sys import argv
+import argparse
 import csv
+import json
 
-session = ArubaCentralAuth(ArubaCentralConfig('Default', './config').read_config())
+tool_description = "This tool renames the APs listed in a CSV file (columns 'AP Name' and 'Serial Number' or" \
+                   " 'MAC Address') in Aruba Central"
+parser = argparse.ArgumentParser(description=tool_description, add_help=True)
+parser.add_argument("filename", help="The CSV file with the new AP names")
+parser.add_argument("-c", "--configpath", help = "The path to the configuration folder (default: ./config)")
+parser.add_argument("-P", "--profile", help="The name of the profile in the config path to use.")
+parser.add_argument("-m", "--match", help="Only rename the APs whose new name contains this text (e.g. one building)")
+parser.add_argument("-j", "--journal", help="Record every result in this file, and skip the APs it records as done,"
+                                            " so a failed run can be started again to finish it")
+parser.add_argument("-w", "--workers", type=int, help="The number of APs renamed at the same time"
+                                                      " (default: max_workers of the profile)")
+parser.add_argument("--stats", help="Write the API calls of this run per endpoint (calls, retries, status codes,"
+                                    " bytes, latency and JSON parse time) to this file as JSON")
+args = parser.parse_args()
 
-filename = argv[1]
-ap_list = list()
-with open(filename, newline='') as csvfile:
+if args.configpath:
+    config_path = args.configpath
+else:
+    config_path = './config'
+if args.profile:
+    profile = args.profile
+else:
+    profile = 'Default'
+
+session = ArubaCentralAuth(ArubaCentralConfig(profile, config_path).read_config())
+
+renames = list()
+with open(args.filename, newline='') as csvfile:
     reader = csv.DictReader(csvfile)
     for row in reader:
-        ap_list.append(row)
-result = list()
+        if args.match and args.match not in row['AP Name']:
+            continue
+        renames.append({'name': row['AP Name'], 'serial': row.get('Serial Number'),
+                        'mac': row.get('MAC Address') or row.get('MAC')})
 
-for i in ap_list:
-    #if i['Type'] != 'AP' or i['AP Name'] == 'STOCK' or i['AP Name'][:4] == 'MPHY' or i['AP Name'][:4] == 'RICK':
-    # One building only
-    if not 'RICK-e' in i['AP Name']:
-        continue
-    try:
-        session.name_ap(i['AP Name'], i['Serial Number'])
-        #print(f"Success: {i['Serial Number']} --> {i['AP Name']}")
-        print('.',  end='')
-    except RuntimeError as e:
-        #print(f"Failed: {i['Serial Number']} --> {i['AP Name']}\t{str(e)}")
-        single_line_error = str(e).replace('\n','')
-        print(f"\nFailed: {i['Serial Number']} --> {i['AP Name']}\t{single_line_error}")
+try:
+    results = session.rename_aps(renames, journal=args.journal, max_workers=args.workers)
+except RuntimeError as e:
+    single_line_error = str(e).replace('\n', '')
+    print(f"Failed: {single_line_error}")
+    exit(1)
+finally:
+    if args.stats:
+        with open(args.stats, 'w') as file:
+            json.dump(session.api_stats(), file, indent=2)
 
+counts = dict()
+for result in results:
+    counts[result['status']] = counts.get(result['status'], 0) + 1
+    if result['status'] in ('failed', 'not found'):
+        single_line_error = str(result['error']).replace('\n', '')
+        print(f"Failed: {result['serial'] or result['mac']} --> {result['name']}\t{single_line_error}")
+print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "Nothing to rename")
+exit(1 if counts.get('failed') or counts.get('not found') else 0)
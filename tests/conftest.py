@@ -0,0 +1,65 @@
+#
+# The tests run the library against benchmarks/mock_central.py, a local stand-in for Aruba Central, so they
+# need no tenant and no network.
+#
+import os
+import sys
+
+import pytest
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.join(REPO, 'benchmarks'))
+
+from bench_scripts import make_config
+from libarubacentral import ArubaCentralAuth, ArubaCentralConfig, RateLimiter
+from libarubacentral_stats import endpoint_template
+from mock_central import MockCentral
+
+
+@pytest.fixture
+def central():
+    central = MockCentral(clients=3000)
+    yield central
+    central.stop()
+
+
+@pytest.fixture
+def session_for(tmp_path):
+    # session_for(central, max_workers=1, ...): a logged in ArubaCentralAuth against a started MockCentral,
+    # with these settings in its profile
+    def session_for(central, **settings):
+        path = str(tmp_path / 'config')
+        make_config(path, central.start(), central)
+        settings = dict({'max_workers': 4, 'rate_limit_per_second': 1000}, **settings)
+        with open(path + "/config.yml", 'a') as file:
+            file.write(''.join(f"  {name}: {value}\n" for name, value in settings.items()))
+        # The rate limiters are per profile and process wide: start every test with a fresh one
+        RateLimiter._limiters.clear()
+        session = ArubaCentralAuth(ArubaCentralConfig('Default', path).read_config())
+        session.authenticate()
+        return session
+    return session_for
+
+
+@pytest.fixture
+def session(central, session_for):
+    return session_for(central)
+
+
+def fail_first(central, endpoint, status, count=1, headers=None):
+    #
+    # Answer the first count calls to endpoint ('GET /monitoring/v1/swarms', or a template like
+    # 'POST /configuration/v2/ap_settings/{serial}') with status instead of serving them, or drop their
+    # connection without an answer when status is None
+    #
+    admit = central.admit
+    failures = {'left': count}
+
+    def failing_admit(method, path):
+        result = admit(method, path)
+        if f"{method} {endpoint_template(path)}" == endpoint and failures['left'] > 0:
+            failures['left'] -= 1
+            return status, dict(result[1], **(headers or dict()))
+        return result
+    central.admit = failing_admit
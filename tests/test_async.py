@@ -0,0 +1,92 @@
+#
+# AsyncArubaCentralAuth (user-003) against the mock: paging, the shared swarm cache, retries and the bound on
+# concurrent page requests.
+#
+import asyncio
+
+import pytest
+
+from conftest import fail_first
+from libarubacentral_async import AsyncArubaCentralAuth
+from mock_central import MockCentral
+
+
+@pytest.fixture(autouse=True)
+def quick_backoff(monkeypatch):
+    from libarubacentral import ArubaCentralAuth
+    monkeypatch.setattr(ArubaCentralAuth, '_backoff_delay', staticmethod(lambda attempt: 0.01))
+
+
+def run(session, call):
+    # call(async_session) in a fresh event loop, closing the aiohttp session afterwards
+    async def main():
+        async with AsyncArubaCentralAuth(session.cfgdata, auth=session) as async_session:
+            return await call(async_session)
+    return asyncio.run(main())
+
+
+def test_get_aps_and_swarms(central, session):
+    aps, swarms = run(session, lambda s: asyncio.gather(s.get_aps(), s.get_swarms()))
+    assert len(aps) == len(central.aps)
+    assert len(swarms) == len(central.swarms)
+
+
+def test_get_aps_limit(central, session):
+    assert len(run(session, lambda s: s.get_aps(limit=5))) == 5
+
+
+def test_client_count_of_vc(central, session):
+    swarm = central.swarms[0]
+    count = run(session, lambda s: s.get_client_count(vc=swarm['name']))
+    assert count == len([client for client in central.clients if client['swarm_id'] == swarm['swarm_id']])
+    # The swarm cache filled by the async call is the synchronous session's
+    assert session.get_swarm_id(swarm['name']) == swarm['swarm_id']
+
+
+def test_pages_bounded_by_max_workers(session_for):
+    # 8 pages of APs, fetched at most 2 at a time
+    central = MockCentral(clients=2000, clients_per_swarm=1, aps_per_swarm=4, latency=0.1)
+    try:
+        session = session_for(central, max_workers=2)
+        central.max_in_flight = 0
+        assert len(run(session, lambda s: s.get_aps())) == len(central.aps)
+        assert central.max_in_flight == 2
+    finally:
+        central.stop()
+
+
+def test_retried_on_503(central, session):
+    fail_first(central, 'GET /monitoring/v1/swarms', 503)
+    assert len(run(session, lambda s: s.get_swarms())) == len(central.swarms)
+    assert central.calls['GET /monitoring/v1/swarms'] == 2
+
+
+def test_retried_on_dropped_connection(central, session):
+    # aiohttp itself resends an idempotent request once on a dropped connection, so drop two
+    fail_first(central, 'GET /monitoring/v1/swarms', None, count=2)
+    assert len(run(session, lambda s: s.get_swarms())) == len(central.swarms)
+    assert session.api_stats()['/monitoring/v1/swarms']['status'].get('error', 0) >= 1
+
+
+def test_retried_on_timeout(central, session):
+    central.latency = 0.5
+    admit = central.admit
+    calls = list()
+
+    def fast_after_first(method, path):
+        # Only the first call is slow enough to time out
+        calls.append(path)
+        if len(calls) > 1:
+            central.latency = 0.0
+        return admit(method, path)
+    central.admit = fast_after_first
+    assert run(session, lambda s: s.get_client_count(timeout=0.2)) == len(central.clients)
+    assert central.calls['GET /monitoring/v1/clients/count'] == 2
+
+
+def test_rate_limited_after_retries(central, session):
+    from libarubacentral import RateLimitError
+    fail_first(central, 'GET /monitoring/v1/swarms', 429, count=10, headers={'Retry-After': '0'})
+    with pytest.raises(RateLimitError):
+        run(session, lambda s: s.get_swarms())
+    assert central.calls['GET /monitoring/v1/swarms'] == session.http_retries + 1
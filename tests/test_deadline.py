@@ -0,0 +1,69 @@
+#
+# Deadline-aware sweeps and counts (user-024) against a slow mock: partial results with their coverage, and
+# the page budget.
+#
+import time
+
+import pytest
+
+from libarubacentral_deadline import Deadline
+from mock_central import MockCentral
+
+
+@pytest.fixture
+def slow_central():
+    # 5 pages of 1000 clients, 0.3 seconds each
+    central = MockCentral(clients=5000, latency=0.3)
+    yield central
+    central.stop()
+
+
+def test_sweep_complete(central, session):
+    sweep = session.sweep_wifi_clients(Deadline(30))
+    assert sweep.complete
+    assert sweep.coverage == 1.0
+    assert sweep.count == len(central.clients)
+
+
+def test_sweep_partial_coverage(slow_central, session_for):
+    session = session_for(slow_central, max_workers=1)
+    start = time.monotonic()
+    sweep = session.sweep_wifi_clients(Deadline(1.0))
+    assert time.monotonic() - start < 1.5
+    assert not sweep.complete
+    assert sweep.total == len(slow_central.clients)
+    assert 0 < sweep.coverage < 1
+    assert sweep.count == 1000 * len(sweep.pages)
+    assert sweep.errors
+
+
+def test_sweep_pages_get_the_page_budget(slow_central, session_for):
+    # Pages slower than http_timeout still finish within their page budget
+    session = session_for(slow_central, http_timeout=0.1)
+    sweep = session.sweep_wifi_clients(Deadline(30, page_budget=5))
+    assert sweep.complete
+    assert sweep.count == len(slow_central.clients)
+
+
+def test_sweep_page_over_budget(slow_central, session_for):
+    # A first page slower than its budget fails the sweep, instead of waiting for http_timeout
+    session = session_for(slow_central)
+    start = time.monotonic()
+    with pytest.raises(RuntimeError):
+        session.sweep_wifi_clients(Deadline(30, page_budget=0.1))
+    assert time.monotonic() - start < 2
+
+
+def test_count_partial_coverage(slow_central, session_for):
+    session = session_for(slow_central, max_workers=1)
+    counts = session.get_client_counts(method='count', kinds=('network',), deadline=Deadline(1.5))
+    assert 0 < counts['coverage'] < 1
+    assert 0 < len(counts['network']) < len(slow_central.networks)
+    for network, count in counts['network'].items():
+        assert count == len([client for client in slow_central.clients if client['network'] == network])
+
+
+def test_count_nothing_answered(slow_central, session_for):
+    session = session_for(slow_central)
+    with pytest.raises(RuntimeError):
+        session.get_client_counts(method='count', kinds=('network',), deadline=Deadline(0.01))
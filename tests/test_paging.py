@@ -0,0 +1,47 @@
+#
+# Paging through every AP and swarm (user-018): the first page asks for the total, so the others are fetched
+# in parallel.
+#
+import pytest
+
+from mock_central import MockCentral
+
+
+@pytest.fixture
+def large_central():
+    # 3000 swarms and 6000 APs, so 3 pages of swarms and 6 of APs
+    central = MockCentral(clients=3000, clients_per_swarm=1, aps_per_swarm=2, latency=0.2)
+    yield central
+    central.stop()
+
+
+def test_aps_fetched_in_parallel(large_central, session_for):
+    session = session_for(large_central, max_workers=4)
+    large_central.max_in_flight = 0
+    aps = [ap for page in session.iter_all_aps() for ap in page]
+    assert len(aps) == len(large_central.aps)
+    assert len({ap['serial'] for ap in aps}) == len(aps)
+    assert large_central.max_in_flight > 1
+
+
+def test_get_aps_fetched_in_parallel(large_central, session_for):
+    session = session_for(large_central, max_workers=4)
+    large_central.max_in_flight = 0
+    assert len(session.get_aps()) == len(large_central.aps)
+    assert large_central.max_in_flight > 1
+
+
+def test_get_aps_limit_fetches_only_its_pages(large_central, session_for):
+    session = session_for(large_central)
+    calls = large_central.calls['GET /monitoring/v1/aps']
+    assert len(session.get_aps(limit=1500)) == 1500
+    assert large_central.calls['GET /monitoring/v1/aps'] - calls == 2
+
+
+def test_swarms_fetched_in_parallel(large_central, session_for):
+    session = session_for(large_central)
+    large_central.max_in_flight = 0
+    swarms = session.get_swarms()
+    assert len(swarms) == len(large_central.swarms)
+    assert large_central.max_in_flight > 1
+    assert session.get_swarm_id(large_central.swarms[-1]['name']) == large_central.swarms[-1]['swarm_id']
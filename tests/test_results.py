@@ -0,0 +1,29 @@
+#
+# Stored check results (user-023): a foreground check and its background refresh can write the same result
+# at once.
+#
+import os
+import threading
+
+from libarubacentral_results import CheckResultStore
+
+
+def test_concurrent_puts(tmp_path):
+    store = CheckResultStore(str(tmp_path))
+    key = store.key('Default', 'vc-1', None, None, None)
+    errors = list()
+
+    def writer(down):
+        try:
+            for _ in range(200):
+                store.put(key, {'down': down, 'total': 10})
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=writer, args=(down,)) for down in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert store.get(key)['down'] in range(4)
+    assert os.listdir(tmp_path) == [f"{key}.json"]
@@ -0,0 +1,54 @@
+#
+# Rate limiting and retries of ArubaCentralAuth._send (user-007) against the mock: 429s with Retry-After, 5xx
+# retried for GETs only.
+#
+import time
+
+import pytest
+
+from conftest import fail_first
+
+
+@pytest.fixture(autouse=True)
+def quick_backoff(monkeypatch):
+    from libarubacentral import ArubaCentralAuth
+    monkeypatch.setattr(ArubaCentralAuth, '_backoff_delay', staticmethod(lambda attempt: 0.01))
+
+
+def test_get_retried_on_503(central, session):
+    fail_first(central, 'GET /monitoring/v1/swarms', 503, count=2)
+    assert len(session.get_swarms()) == len(central.swarms)
+    assert central.calls['GET /monitoring/v1/swarms'] == 3
+    assert session.api_stats()['/monitoring/v1/swarms']['retries'] == 2
+
+
+def test_get_gives_up_after_http_retries(central, session):
+    fail_first(central, 'GET /monitoring/v1/swarms', 503, count=10)
+    with pytest.raises(RuntimeError):
+        session.get_swarms()
+    assert central.calls['GET /monitoring/v1/swarms'] == session.http_retries + 1
+
+
+def test_429_waits_for_retry_after(central, session):
+    fail_first(central, 'GET /monitoring/v1/swarms', 429, headers={'Retry-After': '1'})
+    start = time.monotonic()
+    session.get_swarms()
+    assert time.monotonic() - start >= 0.9
+    assert central.calls['GET /monitoring/v1/swarms'] == 2
+
+
+def test_post_not_retried_on_503(central, session):
+    serial = central.aps[0]['serial']
+    fail_first(central, 'POST /configuration/v2/ap_settings/{serial}', 503)
+    with pytest.raises(RuntimeError):
+        session.name_ap('renamed', serial=serial)
+    assert central.calls['POST /configuration/v2/ap_settings/{serial}'] == 1
+    assert serial not in central.ap_settings
+
+
+def test_post_retried_on_429(central, session):
+    serial = central.aps[0]['serial']
+    fail_first(central, 'POST /configuration/v2/ap_settings/{serial}', 429, headers={'Retry-After': '0'})
+    session.name_ap('renamed', serial=serial)
+    assert central.calls['POST /configuration/v2/ap_settings/{serial}'] == 2
+    assert central.ap_settings[serial]['hostname'] == 'renamed'
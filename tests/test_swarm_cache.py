@@ -0,0 +1,37 @@
+#
+# The swarm name to ID cache (user-004): a VC added after the cache was filled is found without waiting for
+# swarm_cache_ttl, at the cost of one more /swarms call.
+#
+import pytest
+
+
+def add_swarm(central, name):
+    swarm = dict(central.swarms[0], swarm_id='f' * 32, name=name)
+    central.swarms.append(swarm)
+    central._selections.clear()
+    return swarm
+
+
+def test_cached_lookup(central, session):
+    swarm = central.swarms[3]
+    session.get_swarm_id(swarm['name'])
+    calls = central.calls['GET /monitoring/v1/swarms']
+    assert session.get_swarm_id(swarm['name'].lower()) == swarm['swarm_id']
+    assert central.calls['GET /monitoring/v1/swarms'] == calls
+
+
+def test_new_vc_found_before_the_cache_expires(central, session):
+    session.get_swarm_id(central.swarms[0]['name'])
+    swarm = add_swarm(central, 'Added-VC')
+    calls = central.calls['GET /monitoring/v1/swarms']
+    assert session.get_swarm_id('Added-VC') == swarm['swarm_id']
+    assert central.calls['GET /monitoring/v1/swarms'] == calls + 1
+
+
+def test_unknown_vc_fetched_again_once(central, session):
+    session.get_swarm_id(central.swarms[0]['name'])
+    calls = central.calls['GET /monitoring/v1/swarms']
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            session.get_swarm_id('No-Such-VC')
+    assert central.calls['GET /monitoring/v1/swarms'] == calls + 1
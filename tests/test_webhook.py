@@ -0,0 +1,103 @@
+#
+# The webhook receiver (user-025): signatures, duplicate and failed deliveries, and syncs racing alerts.
+#
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from libarubacentral_aggregate import ap_counts
+from libarubacentral_webhook import ApStatusMap, WebhookServer, ap_event, central_signature
+
+TOKEN = 'webhook-token'
+
+
+@pytest.fixture
+def status_map(central, session):
+    status_map = ApStatusMap()
+    status_map.sync(ap for page in session.iter_all_aps() for ap in page)
+    return status_map
+
+
+@pytest.fixture
+def webhook(status_map):
+    # (url, server, the alerts applied); on_alert fails for alerts with 'fail' set
+    applied = list()
+
+    def on_alert(alert):
+        if alert.get('fail'):
+            raise RuntimeError("submit failed")
+        serial, down = ap_event(alert)
+        status_map.set_down(serial, down)
+        applied.append(alert)
+    server = WebhookServer(('127.0.0.1', 0), TOKEN, status_map, on_alert)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", server, applied
+    server.shutdown()
+    server.server_close()
+
+
+def deliver(url, alert, delivery, token=TOKEN, delivered=None):
+    body = json.dumps(alert).encode()
+    headers = {'X-Central-Service': 'wellness', 'X-Central-Delivery-ID': delivery,
+               'X-Central-Delivery-Timestamp': str(int(delivered or time.time()))}
+    headers['X-Central-Signature'] = central_signature(token, body, headers)
+    return requests.post(url + '/', data=body, headers=headers, timeout=5)
+
+
+def down_alert(ap, **fields):
+    return dict({'alert_type': 'AP disconnected', 'device_id': ap['serial'], 'state': 'Open'}, **fields)
+
+
+def test_bad_signature_rejected(central, webhook, status_map):
+    url, server, applied = webhook
+    assert deliver(url, down_alert(central.aps[0]), 'd1', token='wrong').status_code == 401
+    assert not applied
+    assert server.counters()['rejected'] == 1
+    assert status_map.aps[central.aps[0]['serial']][2] is False
+
+
+def test_replayed_delivery_rejected(central, webhook, status_map):
+    # Validly signed, but an hour old
+    url, server, applied = webhook
+    assert deliver(url, down_alert(central.aps[0]), 'd1', delivered=time.time() - 3600).status_code == 401
+    assert not applied
+    assert server.counters()['rejected'] == 1
+
+
+def test_duplicate_applied_once(central, webhook, status_map):
+    url, server, applied = webhook
+    ap = central.aps[0]
+    assert deliver(url, down_alert(ap), 'd1').status_code == 200
+    assert deliver(url, down_alert(ap), 'd1').status_code == 200
+    assert len(applied) == 1
+    assert server.counters()['duplicates'] == 1
+    assert ap_counts(status_map.counts(), swarm_id=ap['swarm_id'])['down'] == 1
+
+
+def test_failed_alert_applied_on_retry(central, webhook, status_map):
+    url, server, applied = webhook
+    ap = central.aps[0]
+    alert = down_alert(ap, fail=True)
+    assert deliver(url, alert, 'd1').status_code == 500
+    assert server.counters()['errors'] == 1
+    # Central retries the same delivery
+    assert deliver(url, down_alert(ap), 'd1').status_code == 200
+    assert len(applied) == 1
+    assert server.counters()['duplicates'] == 0
+    assert status_map.aps[ap['serial']][2] is True
+
+
+def test_sync_keeps_alerts_newer_than_its_sweep(central, session, status_map):
+    ap = central.aps[0]
+    started = time.time()
+    aps = [ap for page in session.iter_all_aps() for ap in page]
+    assert status_map.set_down(ap['serial'], True) == (ap['swarm_id'], ap['group_name'])
+    # The sweep read the AP before it went down
+    status_map.sync(aps, started=started)
+    assert status_map.aps[ap['serial']][2] is True
+    # A later sweep that still has it up wins
+    assert status_map.sync(aps) == {(ap['swarm_id'], ap['group_name'])}
+    assert status_map.aps[ap['serial']][2] is False